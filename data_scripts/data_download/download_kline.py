@@ -1,16 +1,33 @@
 import os
+import time
 import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 import pandas as pd
-import zipfile
 import argparse
+from ingest_kline import ingest, read_checksum, STORE_FOLDER
+from manifest import Manifest, MANIFEST
 
 # Config
 PATH = 'https://data.binance.vision/data/futures/um/daily/klines/'
 CHECKSUM = '.CHECKSUM'
-CHUNK_SIZE = 128
+PART = '.part'
+CHUNK_SIZE = 1024 * 1024
+WORKERS = 8
+RETRIES = 4
+# downloads that completed with a wrong checksum are fetched again this many times,
+# transport errors are retried inside download()
+MISMATCH_RETRIES = 1
+BACKOFF = 0.5
+TIMEOUT = 30
+DOWNLOAD_FOLDER = 'kline_data_{}/download/{}'
+
+# one keep-alive session per worker thread
+_local = threading.local()
 
 # utility
 
@@ -19,6 +36,20 @@ def make_path(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
+def get_session():
+    '''
+    Return the pooled HTTP session of the calling thread, creating it on first use
+    '''
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+
 def checksum(file):
     '''
     Using sha256 to calculate the checksum of a file
@@ -41,115 +72,177 @@ def checksum(file):
     return calculated_checksum == valid_checksum
 
 
-def unzip_file(file, save_path):
+def verified(file, manifest=None):
     '''
-    Unzip a file to a folder
+    Check a file against its checksum, files recorded in the manifest are not read again
+    Returns: True if a file and its checksum are on disk and match, False otherwise
     '''
-    with zipfile.ZipFile(file, 'r') as zip_ref:
-        zip_ref.extractall(save_path)
-        print('{} has been unzipped'.format(file))
-
+    if manifest is not None and manifest.lookup(file):
+        return True
+    if not (os.path.exists(file) and os.path.exists(file+CHECKSUM)):
+        return False
+    try:
+        valid = checksum(file)
+    except (OSError, IndexError):
+        return False
+    if valid and manifest is not None:
+        manifest.add(file, read_checksum(file))
+    return valid
 
-def unzip_files(src_path, save_path):
-    '''
-    Unzip all files in a folder to a folder
-    '''
-    for file in os.listdir(src_path):
-        if file.endswith('.zip'):
-            try:
-                unzip_file(os.path.join(src_path, file), save_path)
-                print('{} has been unzipped'.format(file))
-            except:
-                print('{} unzip fail'.format(file))
 
 # download
 
 
-def data_download(symbol, date, interval, save_path, chunk_size=CHUNK_SIZE):
+def data_download(symbol, date, interval, save_path, chunk_size=CHUNK_SIZE, base_url=PATH, session=None, retries=RETRIES, manifest=None):
     '''
-    Download a file from binance.vision
+    Download a file from binance.vision, skipping it if a verified copy is already on disk
+    The archive is hashed while it streams, so it is never read back to verify it
     Returns: True if the download is successful, False otherwise
     '''
     filename = '{}-{}-{}.zip'.format(symbol, interval, date)
-    path = PATH + symbol + '/' + interval + '/' + filename
+    path = base_url + symbol + '/' + interval + '/' + filename
     checksum_path = path + CHECKSUM
 
     data_save_path = os.path.join(save_path, filename)
     checksum_save_path = data_save_path + CHECKSUM
 
-    download(path, data_save_path, chunk_size)
-    download(checksum_path, checksum_save_path, chunk_size)
+    if verified(data_save_path, manifest):
+        return True
 
-    return checksum(data_save_path)
+    if not download(checksum_path, checksum_save_path, chunk_size, session, retries):
+        return False
+    valid_checksum = read_checksum(data_save_path)
+    for attempt in range(MISMATCH_RETRIES + 1):
+        calculated_checksum = download(path, data_save_path, chunk_size, session, retries)
+        if not calculated_checksum:
+            return False
+        if calculated_checksum == valid_checksum:
+            if manifest is not None:
+                manifest.add(data_save_path, calculated_checksum)
+            return True
+        print('{} checksum mismatch'.format(filename))
+    return False
+
+
+def download(url, save_path, chunk_size=CHUNK_SIZE, session=None, retries=0):
+    '''
+    Download a file from a url, retrying with exponential backoff
+    The file is streamed to a temporary path and only renamed into place once complete
+    Returns: the sha256 of the file if the download is successful, False otherwise
+    '''
+    session = session or get_session()
+    part_path = save_path + PART
+    for attempt in range(retries + 1):
+        try:
+            sha256_hash = hashlib.sha256()
+            with session.get(url, stream=True, timeout=TIMEOUT) as r:
+                if r.status_code == 404:
+                    print('{} not found'.format(url))
+                    return False
+                r.raise_for_status()
+                with open(part_path, 'wb') as fd:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        sha256_hash.update(chunk)
+                        fd.write(chunk)
+            os.replace(part_path, save_path)
+            return sha256_hash.hexdigest()
+        except (requests.RequestException, OSError):
+            if attempt < retries:
+                time.sleep(BACKOFF * 2 ** attempt)
+    print('{} download fail'.format(url))
+    return False
+
+
+def download_job(job, folder=DOWNLOAD_FOLDER, chunk_size=CHUNK_SIZE, base_url=PATH, retries=RETRIES, manifest=None):
+    '''
+    Download one (symbol, interval, date) job on the calling worker thread
+    Returns: True if the download is successful, False otherwise
+    '''
+    symbol, interval, date = job
+    save_path = folder.format(interval, symbol)
+    make_path(save_path)
+    return data_download(symbol, date, interval, save_path, chunk_size, base_url, get_session(), retries, manifest)
 
 
-def download(url, save_path, chunk_size=CHUNK_SIZE):
+def parallel_download(jobs, folder=DOWNLOAD_FOLDER, workers=WORKERS, chunk_size=CHUNK_SIZE, base_url=PATH, retries=RETRIES, manifest=None):
     '''
-    Download a file from a url
+    Download (symbol, interval, date) jobs over a bounded pool of worker threads
+    Returns: dict of job -> True if the download is successful, False otherwise
     '''
-    try:
-        r = requests.get(url, stream=True)
-        with open(save_path, 'wb') as fd:
-            for chunk in r.iter_content(chunk_size=chunk_size):
-                fd.write(chunk)
-        return True
-    except:
-        print('{} download fail'.format(url))
-        return False
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(download_job, job, folder, chunk_size, base_url, retries, manifest): job
+                   for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                results[job] = future.result()
+            except Exception as e:
+                print('{}-{}-{} download error: {}'.format(*job, e))
+                results[job] = False
+            if results[job]:
+                print('{}-{}-{} download success'.format(*job))
+            else:
+                print('{}-{}-{} download fail'.format(*job))
+    return results
 
 # main fucntion
 
 
-def main(symbol, dates, interval, download_folder, unzip_folder, chunk_size=CHUNK_SIZE):
+def main(symbols, dates, interval, workers=WORKERS, chunk_size=CHUNK_SIZE, base_url=PATH, store=STORE_FOLDER):
     '''
-    Download and unzip all files for a symbol and interval
+    Download all files for a list of symbols and an interval and ingest them into the columnar store
     '''
-    make_path(download_folder)
-    print('Downloading {} for {}'.format(symbol, interval))
-    for date in dates:
-        if unzip_file:
-            unzip_files(download_folder, download_folder)
-        if data_download(symbol, date, interval, download_folder, chunk_size):
-            print('{}-{}-{} download success'.format(symbol, interval, date))
-        else:
-            print('{}-{}-{} download fail'.format(symbol, interval, date))
-
-    print('Unzipping {} for {}'.format(symbol, interval))
-    unzip_files(download_folder, unzip_folder)
+    print('Downloading {} for {}'.format(','.join(symbols), interval))
+    jobs = [(symbol, interval, date) for symbol in symbols for date in dates]
+    manifest = Manifest(MANIFEST)
+    results = parallel_download(jobs, DOWNLOAD_FOLDER, workers, chunk_size, base_url, manifest=manifest)
+    manifest.compact()
+
+    print('Ingesting {} for {}'.format(','.join(symbols), interval))
+    archives = [os.path.join(DOWNLOAD_FOLDER.format(interval, symbol), '{}-{}-{}.zip'.format(symbol, interval, date))
+                for (symbol, interval, date), ok in results.items() if ok]
+    ingest(archives, store)
     print('Program finished')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(allow_abbrev=False)
     parser.add_argument(
-        "--symbol", help="The symbol + coin type, e.g. ETHUSDT", type=str, required=True)
+        "--symbol", help="The symbol + coin type, comma separated for several, e.g. ETHUSDT,BTCUSDT", type=str, required=True)
     parser.add_argument(
         "--start", help="The start date to download, e.g. 01-01-2022", type=str, required=True)
     parser.add_argument(
         "--end", help="The end date to download, e.g. 01-01-2022", type=str, required=True)
     parser.add_argument(
         "--interval", help="The interval to download, e.g. 1m", type=str, required=False)
+    parser.add_argument(
+        "--workers", help="The number of concurrent downloads, e.g. 8", type=int, required=False)
+    parser.add_argument(
+        "--store", help="The root folder of the columnar store, e.g. kline_store", type=str, required=False)
 
     # init
-    symbol = ''
+    symbols = []
     start = ''
     end = ''
     interval = '1m'
+    workers = WORKERS
+    store = STORE_FOLDER
 
     # parse
     args = parser.parse_args()
     if args.symbol:
-        symbol = args.symbol
+        symbols = args.symbol.split(',')
     if args.start:
         start = args.start
     if args.end:
         end = args.end
     if args.interval:
         interval = args.interval
-
-    # folders
-    download_folder = 'kline_data_{}/download/{}'.format(interval, symbol)
-    unzip_folder = 'kline_data_{}/unzip/{}'.format(interval, symbol)
+    if args.workers:
+        workers = args.workers
+    if args.store:
+        store = args.store
 
     # dates
     start_date = datetime.strptime(start, '%d-%m-%Y')
@@ -159,4 +252,4 @@ if __name__ == '__main__':
              for x in range((end_date - start_date).days + 1)]
     datas = [date.strftime('%Y-%m-%d') for date in dates]
 
-    main(symbol, datas, interval, download_folder, unzip_folder)
+    main(symbols, datas, interval, workers, store=store)
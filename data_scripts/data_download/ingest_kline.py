@@ -0,0 +1,217 @@
+import os
+import json
+import shutil
+import zipfile
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# Config
+STORE_FOLDER = 'kline_store'
+CHECKSUM = '.CHECKSUM'
+SOURCES = '_sources.json'
+TMP = '.tmp'
+OLD = '.old'
+
+# binance kline csv layout, the trailing 'ignore' column is dropped
+COLUMNS = [
+    ('open_time', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+    ('close_time', np.int64),
+    ('quote_volume', np.float64),
+    ('count', np.int64),
+    ('taker_buy_volume', np.float64),
+    ('taker_buy_quote_volume', np.float64),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+HEADER = b'open_time'
+
+# utility
+
+
+def make_path(path):
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+
+def archive_key(file):
+    '''
+    Split an archive name like ETHUSDT-1m-2022-01-01.zip into its parts
+    Returns: (symbol, interval, date)
+    '''
+    name = os.path.basename(file)[:-len('.zip')]
+    symbol, interval, year, month, day = name.rsplit('-', 4)
+    return symbol, interval, '{}-{}-{}'.format(year, month, day)
+
+
+def partition_path(root, symbol, interval, month):
+    '''
+    Folder of the columns of one symbol/interval/month partition, month as YYYY-MM
+    '''
+    return os.path.join(root, symbol, interval, month)
+
+
+def read_checksum(file):
+    '''
+    Returns: the published sha256 of an archive, None if there is no checksum file
+    '''
+    try:
+        with open(file+CHECKSUM) as f:
+            return f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def read_sources(path):
+    '''
+    Returns: dict of archive name -> sha256 of the archives already in a partition
+    '''
+    try:
+        with open(os.path.join(path, SOURCES)) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+def recover_partition(path):
+    '''
+    Put back a partition left half swapped by an interrupted write
+    '''
+    if not os.path.exists(path) and os.path.exists(path+OLD):
+        os.replace(path+OLD, path)
+    if os.path.exists(path+OLD):
+        shutil.rmtree(path+OLD)
+    if os.path.exists(path+TMP):
+        shutil.rmtree(path+TMP)
+
+# ingestion
+
+
+def parse_archive(file):
+    '''
+    Stream the csv inside a kline archive straight into typed arrays, nothing is extracted to disk
+    Returns: dict of column name -> numpy array
+    '''
+    with zipfile.ZipFile(file, 'r') as zip_ref:
+        member = zip_ref.namelist()[0]
+        with zip_ref.open(member) as f:
+            skip = 1 if f.peek(len(HEADER))[:len(HEADER)] == HEADER else 0
+            frame = pd.read_csv(f, header=None, skiprows=skip, usecols=range(len(COLUMNS)),
+                                names=COLUMN_NAMES, dtype=dict(COLUMNS), engine='c')
+    return {name: frame[name].to_numpy(dtype=dtype) for name, dtype in COLUMNS}
+
+
+def load_partition(path):
+    '''
+    Returns: dict of column name -> numpy array of a stored partition, empty arrays if it does not exist
+    '''
+    if not os.path.exists(os.path.join(path, COLUMN_NAMES[0] + '.npy')):
+        return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+    return {name: np.load(os.path.join(path, name + '.npy')) for name in COLUMN_NAMES}
+
+
+def write_partition(path, columns, sources):
+    '''
+    Write a partition to a temporary folder and swap it in place of the old one
+    '''
+    tmp_path = path + TMP
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    make_path(tmp_path)
+    for name in COLUMN_NAMES:
+        np.save(os.path.join(tmp_path, name + '.npy'), columns[name])
+    with open(os.path.join(tmp_path, SOURCES), 'w') as f:
+        json.dump(sources, f, sort_keys=True)
+
+    if os.path.exists(path):
+        os.replace(path, path+OLD)
+    os.replace(tmp_path, path)
+    if os.path.exists(path+OLD):
+        shutil.rmtree(path+OLD)
+
+
+def merge_columns(parts):
+    '''
+    Concatenate column dicts and sort them by open time, later parts win on duplicated open times
+    Returns: dict of column name -> numpy array
+    '''
+    merged = {name: np.concatenate([part[name] for part in parts]) for name in COLUMN_NAMES}
+    open_time = merged['open_time']
+    order = np.argsort(open_time, kind='stable')
+    sorted_time = open_time[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[:-1] = sorted_time[1:] != sorted_time[:-1]
+    order = order[keep]
+    return {name: column[order] for name, column in merged.items()}
+
+
+def ingest_partition(path, archives):
+    '''
+    Merge archives into one partition, skipping archives it already holds with the same checksum
+    Returns: the number of archives ingested
+    '''
+    recover_partition(path)
+    sources = read_sources(path)
+    new = []
+    for file in archives:
+        name = os.path.basename(file)
+        sha = read_checksum(file)
+        if name in sources and sources[name] == sha:
+            continue
+        try:
+            new.append(parse_archive(file))
+        except (zipfile.BadZipFile, ValueError, OSError) as e:
+            print('{} ingest fail: {}'.format(name, e))
+            continue
+        sources[name] = sha
+    if not new:
+        return 0
+    columns = merge_columns([load_partition(path)] + new)
+    write_partition(path, columns, sources)
+    return len(new)
+
+
+def ingest(archives, root=STORE_FOLDER):
+    '''
+    Ingest kline archives into the columnar store, each partition is read and written once
+    Returns: the number of archives ingested
+    '''
+    partitions = {}
+    for file in archives:
+        symbol, interval, date = archive_key(file)
+        path = partition_path(root, symbol, interval, date[:7])
+        partitions.setdefault(path, []).append(file)
+
+    count = 0
+    for path, files in sorted(partitions.items()):
+        added = ingest_partition(path, sorted(files))
+        if added:
+            print('{} archives ingested into {}'.format(added, path))
+        count += added
+    return count
+
+
+def ingest_folder(src_path, root=STORE_FOLDER):
+    '''
+    Ingest every archive of a download folder into the columnar store
+    Returns: the number of archives ingested
+    '''
+    archives = [os.path.join(src_path, file) for file in sorted(os.listdir(src_path))
+                if file.endswith('.zip')]
+    return ingest(archives, root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "--src", help="The download folder holding the zip archives", type=str, required=True)
+    parser.add_argument(
+        "--store", help="The root folder of the columnar store", type=str, required=False)
+
+    args = parser.parse_args()
+    root = args.store if args.store else STORE_FOLDER
+    print('{} archives ingested'.format(ingest_folder(args.src, root)))
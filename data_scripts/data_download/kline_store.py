@@ -0,0 +1,130 @@
+import os
+import bisect
+import numpy as np
+from datetime import datetime, timezone
+from ingest_kline import STORE_FOLDER, COLUMNS, COLUMN_NAMES, TMP, OLD, partition_path
+
+# Config
+OHLCV = ['open_time', 'open', 'high', 'low', 'close', 'volume']
+TIME_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S']
+
+# utility
+
+
+def to_ms(value):
+    '''
+    Convert None, epoch milliseconds, a datetime or a date string (UTC) to epoch milliseconds
+    '''
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, str):
+        for time_format in TIME_FORMATS:
+            try:
+                value = datetime.strptime(value, time_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError('Unknown time format: {}'.format(value))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def to_month(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime('%Y-%m')
+
+# store
+
+
+class KlineStore:
+    '''
+    Read-only view of the columnar kline store
+    Columns are memory mapped, so every process reading the same partition shares the page cache
+    '''
+
+    def __init__(self, root=STORE_FOLDER):
+        self.root = root
+        self.months = {}
+        self.partitions = {}
+
+    def refresh(self):
+        '''
+        Forget cached listings and maps, needed to see partitions written after they were opened
+        '''
+        self.months = {}
+        self.partitions = {}
+
+    def get_months(self, symbol, interval):
+        '''
+        Returns: the sorted YYYY-MM partitions of a symbol and interval
+        '''
+        key = (symbol, interval)
+        if key not in self.months:
+            path = os.path.join(self.root, symbol, interval)
+            months = []
+            if os.path.isdir(path):
+                months = sorted(month for month in os.listdir(path)
+                                if not month.endswith(TMP) and not month.endswith(OLD))
+            self.months[key] = months
+        return self.months[key]
+
+    def get_partition(self, symbol, interval, month):
+        '''
+        Returns: dict of column name -> read-only memory mapped array of a partition
+        '''
+        path = partition_path(self.root, symbol, interval, month)
+        if path not in self.partitions:
+            self.partitions[path] = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                                     for name in COLUMN_NAMES}
+        return self.partitions[path]
+
+    def load_chunks(self, symbol, interval, start=None, end=None, columns=OHLCV):
+        '''
+        Yield one dict of column name -> zero-copy view per partition overlapping [start, end)
+        Partitions are found by bisecting the month index and rows by bisecting the open time column
+        '''
+        start, end = to_ms(start), to_ms(end)
+        months = self.get_months(symbol, interval)
+        first = 0 if start is None else bisect.bisect_left(months, to_month(start))
+        last = len(months) if end is None else bisect.bisect_right(months, to_month(end - 1))
+        for month in months[first:last]:
+            partition = self.get_partition(symbol, interval, month)
+            open_time = partition['open_time']
+            lo = 0 if start is None else int(np.searchsorted(open_time, start, 'left'))
+            hi = len(open_time) if end is None else int(np.searchsorted(open_time, end, 'left'))
+            if lo < hi:
+                yield {name: partition[name][lo:hi] for name in columns}
+
+    def load(self, symbol, interval, start=None, end=None, columns=OHLCV):
+        '''
+        Load the rows with open time in [start, end)
+        Returns: dict of column name -> array, a zero-copy view when the range sits in one partition
+        '''
+        chunks = list(self.load_chunks(symbol, interval, start, end, columns))
+        if len(chunks) == 1:
+            return chunks[0]
+        if not chunks:
+            dtypes = dict(COLUMNS)
+            return {name: np.empty(0, dtype=dtypes[name]) for name in columns}
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in columns}
+
+
+_stores = {}
+
+
+def get_store(root=STORE_FOLDER):
+    '''
+    Returns: the shared KlineStore of a root folder
+    '''
+    if root not in _stores:
+        _stores[root] = KlineStore(root)
+    return _stores[root]
+
+
+def load(symbol, interval, start=None, end=None, columns=OHLCV, root=STORE_FOLDER):
+    '''
+    Load the klines of a symbol and interval with open time in [start, end)
+    Returns: dict of column name -> array
+    '''
+    return get_store(root).load(symbol, interval, start, end, columns)
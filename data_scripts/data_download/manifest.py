@@ -0,0 +1,74 @@
+import os
+import json
+import threading
+
+# Config
+MANIFEST = 'kline_data_manifest.jsonl'
+
+
+class Manifest:
+    '''
+    Persistent record of verified files: path, size, mtime and sha256
+    A file whose size and mtime still match its entry is trusted without reading it again
+    Entries are appended as json lines, the latest line of a path wins
+    '''
+
+    def __init__(self, file=MANIFEST):
+        self.file = file
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.file):
+            return
+        with open(self.file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn last line of an interrupted run
+                    continue
+                self.entries[entry['path']] = entry
+
+    def lookup(self, path):
+        '''
+        Returns: the sha256 of a file if its entry still matches it on disk, None otherwise
+        '''
+        path = os.path.normpath(path)
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime']:
+            return None
+        return entry['sha256']
+
+    def add(self, path, sha256):
+        '''
+        Record a file as verified with its current size and mtime
+        '''
+        path = os.path.normpath(path)
+        stat = os.stat(path)
+        entry = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha256}
+        with self.lock:
+            self.entries[path] = entry
+            with open(self.file, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def compact(self):
+        '''
+        Rewrite the manifest with one line per file still on disk
+        '''
+        with self.lock:
+            self.entries = {path: entry for path, entry in self.entries.items()
+                            if os.path.exists(path)}
+            tmp_file = self.file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_file, self.file)
@@ -0,0 +1,383 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import numpy as np
+from ingest_kline import (STORE_FOLDER, COLUMNS, COLUMN_NAMES, SOURCES, make_path, partition_path,
+                          read_sources, write_partition)
+from kline_store import get_store, OHLCV
+
+# Config
+BAR_FOLDER = 'bar_store'
+CACHE = '_cache.json'
+# rows reduced at a time, bounds memory whatever the date range
+CHUNK_ROWS = 1 << 20
+TICKS = 'ticks'
+RECORDER_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'livebot')
+RECORD_FOLDER = os.path.join(RECORDER_MODULE, 'recordings')
+UNIT_MS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+DAY_MS = UNIT_MS['d']
+
+TIME = 'time'
+VOLUME = 'volume'
+DOLLAR = 'dollar'
+# column an event bar accumulates to its threshold
+EVENT_COLUMN = {VOLUME: 'volume', DOLLAR: 'quote_volume'}
+SUM_COLUMNS = ['volume', 'quote_volume', 'count', 'taker_buy_volume', 'taker_buy_quote_volume']
+
+# bars
+
+
+class BarSpec:
+    '''
+    A bar definition: '5m' or '1h' time bars, 'volume:1000' or 'dollar:5e6' event bars
+    Time bars must divide a day, so no bar crosses a month partition, and be a multiple of
+    the interval they are built from
+    '''
+
+    def __init__(self, spec):
+        self.spec = spec
+        if ':' in spec:
+            kind, size = spec.split(':')
+            if kind not in EVENT_COLUMN:
+                raise ValueError('Unknown bar type: {}'.format(spec))
+            self.kind = kind
+            self.size = float(size)
+            if self.size <= 0:
+                raise ValueError('Bar threshold must be positive: {}'.format(spec))
+        else:
+            if spec[-1:] not in UNIT_MS or not spec[:-1].isdigit():
+                raise ValueError('Unknown bar interval: {}'.format(spec))
+            self.kind = TIME
+            self.size = int(spec[:-1]) * UNIT_MS[spec[-1]]
+            if not self.size or DAY_MS % self.size:
+                raise ValueError('Time bars must divide a day: {}'.format(spec))
+
+    def name(self, source):
+        '''
+        Returns: the interval folder of these bars built from source, e.g. 1m_5m or ticks_volume_1000
+        '''
+        return '{}_{}'.format(source, self.spec.replace(':', '_'))
+
+    def bar_ids(self, columns, cum):
+        '''
+        Returns: (non decreasing bar id per row, cumulative volume after the rows)
+        An event bar takes every row that starts while the running total is within its threshold
+        '''
+        if self.kind == TIME:
+            return columns['open_time'] // self.size, cum
+        values = columns[EVENT_COLUMN[self.kind]]
+        after = np.cumsum(values) + cum
+        return np.floor((after - values) / self.size).astype(np.int64), float(after[-1])
+
+
+def reduce_bars(columns, ids, spec):
+    '''
+    Vectorized group reduction of rows sorted by bar id
+    Returns: dict of column name -> array, one row per bar
+    '''
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(ids)] - 1
+    bars = {
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+    }
+    for name in SUM_COLUMNS:
+        bars[name] = np.add.reduceat(columns[name], starts)
+    if spec.kind == TIME:
+        bars['open_time'] = ids[starts] * spec.size
+        bars['close_time'] = bars['open_time'] + spec.size - 1
+    else:
+        bars['open_time'] = columns['open_time'][starts]
+        bars['close_time'] = columns['close_time'][ends]
+    return {name: bars[name].astype(dtype, copy=False) for name, dtype in COLUMNS}
+
+
+def resample_chunks(chunks, spec):
+    '''
+    Stream bars out of row chunks, the rows of the last open bar are carried into the next chunk
+    A trailing time bar is emitted as it is, a trailing event bar below its threshold is not
+    Yield: dict of column name -> array per chunk
+    '''
+    pending = None
+    cum = 0.0
+    for chunk in chunks:
+        if not len(chunk['open_time']):
+            continue
+        if pending is not None:
+            chunk = {name: np.concatenate([pending[name], chunk[name]]) for name in COLUMN_NAMES}
+        ids, after = spec.bar_ids(chunk, cum)
+        last = int(np.searchsorted(ids, ids[-1], 'left'))
+        pending = {name: chunk[name][last:] for name in COLUMN_NAMES}
+        if spec.kind != TIME:
+            # running total before the carried rows, they are counted again with the next chunk
+            cum = after - float(np.sum(pending[EVENT_COLUMN[spec.kind]]))
+        if last:
+            yield reduce_bars({name: chunk[name][:last] for name in COLUMN_NAMES}, ids[:last], spec)
+    if pending is not None:
+        ids, after = spec.bar_ids(pending, cum)
+        if spec.kind == TIME or after >= (ids[-1] + 1) * spec.size:
+            yield reduce_bars(pending, ids, spec)
+
+
+def month_of(open_time):
+    return open_time.astype('datetime64[ms]').astype('datetime64[M]').astype(str)
+
+
+def split_months(bars):
+    '''
+    Yield (YYYY-MM, dict of column name -> array) runs of bars by open time month
+    '''
+    months = month_of(bars['open_time'])
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    ends = np.r_[starts[1:], len(months)]
+    for start, end in zip(starts, ends):
+        yield str(months[start]), {name: column[start:end] for name, column in bars.items()}
+
+# sources
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def slices(columns, chunk_rows=CHUNK_ROWS):
+    '''
+    Cut a dict of columns into chunks of at most chunk_rows, views only
+    '''
+    rows = len(columns['open_time'])
+    for start in range(0, rows, chunk_rows):
+        yield {name: column[start:start + chunk_rows] for name, column in columns.items()}
+
+
+class KlineSource:
+    '''
+    Stored klines of one interval, one unit per month partition
+    A unit is keyed by the checksum of its _sources.json, i.e. of the archives ingested into it
+    '''
+
+    def __init__(self, symbol, interval, root=STORE_FOLDER):
+        self.symbol = symbol
+        self.name = interval
+        self.root = root
+        self.store = get_store(root)
+
+    def units(self):
+        '''
+        Returns: list of (unit, checksum) in time order
+        '''
+        self.store.refresh()
+        units = []
+        for month in self.store.get_months(self.symbol, self.name):
+            path = partition_path(self.root, self.symbol, self.name, month)
+            with open(os.path.join(path, SOURCES), 'rb') as f:
+                units.append((month, sha256(f.read())))
+        return units
+
+    def chunks(self, unit, chunk_rows=CHUNK_ROWS):
+        return slices(self.store.get_partition(self.symbol, self.name, unit), chunk_rows)
+
+
+class TickSource:
+    '''
+    aggTrade records of the live recorder, one unit per segment file keyed by its written rows
+    Every trade becomes a one row kline, so ticks and klines share the bar reductions
+    '''
+
+    def __init__(self, symbol, folder=RECORD_FOLDER):
+        self.symbol = symbol
+        self.name = TICKS
+        self.folder = folder
+        if RECORDER_MODULE not in sys.path:
+            sys.path.append(RECORDER_MODULE)
+        import recorder
+        self.recorder = recorder
+
+    def units(self):
+        units = []
+        for path in self.recorder.segment_paths(self.folder, self.symbol, self.recorder.MARKET):
+            rows = len(self.recorder.load_segment(path))
+            units.append((path, sha256('{}:{}'.format(os.path.basename(path), rows).encode())))
+        return units
+
+    def chunks(self, unit, chunk_rows=CHUNK_ROWS):
+        records = self.recorder.load_segment(unit)
+        for start in range(0, len(records), chunk_rows):
+            part = records[start:start + chunk_rows]
+            trades = part[part['kind'] == self.recorder.AGG_TRADE]
+            price = trades['p1']
+            qty = trades['p2']
+            trade_time = trades['p3'].astype(np.int64)
+            quote = price * qty
+            # the taker bought unless the buyer was the maker
+            taker_buy = trades['side'] != 1
+            yield {
+                'open_time': trade_time,
+                'open': price,
+                'high': price,
+                'low': price,
+                'close': price,
+                'volume': qty,
+                'close_time': trade_time,
+                'quote_volume': quote,
+                'count': np.ones(len(trades), dtype=np.int64),
+                'taker_buy_volume': np.where(taker_buy, qty, 0.0),
+                'taker_buy_quote_volume': np.where(taker_buy, quote, 0.0),
+            }
+
+
+def get_source(symbol, source, store=STORE_FOLDER, recordings=RECORD_FOLDER):
+    if source == TICKS:
+        return TickSource(symbol, recordings)
+    return KlineSource(symbol, source, store)
+
+# cache
+
+
+def cache_path(out, symbol, name):
+    # next to the bar folder, the store lists everything inside it as partitions
+    return os.path.join(out, symbol, name + CACHE)
+
+
+def read_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_cache(path, cache):
+    make_path(os.path.dirname(path))
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f, sort_keys=True)
+    os.replace(tmp_file, path)
+
+
+def write_bars(out, symbol, name, months, sources):
+    '''
+    Write the bars of each month as a partition of the bar store
+    Returns: the number of partitions written
+    '''
+    count = 0
+    for month, bars in months:
+        write_partition(partition_path(out, symbol, name, month), bars, sources)
+        count += 1
+    return count
+
+
+def merge_months(parts):
+    '''
+    Group a stream of bar chunks into whole months, only one month is held at a time
+    Yield: (YYYY-MM, dict of column name -> array)
+    '''
+    month, buffered = None, []
+    for bars in parts:
+        for part_month, part in split_months(bars):
+            if month is not None and part_month != month:
+                yield month, {name: np.concatenate([b[name] for b in buffered]) for name in COLUMN_NAMES}
+                buffered = []
+            month = part_month
+            buffered.append(part)
+    if buffered:
+        yield month, {name: np.concatenate([b[name] for b in buffered]) for name in COLUMN_NAMES}
+
+# pipeline
+
+
+def resample_time(source, spec, out, symbol):
+    '''
+    Time bars from klines: every month partition maps to one bar partition and is
+    rebuilt only when the checksum of its source changed
+    Returns: the number of partitions written
+    '''
+    if spec.size % BarSpec(source.name).size:
+        raise ValueError('Time bars must be a multiple of the {} source: {}'.format(source.name, spec.spec))
+    name = spec.name(source.name)
+    count = 0
+    for unit, checksum in source.units():
+        path = partition_path(out, symbol, name, unit)
+        sources = {'source': source.name, 'unit': unit, 'checksum': checksum}
+        if read_sources(path) == sources:
+            continue
+        count += write_bars(out, symbol, name, merge_months(resample_chunks(source.chunks(unit), spec)), sources)
+    return count
+
+
+def resample_series(source, spec, out, symbol):
+    '''
+    Event bars, and any bars from ticks, depend on every row before them: the whole series is
+    streamed again when the checksum chain over its source units changed
+    Returns: the number of partitions written
+    '''
+    name = spec.name(source.name)
+    cache = cache_path(out, symbol, name)
+    units = source.units()
+    chain = sha256(json.dumps(units).encode())
+    if read_cache(cache).get('checksum') == chain:
+        return 0
+
+    def chunks():
+        for unit, _ in units:
+            for chunk in source.chunks(unit):
+                yield chunk
+    sources = {'source': source.name, 'checksum': chain}
+    # the months of the new series may not cover the old ones, drop the old series first
+    shutil.rmtree(os.path.join(out, symbol, name), ignore_errors=True)
+    count = write_bars(out, symbol, name, merge_months(resample_chunks(chunks(), spec)), sources)
+    write_cache(cache, {'checksum': chain, 'units': len(units)})
+    return count
+
+
+def resample(symbol, bars, source='1m', store=STORE_FOLDER, out=BAR_FOLDER, recordings=RECORD_FOLDER):
+    '''
+    Build bars of each spec from the stored klines of source, or from recorded ticks with source 'ticks'
+    Returns: dict of bar folder name -> partitions written
+    '''
+    feed = get_source(symbol, source, store, recordings)
+    written = {}
+    for bar in bars:
+        spec = BarSpec(bar)
+        if spec.kind == TIME and source != TICKS:
+            written[spec.name(source)] = resample_time(feed, spec, out, symbol)
+        else:
+            written[spec.name(source)] = resample_series(feed, spec, out, symbol)
+    return written
+
+
+def load_bars(symbol, bar, source='1m', start=None, end=None, columns=OHLCV, out=BAR_FOLDER):
+    '''
+    Load resampled bars with open time in [start, end)
+    Returns: dict of column name -> array
+    '''
+    return get_store(out).load(symbol, BarSpec(bar).name(source), start, end, columns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "--symbol", help="The symbol, comma separated for several, e.g. ETHUSDT,BTCUSDT", type=str, required=True)
+    parser.add_argument(
+        "--bars", help="Comma separated bars, e.g. 5m,1h,volume:1000,dollar:5e6", type=str, required=True)
+    parser.add_argument(
+        "--source", help="The stored interval to build from, or ticks for recordings, e.g. 1m", type=str, required=False)
+    parser.add_argument(
+        "--store", help="The root folder of the columnar store, e.g. kline_store", type=str, required=False)
+    parser.add_argument(
+        "--out", help="The root folder of the resampled bars, e.g. bar_store", type=str, required=False)
+    parser.add_argument(
+        "--recordings", help="The recorder folder, for --source ticks", type=str, required=False)
+
+    args = parser.parse_args()
+    source = args.source if args.source else '1m'
+    store = args.store if args.store else STORE_FOLDER
+    out = args.out if args.out else BAR_FOLDER
+    recordings = args.recordings if args.recordings else RECORD_FOLDER
+    for symbol in args.symbol.split(','):
+        for name, count in resample(symbol, args.bars.split(','), source, store, out, recordings).items():
+            print('{} {}: {} partitions written'.format(symbol, name, count))
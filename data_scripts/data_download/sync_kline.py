@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import aiohttp
+from datetime import datetime, timedelta, timezone
+from ingest_kline import ingest, read_sources, partition_path, STORE_FOLDER, CHECKSUM
+from download_kline import PATH, PART, CHUNK_SIZE, RETRIES, MISMATCH_RETRIES, BACKOFF, TIMEOUT, DOWNLOAD_FOLDER, make_path
+
+# Config
+CATALOG = 'kline_catalog.json'
+START = '2020-01-01'
+CONCURRENCY = 16
+# a file this many days old or newer may just not be published yet and is tried again
+RETRY_DAYS = 3
+# checksums of this many latest days are compared with the store, binance republishes corrected files
+STALE_DAYS = 2
+SYNC_INTERVAL = 60 * 60
+DATE_FORMAT = '%Y-%m-%d'
+
+# file outcomes
+OK = 'ok'
+ABSENT = 'absent'
+FAILED = 'failed'
+
+# utility
+
+
+def to_date(value):
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def date_range(first, last):
+    '''
+    Returns: list of YYYY-MM-DD from first to last inclusive
+    '''
+    first, last = to_date(first), to_date(last)
+    return [(first + timedelta(days=x)).strftime(DATE_FORMAT) for x in range((last - first).days + 1)]
+
+
+def shift(date, days):
+    return (to_date(date) + timedelta(days=days)).strftime(DATE_FORMAT)
+
+
+def yesterday():
+    '''
+    Returns: the last UTC day binance can have published
+    '''
+    return (datetime.now(timezone.utc).date() - timedelta(days=1)).strftime(DATE_FORMAT)
+
+
+def archive_name(symbol, interval, date):
+    return '{}-{}-{}.zip'.format(symbol, interval, date)
+
+# catalog
+
+
+class Catalog:
+    '''
+    What is already in the store per symbol and interval, so a sync never walks old dates or folders
+    synced: every day up to it is ingested or does not exist upstream
+    missing: later or failed days to try again
+    '''
+
+    def __init__(self, file=CATALOG):
+        self.file = file
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        tmp_file = self.file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.file)
+
+    def get(self, symbol, interval, start=START):
+        key = '{}/{}'.format(symbol, interval)
+        if key not in self.entries:
+            self.entries[key] = {'start': start, 'synced': None, 'missing': []}
+        return self.entries[key]
+
+    def plan(self, symbol, interval, last, start=START):
+        '''
+        Returns: sorted dates to fetch, the days after synced up to last and the missing ones
+        '''
+        entry = self.get(symbol, interval, start)
+        first = shift(entry['synced'], 1) if entry['synced'] else entry['start']
+        dates = set(entry['missing'])
+        if first <= last:
+            dates.update(date_range(first, last))
+        return sorted(dates)
+
+    def update(self, symbol, interval, outcomes, last):
+        '''
+        Advance synced over the contiguous days that are done, keep the rest as missing
+        outcomes: dict of date -> OK, ABSENT or FAILED
+        '''
+        entry = self.get(symbol, interval)
+        retry_from = shift(last, -RETRY_DAYS + 1)
+        missing = set()
+        for date, outcome in outcomes.items():
+            if outcome == FAILED or (outcome == ABSENT and date >= retry_from):
+                missing.add(date)
+        synced = entry['synced'] or shift(entry['start'], -1)
+        while True:
+            date = shift(synced, 1)
+            if date > last or date in missing:
+                break
+            synced = date
+        entry['synced'] = synced if synced >= entry['start'] else None
+        entry['missing'] = sorted(missing | set(date for date in entry['missing'] if date not in outcomes))
+        entry['time'] = time.time()
+
+# download
+
+
+async def fetch(session, url, save_path, retries=RETRIES):
+    '''
+    Stream a url to a temporary file and rename it into place once complete
+    Returns: the sha256 of the file, ABSENT on 404, FAILED after the retries
+    '''
+    part_path = save_path + PART
+    for attempt in range(retries + 1):
+        try:
+            sha256_hash = hashlib.sha256()
+            async with session.get(url) as response:
+                if response.status == 404:
+                    return ABSENT
+                response.raise_for_status()
+                with open(part_path, 'wb') as fd:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        sha256_hash.update(chunk)
+                        fd.write(chunk)
+            os.replace(part_path, save_path)
+            return sha256_hash.hexdigest()
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            if attempt < retries:
+                await asyncio.sleep(BACKOFF * 2 ** attempt)
+    return FAILED
+
+
+async def fetch_checksum(session, url, retries=RETRIES):
+    '''
+    Returns: the published sha256 of an archive, ABSENT on 404, FAILED after the retries
+    '''
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url) as response:
+                if response.status == 404:
+                    return ABSENT
+                response.raise_for_status()
+                return (await response.text()).split()[0]
+        except (aiohttp.ClientError, asyncio.TimeoutError, IndexError):
+            if attempt < retries:
+                await asyncio.sleep(BACKOFF * 2 ** attempt)
+    return FAILED
+
+
+def local_checksum(file):
+    '''
+    Returns: the sha256 of a file on disk, None if it is not there
+    '''
+    if not os.path.exists(file):
+        return None
+    sha256_hash = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+async def sync_file(session, semaphore, symbol, interval, date, folder=DOWNLOAD_FOLDER, base_url=PATH,
+                    known=None):
+    '''
+    Fetch one daily archive unless the copy on disk or in the store already has the published checksum
+    known: sha256 of the archive already in the store, None if it is not
+    Returns: (OK with the archive path, or ABSENT or FAILED with None)
+    '''
+    name = archive_name(symbol, interval, date)
+    url = base_url + symbol + '/' + interval + '/' + name
+    save_path = os.path.join(folder.format(interval, symbol), name)
+    async with semaphore:
+        published = await fetch_checksum(session, url + CHECKSUM)
+        if published in (ABSENT, FAILED):
+            return published, None
+        if published == known:
+            return OK, None
+        make_path(os.path.dirname(save_path))
+        with open(save_path + CHECKSUM, 'w') as f:
+            f.write('{}  {}\n'.format(published, name))
+        if await asyncio.get_running_loop().run_in_executor(None, local_checksum, save_path) == published:
+            return OK, save_path
+        for attempt in range(MISMATCH_RETRIES + 1):
+            calculated = await fetch(session, url, save_path)
+            if calculated in (ABSENT, FAILED):
+                return calculated, None
+            if calculated == published:
+                return OK, save_path
+            print('{} checksum mismatch'.format(name))
+    return FAILED, None
+
+
+def stored_checksums(store, symbol, interval, dates):
+    '''
+    Returns: dict of date -> sha256 of the archives of these dates already in the store
+    '''
+    known = {}
+    sources = {}
+    for date in dates:
+        month = date[:7]
+        if month not in sources:
+            sources[month] = read_sources(partition_path(store, symbol, interval, month))
+        sha = sources[month].get(archive_name(symbol, interval, date))
+        if sha:
+            known[date] = sha
+    return known
+
+# sync
+
+
+async def sync_key(session, semaphore, catalog, symbol, interval, last, store, folder, base_url, start):
+    '''
+    Returns: (dict of date -> outcome, list of archive paths to ingest)
+    '''
+    dates = catalog.plan(symbol, interval, last, start)
+    entry = catalog.get(symbol, interval, start)
+    if entry['synced'] and STALE_DAYS:
+        recent = date_range(max(entry['start'], shift(entry['synced'], -STALE_DAYS + 1)), entry['synced'])
+        dates = sorted(set(dates) | set(recent))
+    known = stored_checksums(store, symbol, interval, dates)
+    results = await asyncio.gather(*(sync_file(session, semaphore, symbol, interval, date, folder, base_url,
+                                                known.get(date)) for date in dates))
+    outcomes = {}
+    archives = []
+    for date, (outcome, path) in zip(dates, results):
+        outcomes[date] = outcome
+        if path is not None:
+            archives.append(path)
+    return outcomes, archives
+
+
+async def sync(symbols, intervals, catalog_file=CATALOG, store=STORE_FOLDER, folder=DOWNLOAD_FOLDER,
+               base_url=PATH, concurrency=CONCURRENCY, start=START, last=None):
+    '''
+    Bring every symbol and interval up to last (default yesterday UTC): fetch the missing and changed
+    daily archives, ingest them and record the progress in the catalog
+    Returns: dict of (symbol, interval) -> (archives ingested, dates still missing, dates failed)
+    '''
+    last = last or yesterday()
+    catalog = Catalog(catalog_file)
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=TIMEOUT, sock_read=TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    keys = [(symbol, interval) for symbol in symbols for interval in intervals]
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        results = await asyncio.gather(*(sync_key(session, semaphore, catalog, symbol, interval, last, store,
+                                                  folder, base_url, start) for symbol, interval in keys))
+    loop = asyncio.get_running_loop()
+    report = {}
+    for (symbol, interval), (outcomes, archives) in zip(keys, results):
+        # the store swaps whole partitions, an interrupted ingest leaves the catalog behind, never ahead
+        ingested = await loop.run_in_executor(None, ingest, archives, store) if archives else 0
+        catalog.update(symbol, interval, outcomes, last)
+        catalog.save()
+        failed = sum(1 for outcome in outcomes.values() if outcome == FAILED)
+        report[(symbol, interval)] = (ingested, len(catalog.get(symbol, interval)['missing']), failed)
+    return report
+
+
+async def run_daemon(symbols, intervals, interval=SYNC_INTERVAL, **kwargs):
+    '''
+    Sync every interval seconds, a failed round is logged and retried on the next one
+    '''
+    while True:
+        timer = time.time()
+        try:
+            print_report(await sync(symbols, intervals, **kwargs), time.time() - timer)
+        except Exception as e:
+            print('sync fail: {}'.format(e))
+        await asyncio.sleep(max(0, interval - (time.time() - timer)))
+
+
+def print_report(report, elapsed):
+    for (symbol, interval), (ingested, missing, failed) in sorted(report.items()):
+        print('{} {}: {} archives ingested, {} dates missing, {} failed'.format(
+            symbol, interval, ingested, missing, failed))
+    print('sync finished in {:.1f}s'.format(elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "--symbol", help="The symbols to keep in sync, comma separated, e.g. ETHUSDT,BTCUSDT", type=str, required=True)
+    parser.add_argument(
+        "--interval", help="The intervals to keep in sync, comma separated, e.g. 1m,1h", type=str, required=False)
+    parser.add_argument(
+        "--start", help="The first date of a symbol new to the catalog, e.g. 2020-01-01", type=str, required=False)
+    parser.add_argument(
+        "--concurrency", help="The number of concurrent requests, e.g. 16", type=int, required=False)
+    parser.add_argument(
+        "--store", help="The root folder of the columnar store, e.g. kline_store", type=str, required=False)
+    parser.add_argument(
+        "--catalog", help="The catalog file, e.g. kline_catalog.json", type=str, required=False)
+    parser.add_argument(
+        "--daemon", help="Keep running and sync every --every seconds", action='store_true')
+    parser.add_argument(
+        "--every", help="Seconds between syncs in daemon mode, e.g. 3600", type=int, required=False)
+
+    args = parser.parse_args()
+    kwargs = dict(
+        catalog_file=args.catalog if args.catalog else CATALOG,
+        store=args.store if args.store else STORE_FOLDER,
+        concurrency=args.concurrency if args.concurrency else CONCURRENCY,
+        start=args.start if args.start else START,
+    )
+    symbols = args.symbol.split(',')
+    intervals = args.interval.split(',') if args.interval else ['1m']
+    if args.daemon:
+        asyncio.run(run_daemon(symbols, intervals, args.every if args.every else SYNC_INTERVAL, **kwargs))
+    else:
+        # one round for cron, a non zero exit status if downloads failed
+        timer = time.time()
+        report = asyncio.run(sync(symbols, intervals, **kwargs))
+        print_report(report, time.time() - timer)
+        exit(1 if any(failed for _, _, failed in report.values()) else 0)
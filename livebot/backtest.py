@@ -0,0 +1,336 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# Config
+TAKE_PROFIT = 0.1
+STOP_LOSS = 0.1
+MAX_ORDER = 2
+FEE = 0.0
+STORE_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'data_scripts', 'data_download')
+
+QUOTE = 0
+TAKE_PROFIT_FILL = 1
+STOP_LOSS_FILL = 2
+
+FILL_DTYPE = np.dtype([
+    ('series', np.int32),
+    ('step', np.int64),
+    ('time', np.int64),
+    ('kind', np.int8),
+    ('side', np.int8),
+    ('price', np.float64),
+    ('qty', np.float64),
+])
+
+
+class Market:
+    '''
+    Aligned market series of shape (series, steps)
+    bid/ask are the prices quoted at, a resting buy fills when low trades below it
+    and a resting sell fills when high trades above it
+    '''
+
+    def __init__(self, time, bid, ask, low, high, symbols=None):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.bid = np.atleast_2d(np.asarray(bid, dtype=np.float64))
+        self.ask = np.atleast_2d(np.asarray(ask, dtype=np.float64))
+        self.low = np.atleast_2d(np.asarray(low, dtype=np.float64))
+        self.high = np.atleast_2d(np.asarray(high, dtype=np.float64))
+        self.symbols = symbols or [str(i) for i in range(len(self.bid))]
+
+    @property
+    def mark(self):
+        return (self.bid + self.ask) / 2
+
+
+class BacktestResult:
+    def __init__(self, fills, position, cash, equity):
+        self.fills = fills
+        self.position = position
+        self.cash = cash
+        self.equity = equity
+
+    @property
+    def pnl(self):
+        '''
+        Final mark to market pnl per series
+        '''
+        last = self.equity[:, -1]
+        return np.where(np.isnan(last), 0.0, last)
+
+    def summary(self, symbols):
+        lines = []
+        for i, symbol in enumerate(symbols):
+            fills = self.fills[self.fills['series'] == i]
+            lines.append('{}: fills: {}, brackets closed: {}, position: {}, pnl: {}'.format(
+                symbol, len(fills), int(np.count_nonzero(fills['kind'] != QUOTE)),
+                self.position[i, -1], self.pnl[i]))
+        return '\n'.join(lines)
+
+# market data
+
+
+def from_klines(time, close, low, high, symbols=None):
+    '''
+    Klines carry no book, so bid and ask are both the close of the previous bar
+    '''
+    return Market(time, close, close, low, high, symbols)
+
+
+def from_book_ticker(time, bid, ask, symbols=None):
+    '''
+    On book ticks a resting buy fills once the ask trades below it and a resting sell once the bid trades above it
+    '''
+    return Market(time, bid, ask, ask, bid, symbols)
+
+
+def align(times, columns):
+    '''
+    Put series with different timestamps on their union time grid, missing steps are NaN
+    Returns: (time, list of 2d arrays, one per column name)
+    '''
+    grid = times[0]
+    for t in times[1:]:
+        grid = np.union1d(grid, t)
+    aligned = []
+    for k in range(len(columns[0])):
+        values = np.full((len(times), len(grid)), np.nan)
+        for i, t in enumerate(times):
+            values[i, np.searchsorted(grid, t)] = columns[i][k]
+        aligned.append(values)
+    return grid, aligned
+
+
+def load_klines(symbols, interval, start=None, end=None, root=None):
+    '''
+    Load klines of several symbols from the kline store into one aligned Market
+    '''
+    if STORE_MODULE not in sys.path:
+        sys.path.append(STORE_MODULE)
+    import kline_store
+
+    store = kline_store.get_store(root) if root else kline_store.get_store()
+    times, columns = [], []
+    for symbol in symbols:
+        data = store.load(symbol, interval, start, end)
+        times.append(data['open_time'])
+        columns.append([data['close'], data['low'], data['high']])
+    grid, (close, low, high) = align(times, columns)
+    return from_klines(grid, close, low, high, symbols)
+
+# first passage search
+
+
+def sparse_table(values, func):
+    '''
+    table[level][i] = func over values[i:i + 2**level], built in O(n log n)
+    '''
+    table = [values]
+    width = 1
+    while width * 2 <= len(values):
+        prev = table[-1]
+        table.append(func(prev[:-width], prev[width:]))
+        width *= 2
+    return table
+
+
+def first_crossing(table, start, target, above, inclusive=False):
+    '''
+    For every (start, target) pair find the first index j >= start where the series crosses target
+    Binary lifting over the sparse table, O(log n) numpy steps for all pairs at once
+    Returns: the indices, len(series) where the target is never reached
+    '''
+    n = len(table[0])
+    pos = np.asarray(start, dtype=np.int64).copy()
+    for level in range(len(table) - 1, -1, -1):
+        width = 1 << level
+        valid = pos + width <= n
+        block = table[level][np.where(valid, pos, 0)]
+        if above:
+            clear = block < target if inclusive else block <= target
+        else:
+            clear = block > target if inclusive else block >= target
+        # NaN blocks never compare, treat them as clear
+        clear |= np.isnan(block)
+        pos = np.where(valid & clear, pos + width, pos)
+    return pos
+
+# simulation
+
+
+def simulate_quotes(market, order_interval, max_order=MAX_ORDER):
+    '''
+    Replay regular_order_stream: quote BUY at the bid and SELL at the ask, cancel and requote
+    when order_interval seconds passed or fewer than max_order quotes are still open
+    Returns: (buy mask, sell mask, bid quote, ask quote), all (series, steps)
+    '''
+    bid, ask, low, high = market.bid, market.ask, market.low, market.high
+    series, steps = bid.shape
+    interval_ms = order_interval * 1000
+    buy = np.zeros((series, steps), dtype=bool)
+    sell = np.zeros((series, steps), dtype=bool)
+    quote_bid = np.full((series, steps), np.nan)
+    quote_ask = np.full((series, steps), np.nan)
+    if steps < 2:
+        return buy, sell, quote_bid, quote_ask
+
+    # two quotes a cycle, so with more than two allowed the quotes are refreshed on every step
+    if max_order > 2 or interval_ms <= np.min(np.diff(market.time)):
+        quote_bid[:, 1:] = bid[:, :-1]
+        quote_ask[:, 1:] = ask[:, :-1]
+        buy[:, 1:] = low[:, 1:] < quote_bid[:, 1:]
+        sell[:, 1:] = high[:, 1:] > quote_ask[:, 1:]
+        return buy, sell, quote_bid, quote_ask
+
+    # step-major copies so every step touches contiguous rows
+    bid_t, ask_t = np.ascontiguousarray(bid.T), np.ascontiguousarray(ask.T)
+    low_t, high_t = np.ascontiguousarray(low.T), np.ascontiguousarray(high.T)
+    buy_t = np.zeros((steps, series), dtype=bool)
+    sell_t = np.zeros((steps, series), dtype=bool)
+    quote_bid_t = np.full((steps, series), np.nan)
+    quote_ask_t = np.full((steps, series), np.nan)
+
+    # a filled side is parked at -inf/+inf so it cannot fill twice in a cycle
+    ref_bid = bid_t[0].copy()
+    ref_ask = ask_t[0].copy()
+    deadline = np.full(series, market.time[0] + interval_ms)
+    for i in range(1, steps):
+        quote_bid_t[i] = ref_bid
+        quote_ask_t[i] = ref_ask
+        buy_i = np.less(low_t[i], ref_bid, out=buy_t[i])
+        sell_i = np.greater(high_t[i], ref_ask, out=sell_t[i])
+        if max_order == 2:
+            reset = buy_i | sell_i
+        else:
+            ref_bid[buy_i] = -np.inf
+            ref_ask[sell_i] = np.inf
+            if max_order == 1:
+                reset = (ref_bid == -np.inf) & (ref_ask == np.inf)
+            else:
+                reset = np.zeros(series, dtype=bool)
+        reset |= deadline <= market.time[i]
+        if reset.any():
+            np.copyto(ref_bid, bid_t[i], where=reset)
+            np.copyto(ref_ask, ask_t[i], where=reset)
+            np.copyto(deadline, market.time[i] + interval_ms, where=reset)
+    return buy_t.T, sell_t.T, quote_bid_t.T, quote_ask_t.T
+
+
+def simulate_brackets(market, series, step, side, price, take_profit=TAKE_PROFIT, stop_loss=STOP_LOSS):
+    '''
+    Replay send_take_profit_order/send_stop_loss_order: every quote fill gets a take profit limit and
+    a stop loss, whichever is hit first closes it, a stop loss wins when both are hit on the same step
+    Returns: (exit step, exit kind, exit price), exit step is -1 for brackets still open at the end
+    '''
+    steps = market.bid.shape[1]
+    exit_step = np.full(len(step), -1, dtype=np.int64)
+    exit_kind = np.zeros(len(step), dtype=np.int8)
+    exit_price = np.zeros(len(step))
+    long = side > 0
+    tp_price = np.where(long, price * (1 + take_profit), price * (1 - take_profit))
+    sl_price = np.where(long, price * (1 - stop_loss), price * (1 + stop_loss))
+
+    # group the entries by (series, side) once instead of masking all of them per group
+    key = series.astype(np.int64) * 2 + long
+    order = np.argsort(key, kind='stable')
+    bounds = np.searchsorted(key[order], np.arange(2 * len(market.bid) + 1))
+    for s in np.unique(series):
+        max_table = sparse_table(market.high[s], np.fmax)
+        min_table = sparse_table(market.low[s], np.fmin)
+        for is_long in (False, True):
+            group = 2 * s + is_long
+            idx = order[bounds[group]:bounds[group + 1]]
+            if not len(idx):
+                continue
+            start = step[idx] + 1
+            if is_long:
+                tp = first_crossing(max_table, start, tp_price[idx], above=True)
+                sl = first_crossing(min_table, start, sl_price[idx], above=False, inclusive=True)
+            else:
+                tp = first_crossing(min_table, start, tp_price[idx], above=False)
+                sl = first_crossing(max_table, start, sl_price[idx], above=True, inclusive=True)
+            stopped = sl <= tp
+            hit = np.minimum(tp, sl)
+            exit_step[idx] = np.where(hit < steps, hit, -1)
+            exit_kind[idx] = np.where(stopped, STOP_LOSS_FILL, TAKE_PROFIT_FILL)
+            exit_price[idx] = np.where(stopped, sl_price[idx], tp_price[idx])
+    return exit_step, exit_kind, exit_price
+
+
+def run_backtest(market, init_amount, order_interval, max_order=MAX_ORDER,
+                 take_profit=TAKE_PROFIT, stop_loss=STOP_LOSS, fee=FEE):
+    '''
+    Backtest simple_strat over a Market, the order amount is init_amount worth of the first price
+    Returns: BacktestResult with the fills and the position, cash and equity series
+    '''
+    series, steps = market.bid.shape
+    buy, sell, quote_bid, quote_ask = simulate_quotes(market, order_interval, max_order)
+
+    first = np.argmax(~np.isnan(market.bid), axis=1)
+    amount = init_amount / market.bid[np.arange(series), first]
+
+    buy_series, buy_step = np.nonzero(buy)
+    sell_series, sell_step = np.nonzero(sell)
+    entry_series = np.concatenate([buy_series, sell_series]).astype(np.int32)
+    entry_step = np.concatenate([buy_step, sell_step])
+    entry_side = np.concatenate([np.ones(len(buy_step), np.int8), -np.ones(len(sell_step), np.int8)])
+    entry_price = np.concatenate([quote_bid[buy], quote_ask[sell]])
+    entry_qty = amount[entry_series]
+
+    exit_step, exit_kind, exit_price = simulate_brackets(
+        market, entry_series, entry_step, entry_side, entry_price, take_profit, stop_loss)
+    closed = exit_step >= 0
+
+    fills = np.empty(len(entry_step) + np.count_nonzero(closed), dtype=FILL_DTYPE)
+    fills['series'] = np.concatenate([entry_series, entry_series[closed]])
+    fills['step'] = np.concatenate([entry_step, exit_step[closed]])
+    fills['kind'] = np.concatenate([np.full(len(entry_step), QUOTE, np.int8), exit_kind[closed]])
+    fills['side'] = np.concatenate([entry_side, -entry_side[closed]])
+    fills['price'] = np.concatenate([entry_price, exit_price[closed]])
+    fills['qty'] = np.concatenate([entry_qty, entry_qty[closed]])
+    fills['time'] = market.time[fills['step']]
+    order = np.argsort((fills['series'].astype(np.int64) * steps + fills['step']) * 3 + fills['kind'], kind='stable')
+    fills = fills[order]
+
+    flat = fills['series'].astype(np.int64) * steps + fills['step']
+    signed_qty = fills['side'] * fills['qty']
+    notional = fills['qty'] * fills['price']
+    position = np.bincount(flat, signed_qty, series * steps).reshape(series, steps).cumsum(axis=1)
+    cash = np.bincount(flat, -signed_qty * fills['price'] - fee * notional,
+                       series * steps).reshape(series, steps).cumsum(axis=1)
+    equity = cash + position * market.mark
+    return BacktestResult(fills, position, cash, equity)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "--symbol", help="The symbols, comma separated, e.g. ETHUSDT,BTCUSDT", type=str, required=True)
+    parser.add_argument(
+        "--interval", help="The kline interval, e.g. 1m", type=str, default='1m')
+    parser.add_argument(
+        "--start", help="The start date, e.g. 2022-01-01", type=str, required=False)
+    parser.add_argument(
+        "--end", help="The end date (exclusive), e.g. 2022-02-01", type=str, required=False)
+    parser.add_argument(
+        "--store", help="The root folder of the kline store", type=str, required=False)
+    parser.add_argument(
+        "--init_amount", help="The order size in quote asset", type=float, required=True)
+    parser.add_argument(
+        "--order_interval", help="The requote interval in seconds", type=int, required=True)
+    parser.add_argument(
+        "--max_order", help="The number of open quotes below which it requotes", type=int, default=MAX_ORDER)
+    parser.add_argument(
+        "--fee", help="The fee rate per fill, e.g. 0.0002", type=float, default=FEE)
+
+    args = parser.parse_args()
+    symbols = args.symbol.split(',')
+    market = load_klines(symbols, args.interval, args.start, args.end, args.store)
+    timer = time.time()
+    result = run_backtest(market, args.init_amount, args.order_interval, args.max_order, fee=args.fee)
+    print(result.summary(symbols))
+    print('{} steps x {} symbols in {:.3f}s'.format(market.bid.shape[1], len(symbols), time.time() - timer))
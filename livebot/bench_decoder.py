@@ -0,0 +1,90 @@
+import json
+import time
+import argparse
+
+from decoder import orjson, EventFilter, USER_EVENTS
+from market_stream import StreamRouter
+from data_structure.orderbook import TopOfBook, TickScale
+
+# Config
+MESSAGES = 200000
+BOOK_TICKER = ('{{"stream":"{stream}@bookTicker","data":{{"e":"bookTicker","u":{u},"s":"{symbol}",'
+               '"b":"{bid:.2f}","B":"1.234","a":"{ask:.2f}","A":"0.567","T":1700000000000,"E":1700000000001}}}}')
+ORDER_UPDATE = ('{{"e":"ORDER_TRADE_UPDATE","T":1700000000000,"E":1700000000001,"o":{{"s":"{symbol}",'
+                '"c":"x","S":"BUY","o":"LIMIT","f":"GTC","q":"0.001","p":"{price:.2f}","ap":"0","sp":"0",'
+                '"x":"NEW","X":"NEW","i":{u},"l":"0","z":"0","L":"0","T":1700000000000,"t":0}}}}')
+TRADE_LITE = ('{{"e":"TRADE_LITE","E":1700000000001,"T":1700000000000,"s":"{symbol}","q":"0.001",'
+              '"p":"{price:.2f}","m":false,"c":"x","S":"BUY","L":"{price:.2f}","l":"0.001","t":{u},"i":{u}}}')
+
+
+def book_frames(n, symbols):
+    return [BOOK_TICKER.format(stream=symbols[i % len(symbols)].lower(), symbol=symbols[i % len(symbols)],
+                               u=i, bid=30000 + i % 100 * 0.1, ask=30000.1 + i % 100 * 0.1)
+            for i in range(n)]
+
+
+def user_frames(n, symbols):
+    templates = (ORDER_UPDATE, TRADE_LITE, TRADE_LITE)
+    return [templates[i % 3].format(symbol=symbols[i % len(symbols)], u=i, price=30000 + i % 100 * 0.1)
+            for i in range(n)]
+
+
+def baseline_book(frames, symbol):
+    '''
+    The previous path: full json decode of every frame, key probing and float conversion
+    '''
+    orderbook = TopOfBook(symbol)
+    for frame in frames:
+        res = json.loads(frame)
+        data = res['data'] if 'data' in res else res
+        if 'b' in data and 'a' in data and data['s'] == symbol:
+            orderbook.on_book_ticker(data)
+
+
+def fast_book(frames, symbol):
+    orderbook = TopOfBook(symbol, TickScale(0.1, 1))
+    router = StreamRouter()
+    router.add(symbol.lower() + '@bookTicker', orderbook.on_book_ticker)
+    dispatch = router.dispatch
+    for frame in frames:
+        dispatch(frame)
+
+
+def baseline_user(frames, symbol):
+    for frame in frames:
+        res = json.loads(frame)
+        if res['e'] == 'ORDER_TRADE_UPDATE' and res['o']['s'] == symbol:
+            pass
+
+
+def fast_user(frames, symbol):
+    event_loads = EventFilter(USER_EVENTS, symbol).loads
+    for frame in frames:
+        event_loads(frame)
+
+
+def rate(func, frames, symbol):
+    timer = time.perf_counter()
+    func(frames, symbol)
+    return len(frames) / (time.perf_counter() - timer)
+
+
+def main(messages, symbols):
+    print("orjson: {}".format('yes' if orjson is not None else 'no, json fallback'))
+    symbol = symbols[0]
+    for name, frames, baseline, fast in (
+        ('bookTicker', book_frames(messages, symbols), baseline_book, fast_book),
+        ('user data', user_frames(messages, symbols), baseline_user, fast_user),
+    ):
+        before = rate(baseline, frames, symbol)
+        after = rate(fast, frames, symbol)
+        print("{}: {:,.0f} msg/s before, {:,.0f} msg/s after, {:.2f}x".format(name, before, after, after / before))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Feed handler decode throughput on one core')
+    parser.add_argument('--messages', type=int, default=MESSAGES)
+    parser.add_argument('--symbols', type=str, default='BTCUSDT',
+                        help='comma separated, frames rotate over them and only the first is routed')
+    args = parser.parse_args()
+    main(args.messages, args.symbols.split(','))
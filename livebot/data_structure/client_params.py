@@ -1,7 +1,7 @@
 import asyncio
 
 class BaseParamsManager:
-    async def __init__(self, keywords, logger=None):
+    def __init__(self, keywords, logger=None):
         self.params = {}
         self.keywords = keywords
         self.logger = logger
@@ -9,7 +9,7 @@ class BaseParamsManager:
     async def clear(self):
         self.params = {}
         if self.logger:
-            self.logger.info("Params cleared")
+            self.logger.info_nowait("Params cleared")
     
     async def set_params(self, params):
         self.params = params
@@ -21,20 +21,30 @@ class BaseParamsManager:
         if key in self.params:
             return self.params[key]
         else:
-            self.logger.error("Param get failed: {} not in params".format(key))
+            self.logger.error_nowait("Param get failed: {} not in params".format(key))
             return -1
     
     async def update_param(self, key, value):
         if key in self.params:
             self.params[key] = value
             if self.logger:
-                self.logger.info("Param updated: {} = {}".format(key, value))
+                self.logger.info_nowait("Param updated: {} = {}".format(key, value))
         else:
             if self.logger:
-                self.logger.error("Param update failed: {} not in params".format(key))
+                self.logger.error_nowait("Param update failed: {} not in params".format(key))
     
     async def update_params(self, params):
         for key, value in params.items():
             await self.update_param(key, value)
-    
-    
\ No newline at end of file
+
+
+class ClientParams(BaseParamsManager):
+    def __init__(self, keywords, logger=None):
+        super().__init__(keywords, logger)
+        # journal of the updates, None when params are not persisted
+        self.journal = None
+
+    async def update_param(self, key, value):
+        await super().update_param(key, value)
+        if self.journal is not None and key in self.params:
+            self.journal.param(key, value)
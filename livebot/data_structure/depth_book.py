@@ -0,0 +1,213 @@
+from bisect import bisect_left
+
+BID = 'bid'
+ASK = 'ask'
+
+
+class BookSide:
+    '''
+    Price levels of one side in two parallel lists sorted by key, best level last
+    Bids are keyed by price and asks by -price, so the top of both sides sits at the
+    end of the lists and most inserts and deletes only move a few entries
+    '''
+    __slots__ = ('sign', 'keys', 'qtys')
+
+    def __init__(self, sign):
+        self.sign = sign
+        self.keys = []
+        self.qtys = []
+
+    def clear(self):
+        self.keys = []
+        self.qtys = []
+
+    def set(self, price, qty):
+        '''
+        Set the quantity at a price, 0 removes the level
+        '''
+        key = self.sign * price
+        keys = self.keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            if qty:
+                self.qtys[i] = qty
+            else:
+                del keys[i]
+                del self.qtys[i]
+        elif qty:
+            keys.insert(i, key)
+            self.qtys.insert(i, qty)
+
+    def load(self, levels):
+        levels = sorted((self.sign * float(price), float(qty)) for price, qty in levels if float(qty))
+        self.keys = [key for key, _ in levels]
+        self.qtys = [qty for _, qty in levels]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def level(self, n=0):
+        '''
+        Returns: (price, qty) of the n-th best level, None past the end
+        '''
+        if n >= len(self.keys):
+            return None
+        return self.sign * self.keys[-1 - n], self.qtys[-1 - n]
+
+    def top(self, n):
+        '''
+        Returns: list of (price, qty) of the n best levels, best first
+        '''
+        sign = self.sign
+        return [(sign * key, qty) for key, qty in zip(self.keys[:-n - 1:-1], self.qtys[:-n - 1:-1])]
+
+    def qty_at(self, price):
+        key = self.sign * price
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.qtys[i]
+        return 0.0
+
+    def vwap(self, size):
+        '''
+        Average price of taking size from this side, walking levels from the best
+        Returns: (vwap, filled), filled is less than size when the side runs out
+        '''
+        filled = 0.0
+        notional = 0.0
+        keys, qtys, sign = self.keys, self.qtys, self.sign
+        for i in range(len(keys) - 1, -1, -1):
+            take = min(qtys[i], size - filled)
+            filled += take
+            notional += take * sign * keys[i]
+            if filled >= size:
+                break
+        if not filled:
+            return None, 0.0
+        return notional / filled, filled
+
+
+class DepthBook:
+    '''
+    L2 book of one symbol from a REST snapshot plus @depth diff events
+    Events are buffered until a snapshot bridges them, after that every event must
+    continue the previous one (pu == last u) or the book drops to unsynced and
+    needs a new snapshot
+    '''
+
+    def __init__(self, symbol=''):
+        self.symbol = symbol
+        self.bids = BookSide(1)
+        self.asks = BookSide(-1)
+        self.last_update_id = -1
+        self.event_time = 0
+        self.synced = False
+        self.bridged = False
+        self.buffer = []
+        self.resyncs = 0
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.last_update_id = -1
+        self.synced = False
+        self.bridged = False
+        self.buffer = []
+
+    def apply_levels(self, event):
+        for price, qty in event['b']:
+            self.bids.set(float(price), float(qty))
+        for price, qty in event['a']:
+            self.asks.set(float(price), float(qty))
+        self.last_update_id = event['u']
+        self.event_time = event.get('E', self.event_time)
+
+    def apply(self, event):
+        '''
+        Apply one event to a synced book
+        Returns: True if applied, False if it was stale or broke the sequence
+        '''
+        if event['u'] < self.last_update_id:
+            return False
+        if not self.bridged:
+            # the first event after the snapshot has to straddle it
+            if not event['U'] <= self.last_update_id <= event['u']:
+                return False
+            self.bridged = True
+        elif event['pu'] != self.last_update_id:
+            return False
+        self.apply_levels(event)
+        return True
+
+    def on_event(self, event):
+        '''
+        Feed a depthUpdate payload
+        Returns: True if the book changed, False if it is buffering or just lost sync
+        '''
+        if not self.synced:
+            self.buffer.append(event)
+            return False
+        if event['u'] < self.last_update_id:
+            # a late duplicate, not a gap
+            return False
+        if not self.apply(event):
+            self.synced = False
+            self.bridged = False
+            self.buffer = [event]
+            self.resyncs += 1
+            return False
+        return True
+
+    def on_snapshot(self, snapshot):
+        '''
+        Load a REST depth snapshot and replay the buffered events on top of it
+        Returns: True if the book is synced, False if the snapshot is older than the buffer
+        '''
+        last_update_id = snapshot['lastUpdateId']
+        buffer = [event for event in self.buffer if event['u'] >= last_update_id]
+        if buffer and buffer[0]['U'] > last_update_id:
+            # events between the snapshot and the buffer are missing
+            return False
+        self.bids.load(snapshot['bids'])
+        self.asks.load(snapshot['asks'])
+        self.last_update_id = last_update_id
+        self.bridged = False
+        self.buffer = []
+        for event in buffer:
+            if not self.apply(event):
+                self.buffer = []
+                self.synced = False
+                self.resyncs += 1
+                return False
+        self.synced = True
+        return True
+
+    # queries
+
+    def best_bid(self):
+        return self.bids.level(0)
+
+    def best_ask(self):
+        return self.asks.level(0)
+
+    def mid(self):
+        bid, ask = self.bids.level(0), self.asks.level(0)
+        if bid is None or ask is None:
+            return None
+        return (bid[0] + ask[0]) / 2
+
+    def depth(self, side, n):
+        '''
+        Returns: the n best (price, qty) levels of BID or ASK
+        '''
+        return (self.bids if side == BID else self.asks).top(n)
+
+    def level(self, side, n):
+        return (self.bids if side == BID else self.asks).level(n)
+
+    def vwap(self, side, size):
+        '''
+        Average price of selling size into the bids (BID) or buying it from the asks (ASK)
+        Returns: (vwap, filled)
+        '''
+        return (self.bids if side == BID else self.asks).vwap(size)
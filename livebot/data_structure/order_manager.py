@@ -0,0 +1,218 @@
+NEW = 'NEW'
+PARTIAL = 'PARTIAL'
+FILLED = 'FILLED'
+CANCELED = 'CANCELED'
+
+REGULAR_ORDER = 'regular'
+TAKE_PROFIT_ORDER = 'take_profit'
+STOP_LOSS_ORDER = 'stop_loss'
+
+# futures order status (X of ORDER_TRADE_UPDATE) to local state
+EXCHANGE_STATUS = {
+    'NEW': NEW,
+    'PARTIALLY_FILLED': PARTIAL,
+    'FILLED': FILLED,
+    'CANCELED': CANCELED,
+    'EXPIRED': CANCELED,
+    'REJECTED': CANCELED,
+}
+OPEN = (NEW, PARTIAL)
+
+
+class Order:
+    '''
+    One order placed by the bot, regular orders link to their take profit and stop loss children
+    '''
+    __slots__ = ('order_id', 'client_order_id', 'side', 'price', 'qty', 'filled_qty', 'avg_price',
+                 'status', 'role', 'parent', 'take_profit', 'stop_loss')
+
+    def __init__(self, order_id, side, price, qty, role=REGULAR_ORDER, parent=None, client_order_id=None):
+        self.order_id = order_id
+        self.client_order_id = client_order_id
+        self.side = side
+        self.price = price
+        self.qty = qty
+        self.filled_qty = 0.0
+        self.avg_price = 0.0
+        self.status = NEW
+        self.role = role
+        self.parent = parent
+        self.take_profit = None
+        self.stop_loss = None
+
+    @property
+    def is_open(self):
+        return self.status in OPEN
+
+    def __repr__(self):
+        return 'Order(id={}, role={}, side={}, price={}, qty={}, filled={}, status={}, parent={})'.format(
+            self.order_id, self.role, self.side, self.price, self.qty, self.filled_qty, self.status,
+            self.parent.order_id if self.parent else None)
+
+
+class OrderManager:
+    '''
+    Local order state of one symbol
+    Orders are indexed by order id and client order id, and the open ones by role, so
+    placing, filling and cancelling an order only touches that order and its links
+    '''
+
+    def __init__(self, symbol=''):
+        self.symbol = symbol
+        # called with every order that stops being open
+        self.on_close = None
+        # journal of every state change, None when the state is not persisted
+        self.journal = None
+        # pre-trade risk aggregates of the symbol, None when no risk engine is used
+        self.risk = None
+        self.orders = {}
+        self.by_client_id = {}
+        # role -> {order_id: Order} of open orders, dicts keep placement order
+        self.open = {REGULAR_ORDER: {}, TAKE_PROFIT_ORDER: {}, STOP_LOSS_ORDER: {}}
+
+    def clear(self):
+        self.orders = {}
+        self.by_client_id = {}
+        self.open = {REGULAR_ORDER: {}, TAKE_PROFIT_ORDER: {}, STOP_LOSS_ORDER: {}}
+        if self.journal is not None:
+            self.journal.clear()
+        if self.risk is not None:
+            self.risk.clear()
+
+    def add(self, order_id, side, price, qty, role=REGULAR_ORDER, parent_id=None, client_order_id=None):
+        '''
+        Track a newly placed order, children are linked to their parent
+        Returns: the Order
+        '''
+        parent = self.orders.get(parent_id) if parent_id is not None else None
+        order = Order(order_id, side, price, qty, role, parent, client_order_id)
+        self.orders[order_id] = order
+        if client_order_id:
+            self.by_client_id[client_order_id] = order
+        self.open[role][order_id] = order
+        if parent is not None:
+            if role == TAKE_PROFIT_ORDER:
+                parent.take_profit = order
+            elif role == STOP_LOSS_ORDER:
+                parent.stop_loss = order
+        if self.journal is not None:
+            self.journal.add(order)
+        if self.risk is not None:
+            self.risk.add(order)
+        return order
+
+    def get(self, order_id):
+        return self.orders.get(order_id)
+
+    def get_by_client_id(self, client_order_id):
+        return self.by_client_id.get(client_order_id)
+
+    def open_ids(self, role=REGULAR_ORDER):
+        return list(self.open[role])
+
+    def open_count(self, role=REGULAR_ORDER):
+        return len(self.open[role])
+
+    def working(self, side, role=REGULAR_ORDER):
+        '''
+        Returns: the oldest open order of a side, None if there is none
+        '''
+        for order in self.open[role].values():
+            if order.side == side:
+                return order
+        return None
+
+    def reprice(self, order_id, price):
+        order = self.orders.get(order_id)
+        if order is not None:
+            order.price = price
+            if self.journal is not None:
+                self.journal.reprice(order)
+            if self.risk is not None:
+                self.risk.reprice(order)
+        return order
+
+    def set_status(self, order, status):
+        order.status = status
+        if self.journal is not None:
+            self.journal.status(order)
+        if self.risk is not None:
+            self.risk.status(order)
+        if status not in OPEN and self.open[order.role].pop(order.order_id, None) is not None:
+            if self.on_close is not None:
+                self.on_close(order)
+
+    def fill(self, order_id, filled_qty, avg_price=0.0, status=FILLED):
+        '''
+        Returns: the Order, None if it is not tracked
+        '''
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        order.filled_qty = filled_qty
+        if avg_price:
+            order.avg_price = avg_price
+        self.set_status(order, status)
+        return order
+
+    def cancel(self, order_id):
+        '''
+        Returns: the Order, None if it is not tracked
+        '''
+        order = self.orders.get(order_id)
+        if order is not None and order.is_open:
+            self.set_status(order, CANCELED)
+        return order
+
+    def cancel_open(self):
+        '''
+        Mark every open order canceled, after a cancel all on the exchange
+        '''
+        for role in self.open:
+            for order in self.open[role].values():
+                order.status = CANCELED
+                if self.on_close is not None:
+                    self.on_close(order)
+            self.open[role] = {}
+        if self.journal is not None:
+            self.journal.cancel_open()
+        if self.risk is not None:
+            self.risk.cancel_open()
+
+    def sibling(self, order):
+        '''
+        Returns: the other bracket child of a take profit or stop loss order, None if there is none
+        '''
+        parent = order.parent
+        if parent is None:
+            return None
+        return parent.stop_loss if order.role == TAKE_PROFIT_ORDER else parent.take_profit
+
+    def on_order_update(self, order):
+        '''
+        Apply the o payload of an ORDER_TRADE_UPDATE event
+        Returns: the updated Order, None if it is not one of ours
+        '''
+        tracked = self.orders.get(order['i'])
+        if tracked is None:
+            tracked = self.by_client_id.get(order.get('c'))
+        if tracked is None:
+            return None
+        status = EXCHANGE_STATUS.get(order['X'])
+        if status is None:
+            return tracked
+        return self.fill(tracked.order_id, float(order['z']), float(order.get('ap') or 0), status)
+
+    def forget(self, order):
+        '''
+        Drop a closed order and its closed children from the indexes
+        '''
+        for child in (order.take_profit, order.stop_loss):
+            if child is not None and not child.is_open:
+                self.forget(child)
+        if order.is_open:
+            return
+        if self.orders.pop(order.order_id, None) is not None and self.journal is not None:
+            self.journal.forget(order)
+        if order.client_order_id:
+            self.by_client_id.pop(order.client_order_id, None)
@@ -1,3 +1,4 @@
+import time
 import asyncio
 
 
@@ -11,17 +12,17 @@ class OrderBook:
     async def clear(self):
         self.orderbook = {key: -1 for key in self.keywords}
         if self.logger:
-            self.logger.info("Orderbook cleared")
+            self.logger.info_nowait("Orderbook cleared")
 
     async def update(self, key, value):
         if key in self.orderbook:
             self.orderbook[key] = value
             if self.logger:
-                self.logger.info(
+                self.logger.info_nowait(
                     "Orderbook updated: {} = {}".format(key, value))
         else:
             if self.logger:
-                self.logger.error(
+                self.logger.error_nowait(
                     "Orderbook update failed: {} not in orderbook".format(key))
 
     async def updates(self, orderbook):
@@ -33,7 +34,7 @@ class OrderBook:
             return self.orderbook[key]
         else:
             if self.logger:
-                self.logger.error(
+                self.logger.error_nowait(
                     "Orderbook get failed: {} not in orderbook".format(key))
             return -1
 
@@ -43,4 +44,94 @@ class OrderBook:
     async def set(self, orderbook):
         self.orderbook = orderbook
         if self.logger:
-            self.logger.info("Orderbook set")
+            self.logger.info_nowait("Orderbook set")
+
+
+class TickScale:
+    '''
+    Conversion between price strings/floats and integer multiples of the tick size
+    '''
+    __slots__ = ('tick_size', 'inverse', 'precision')
+
+    def __init__(self, tick_size, precision):
+        self.tick_size = tick_size
+        self.inverse = 1.0 / tick_size
+        self.precision = precision
+
+    def to_ticks(self, price):
+        return round(float(price) * self.inverse)
+
+    def to_price(self, ticks):
+        return round(ticks * self.tick_size, self.precision)
+
+
+class TopOfBook:
+    '''
+    Best bid/ask of one symbol, updated synchronously from bookTicker
+    The whole state is one tuple swapped in a single assignment, so a reader
+    always gets a consistent snapshot without a lock
+    state: (update_id, bid, bid_qty, ask, ask_qty, event_time, recv_time)
+    With a TickScale bid and ask are integer ticks, prices() converts them back
+    '''
+    __slots__ = ('symbol', 'state', 'dropped', 'scale')
+
+    EMPTY = (-1, -1.0, 0.0, -1.0, 0.0, 0, 0)
+
+    def __init__(self, symbol='', scale=None):
+        self.symbol = symbol
+        self.state = TopOfBook.EMPTY
+        self.dropped = 0
+        self.scale = scale
+
+    def clear(self):
+        self.state = TopOfBook.EMPTY
+
+    def update(self, update_id, bid, bid_qty, ask, ask_qty, event_time=0, recv_time=0):
+        '''
+        Returns: True if applied, False if the tick is older than the book and was dropped
+        '''
+        if update_id <= self.state[0]:
+            self.dropped += 1
+            return False
+        self.state = (update_id, bid, bid_qty, ask, ask_qty, event_time, recv_time or time.time_ns())
+        return True
+
+    def on_book_ticker(self, data, recv_time=0):
+        '''
+        Apply a bookTicker payload: {"u": id, "E": event time, "b": bid, "B": qty, "a": ask, "A": qty}
+        '''
+        scale = self.scale
+        if scale is None:
+            return self.update(data['u'], float(data['b']), float(data['B']),
+                               float(data['a']), float(data['A']), data.get('E', 0), recv_time)
+        inverse = scale.inverse
+        return self.update(data['u'], round(float(data['b']) * inverse), float(data['B']),
+                           round(float(data['a']) * inverse), float(data['A']), data.get('E', 0), recv_time)
+
+    def snapshot(self):
+        return self.state
+
+    def prices(self):
+        '''
+        Returns: (bid, ask) as prices
+        '''
+        state = self.state
+        if self.scale is None or state[0] < 0:
+            return state[1], state[3]
+        return self.scale.to_price(state[1]), self.scale.to_price(state[3])
+
+    @property
+    def update_id(self):
+        return self.state[0]
+
+    @property
+    def bid(self):
+        return self.state[1]
+
+    @property
+    def ask(self):
+        return self.state[3]
+
+    @property
+    def recv_time(self):
+        return self.state[6]
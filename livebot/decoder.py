@@ -0,0 +1,72 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson decodes the same frames about three times faster than json
+loads = orjson.loads if orjson is not None else json.loads
+
+COMBINED_PREFIX = '{"stream":"'
+# user data events the bot acts on
+USER_EVENTS = ('ORDER_TRADE_UPDATE', 'ACCOUNT_UPDATE')
+
+
+def stream_name(frame):
+    '''
+    Read the stream name of a combined stream frame without decoding it
+    Returns: the name, None if the frame is not from a combined stream
+    '''
+    if not frame.startswith(COMBINED_PREFIX):
+        return None
+    start = len(COMBINED_PREFIX)
+    return frame[start:frame.find('"', start)]
+
+
+def decode_payload(frame):
+    '''
+    Returns: the payload of a raw or combined stream frame
+    '''
+    message = loads(frame)
+    return message.get('data', message)
+
+
+class EventFilter:
+    '''
+    Substring checks on the raw frame, so messages of other event types or other
+    symbols are dropped before they are decoded
+    '''
+
+    def __init__(self, events, symbol=None):
+        self.markers = tuple('"{}"'.format(event) for event in events)
+        self.symbol = '"{}"'.format(symbol) if symbol else None
+        self.skipped = 0
+
+    def accept(self, frame):
+        for marker in self.markers:
+            if marker in frame:
+                if self.symbol is None or self.symbol in frame:
+                    return True
+                break
+        self.skipped += 1
+        return False
+
+    def loads(self, frame):
+        '''
+        Drop in for the json_loads of a python-binance socket, None drops the message
+        '''
+        if not self.accept(frame):
+            return None
+        return loads(frame)
+
+
+def install(stream, event_filter):
+    '''
+    Make a python-binance socket filter and decode its frames with event_filter
+    Returns: False if this python-binance version has no json_loads hook
+    '''
+    if not hasattr(stream, 'json_loads'):
+        return False
+    stream.json_loads = event_filter.loads
+    return True
@@ -0,0 +1,419 @@
+import os
+import sys
+import math
+import bisect
+import time
+from collections import deque
+from rate_limiter import limited_call
+
+# Config
+EMA_FAST = 12
+EMA_SLOW = 26
+WINDOW = 20
+# at most this many empty bars are filled in after a gap without trades
+MAX_GAP_BARS = 1440
+INTERVAL_MS = {
+    '1s': 1000, '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000, '30m': 1800000,
+    '1h': 3600000, '2h': 7200000, '4h': 14400000, '6h': 21600000, '8h': 28800000,
+    '12h': 43200000, '1d': 86400000,
+}
+STORE_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'data_scripts', 'data_download')
+KLINE_COLUMNS = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'quote_volume']
+# index of each of KLINE_COLUMNS in a REST kline row
+KLINE_FIELDS = [0, 1, 2, 3, 4, 5, 7]
+KLINE_LIMIT = 1500
+KLINE_WEIGHT = 10
+
+
+class RingBuffer:
+    '''
+    Fixed size window over the last size values, push returns the value it evicts
+    '''
+    __slots__ = ('size', 'values', 'head', 'count')
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.head = 0
+        self.count = 0
+
+    def push(self, value):
+        '''
+        Returns: the evicted value, None while the buffer is filling
+        '''
+        evicted = self.values[self.head] if self.count == self.size else None
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        return evicted
+
+    def full(self):
+        return self.count == self.size
+
+    def __len__(self):
+        return self.count
+
+
+class EMA:
+    __slots__ = ('alpha', 'value', 'count', 'period')
+
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value = math.nan
+        self.count = 0
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def update(self, x):
+        if self.count:
+            self.value += self.alpha * (x - self.value)
+        else:
+            self.value = x
+        self.count += 1
+        return self.value
+
+
+class RollingStats:
+    '''
+    Mean and sample variance over the last window values, Welford updates for the value
+    coming in and the value falling out of the window
+    '''
+    __slots__ = ('window', 'buffer', 'mean', 'm2')
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = RingBuffer(window)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    @property
+    def ready(self):
+        return self.buffer.full()
+
+    @property
+    def variance(self):
+        n = len(self.buffer)
+        return self.m2 / (n - 1) if n > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def update(self, x):
+        evicted = self.buffer.push(x)
+        if evicted is None:
+            n = len(self.buffer)
+            delta = x - self.mean
+            self.mean += delta / n
+            self.m2 += delta * (x - self.mean)
+        else:
+            # replace evicted by x, the count stays the same
+            delta = x - evicted
+            mean = self.mean + delta / self.window
+            self.m2 += delta * (x - mean + evicted - self.mean)
+            self.mean = mean
+            if self.m2 < 0:
+                self.m2 = 0.0
+        return self.mean
+
+
+class RollingExtreme:
+    '''
+    Rolling min (or max) over the last window values with a monotonic deque, amortised O(1)
+    '''
+    __slots__ = ('window', 'is_max', 'deque', 'index')
+
+    def __init__(self, window, is_max=False):
+        self.window = window
+        self.is_max = is_max
+        self.deque = deque()
+        self.index = 0
+
+    @property
+    def ready(self):
+        return self.index >= self.window
+
+    @property
+    def value(self):
+        return self.deque[0][1] if self.deque else math.nan
+
+    def update(self, x):
+        values = self.deque
+        if self.is_max:
+            while values and values[-1][1] <= x:
+                values.pop()
+        else:
+            while values and values[-1][1] >= x:
+                values.pop()
+        values.append((self.index, x))
+        if values[0][0] <= self.index - self.window:
+            values.popleft()
+        self.index += 1
+        return values[0][1]
+
+
+class RollingVWAP:
+    '''
+    Volume weighted price over the last window bars from their notional and volume
+    '''
+    __slots__ = ('notionals', 'volumes', 'notional', 'volume')
+
+    def __init__(self, window):
+        self.notionals = RingBuffer(window)
+        self.volumes = RingBuffer(window)
+        self.notional = 0.0
+        self.volume = 0.0
+
+    @property
+    def ready(self):
+        return self.volumes.full()
+
+    @property
+    def value(self):
+        return self.notional / self.volume if self.volume > 0 else math.nan
+
+    def update(self, notional, volume):
+        self.notional += notional - (self.notionals.push(notional) or 0.0)
+        self.volume += volume - (self.volumes.push(volume) or 0.0)
+        return self.value
+
+
+def microprice(bid, bid_qty, ask, ask_qty):
+    '''
+    Mid weighted towards the side with less size, where the next trade is more likely to move the price
+    '''
+    size = bid_qty + ask_qty
+    if size <= 0:
+        return (bid + ask) / 2
+    return (bid * ask_qty + ask * bid_qty) / size
+
+
+class IndicatorEngine:
+    '''
+    Bar driven indicators, every update is O(1) and all windows are bounded
+    Live bars come from BarBuilder over trades and historic ones from klines, both go
+    through update, so the values match for the same bars
+    '''
+
+    def __init__(self, ema_fast=EMA_FAST, ema_slow=EMA_SLOW, window=WINDOW):
+        self.ema_fast = EMA(ema_fast)
+        self.ema_slow = EMA(ema_slow)
+        self.stats = RollingStats(window)
+        self.low = RollingExtreme(window)
+        self.high = RollingExtreme(window, is_max=True)
+        self.vwap = RollingVWAP(window)
+        self.open_time = -1
+        self.close = math.nan
+        self.bars = 0
+
+    @property
+    def ready(self):
+        return self.ema_slow.ready and self.stats.ready
+
+    def update(self, open_time, high, low, close, volume, quote_volume):
+        self.open_time = open_time
+        self.close = close
+        self.ema_fast.update(close)
+        self.ema_slow.update(close)
+        self.stats.update(close)
+        self.low.update(low)
+        self.high.update(high)
+        self.vwap.update(quote_volume, volume)
+        self.bars += 1
+
+    def values(self):
+        return {
+            'open_time': self.open_time,
+            'close': self.close,
+            'ema_fast': self.ema_fast.value,
+            'ema_slow': self.ema_slow.value,
+            'mean': self.stats.mean,
+            'std': self.stats.std,
+            'low': self.low.value,
+            'high': self.high.value,
+            'vwap': self.vwap.value,
+        }
+
+
+class BarBuilder:
+    '''
+    Aggregates trades into klines of interval_ms by trade time and hands every closed bar
+    to on_bar(open_time, high, low, close, volume, quote_volume)
+    A bar closes when the first trade of a later bar arrives, bars without trades
+    repeat the previous close with zero volume like binance klines
+    The first live bar started before the first trade seen, it is partial and dropped
+    '''
+
+    def __init__(self, interval_ms, on_bar):
+        self.interval = interval_ms
+        self.on_bar = on_bar
+        self.open_time = -1
+        self.high = self.low = self.close = 0.0
+        self.volume = self.quote_volume = 0.0
+        # bars from the current one on that close without being handed over
+        self.skip = 1
+
+    def seed(self, open_time, close):
+        '''
+        Continue after the last warmup kline, the bars between it and the first trade are filled in
+        '''
+        self.open_time = open_time
+        self.close = close
+        # the seeded bar is already in the indicators, the first live bar is still partial
+        self.skip = 2
+
+    def on_trade(self, trade_time, price, qty):
+        open_time = trade_time - trade_time % self.interval
+        if open_time != self.open_time:
+            if open_time < self.open_time:
+                # before the seeded bar, already in the warmup
+                return
+            if self.open_time >= 0:
+                self.flush(open_time)
+            self.open_time = open_time
+            self.high = self.low = price
+            self.volume = self.quote_volume = 0.0
+        elif price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += qty
+        self.quote_volume += price * qty
+
+    def flush(self, next_open_time):
+        if self.skip:
+            self.skip -= 1
+        else:
+            self.on_bar(self.open_time, self.high, self.low, self.close, self.volume, self.quote_volume)
+        gap = (next_open_time - self.open_time) // self.interval - 1
+        close = self.close
+        for i in range(1, min(gap, MAX_GAP_BARS) + 1):
+            self.on_bar(self.open_time + i * self.interval, close, close, close, 0.0, 0.0)
+
+    def on_agg_trade(self, data, recv_time=0):
+        '''
+        Feed an aggTrade payload: {"p": price, "q": qty, "T": trade time, ...}
+        '''
+        self.on_trade(data['T'], float(data['p']), float(data['q']))
+
+
+def warmup(engine, klines):
+    '''
+    Run historic klines (dict of column arrays) through the engine
+    '''
+    columns = [klines[name].tolist() for name in ('open_time', 'high', 'low', 'close', 'volume', 'quote_volume')]
+    update = engine.update
+    for row in zip(*columns):
+        update(*row)
+    return engine
+
+
+def load_stored_klines(symbol, interval, bars, end, root=None):
+    '''
+    Load the last bars klines with open time before end from the kline store, the store
+    only holds published daily archives, so it usually stops a day or more before end
+    Returns: dict of column name -> list
+    '''
+    import numpy as np
+    if STORE_MODULE not in sys.path:
+        sys.path.append(STORE_MODULE)
+    import kline_store
+
+    store = kline_store.get_store(root) if root else kline_store.get_store()
+    store.refresh()
+    # walk back from the newest month until it holds enough rows, then load from there once
+    start = None
+    count = 0
+    for month in reversed(store.get_months(symbol, interval)):
+        start = month + '-01'
+        open_time = store.get_partition(symbol, interval, month)['open_time']
+        count += int(np.searchsorted(open_time, end, 'left'))
+        if count >= bars:
+            break
+    klines = store.load(symbol, interval, start, end, KLINE_COLUMNS) if start else {}
+    return {name: klines[name][-bars:].tolist() if bars and start else [] for name in KLINE_COLUMNS}
+
+
+async def fetch_klines(client, limiter, symbol, interval, start, end):
+    '''
+    Fetch the klines with open time in [start, end) from REST, KLINE_LIMIT per call
+    Returns: dict of column name -> list
+    '''
+    klines = {name: [] for name in KLINE_COLUMNS}
+    while start < end:
+        rows = await limited_call(limiter, client, KLINE_WEIGHT, client.futures_klines, symbol=symbol,
+                                  interval=interval, startTime=start, endTime=end - 1, limit=KLINE_LIMIT)
+        rows = [row for row in rows if start <= row[0] < end]
+        if not rows:
+            break
+        for name, field in zip(KLINE_COLUMNS, KLINE_FIELDS):
+            cast = int if name == 'open_time' else float
+            klines[name].extend(cast(row[field]) for row in rows)
+        start = rows[-1][0] + INTERVAL_MS[interval]
+    return klines
+
+
+async def load_warmup_klines(client, limiter, symbol, interval, bars, end=None, root=None, logger=None):
+    '''
+    The last bars closed klines before end (ms, default now): the tail of the kline store,
+    backfilled from REST up to end. A series with a gap is cut after its last gap, indicators
+    are only warmed up on consecutive bars
+    Returns: dict of column name -> array
+    '''
+    import numpy as np
+
+    step = INTERVAL_MS[interval]
+    end = end if end is not None else int(time.time() * 1000)
+    end -= end % step
+    first = end - bars * step
+    try:
+        klines = load_stored_klines(symbol, interval, bars, end, root)
+    except (ImportError, OSError, KeyError, ValueError) as e:
+        if logger:
+            logger.error_nowait("load_warmup_klines: kline store not read: {}".format(e))
+        klines = {name: [] for name in KLINE_COLUMNS}
+    # stored rows older than the window are of no use, backfill never reaches back further than it
+    skip = bisect.bisect_left(klines['open_time'], first)
+    klines = {name: values[skip:] for name, values in klines.items()}
+    open_time = klines['open_time']
+    start = open_time[-1] + step if open_time else first
+    if start < end:
+        fetched = await fetch_klines(client, limiter, symbol, interval, start, end)
+        for name in KLINE_COLUMNS:
+            klines[name].extend(fetched[name])
+    open_time = klines['open_time']
+    keep = 0
+    for i in range(len(open_time) - 1, 0, -1):
+        if open_time[i] - open_time[i - 1] != step:
+            keep = i
+            if logger:
+                logger.error_nowait("load_warmup_klines: {} {} gap before {}, warming up on the last {} bars".format(
+                    symbol, interval, open_time[i], len(open_time) - i))
+            break
+    keep = max(keep, len(open_time) - bars)
+    if open_time and open_time[-1] != end - step and logger:
+        logger.error_nowait("load_warmup_klines: {} {} klines stop at {}, not {}".format(
+            symbol, interval, open_time[-1], end - step))
+    return {name: np.array(values[keep:], dtype=np.int64 if name == 'open_time' else np.float64)
+            for name, values in klines.items()}
+
+
+def indicator_series(klines, engine=None):
+    '''
+    Indicator values after every kline, for backtests
+    Returns: dict of name -> list, one entry per kline
+    '''
+    engine = engine or IndicatorEngine()
+    series = {name: [] for name in engine.values()}
+    columns = [klines[name].tolist() for name in ('open_time', 'high', 'low', 'close', 'volume', 'quote_volume')]
+    for row in zip(*columns):
+        engine.update(*row)
+        for name, value in engine.values().items():
+            series[name].append(value)
+    return series
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import queue
+import atexit
+import asyncio
+import threading
+
+from utility import make_path
+from decoder import orjson, loads
+from data_structure.order_manager import EXCHANGE_STATUS, OPEN
+
+# Config
+JOURNAL_FOLDER = 'state'
+JOURNAL_FILE = 'journal.log'
+SNAPSHOT_FILE = 'snapshot.json'
+# a snapshot is taken every SNAPSHOT_INTERVAL seconds once SNAPSHOT_RECORDS records were written since the last
+SNAPSHOT_INTERVAL = 10
+SNAPSHOT_RECORDS = 1000
+# fsync every written batch, survives a host crash at the cost of disk latency on the writer thread
+FSYNC = False
+# params that change while trading and are journaled
+JOURNAL_PARAMS = ('posAmt', 'pnl')
+
+# record kinds
+ADD = 'add'
+STATUS = 'status'
+REPRICE = 'reprice'
+FORGET = 'forget'
+CANCEL_OPEN = 'cancel_open'
+CLEAR = 'clear'
+PARAM = 'param'
+
+_SNAPSHOT = object()
+_STOP = object()
+
+if orjson is not None:
+    def dumps(record):
+        return orjson.dumps(record) + b'\n'
+else:
+    def dumps(record):
+        return json.dumps(record, separators=(',', ':')).encode() + b'\n'
+
+
+class Journal:
+    '''
+    Write-ahead journal of the order state of one symbol
+    Callers only enqueue a tuple, a background thread encodes and appends the records
+    A snapshot replaces the journal: the writer saves it atomically and starts an empty journal,
+    so recovery reads one small snapshot and the records since
+    '''
+
+    def __init__(self, symbol, folder=JOURNAL_FOLDER, fsync=FSYNC):
+        self.symbol = symbol
+        self.folder = os.path.join(folder, symbol)
+        self.journal_path = os.path.join(self.folder, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(self.folder, SNAPSHOT_FILE)
+        self.fsync = fsync
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.writer = None
+
+    def start(self):
+        '''
+        Open the journal for appending after recovery, numbering continues from the last record
+        '''
+        make_path(self.folder)
+        self.file = open(self.journal_path, 'ab')
+        self.writer = threading.Thread(target=self.run, name='journal-' + self.symbol, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+        return self
+
+    def record(self, kind, *args):
+        self.seq += 1
+        self.queue.put((self.seq, kind) + args)
+
+    # order manager hooks
+
+    def add(self, order):
+        self.record(ADD, order.order_id, order.side, order.price, order.qty, order.role,
+                    order.parent.order_id if order.parent is not None else None, order.client_order_id)
+
+    def status(self, order):
+        self.record(STATUS, order.order_id, order.status, order.filled_qty, order.avg_price)
+
+    def reprice(self, order):
+        self.record(REPRICE, order.order_id, order.price)
+
+    def forget(self, order):
+        self.record(FORGET, order.order_id)
+
+    def cancel_open(self):
+        self.record(CANCEL_OPEN)
+
+    def clear(self):
+        self.record(CLEAR)
+
+    def param(self, key, value):
+        if key in JOURNAL_PARAMS:
+            self.record(PARAM, key, value)
+
+    def snapshot(self, orders, params):
+        '''
+        Capture the state now, it is written by the writer thread after every earlier record
+        '''
+        state = {
+            'seq': self.seq,
+            'time': time.time(),
+            'params': {key: params[key] for key in JOURNAL_PARAMS if key in params},
+            # parents are tracked before their children, so rows restore in order
+            'orders': [order_row(order) for order in orders.orders.values()],
+        }
+        self.snapshot_seq = self.seq
+        self.queue.put((_SNAPSHOT, state))
+
+    async def snapshot_loop(self, orders, params, err, interval=SNAPSHOT_INTERVAL, records=SNAPSHOT_RECORDS):
+        while not err.status:
+            await asyncio.sleep(interval)
+            if self.seq - self.snapshot_seq >= records:
+                self.snapshot(orders, params.params)
+
+    # writer thread
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is _STOP:
+                    self.flush()
+                    self.file.close()
+                    return
+                if record[0] is _SNAPSHOT:
+                    self.flush()
+                    self.write_snapshot(record[1])
+                else:
+                    self.file.write(dumps(record))
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def write_snapshot(self, state):
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(dumps(state))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # the snapshot covers every record so far, a crash before this truncate is handled by seq on replay
+        self.file.close()
+        self.file = open(self.journal_path, 'wb')
+
+    def close(self):
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.put(_STOP)
+            self.writer.join()
+
+    # recovery
+
+    def load(self):
+        '''
+        Returns: (snapshot or None, records after it), a torn last record is ignored
+        '''
+        snapshot = None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = loads(f.read())
+        except (OSError, ValueError):
+            pass
+        start = snapshot['seq'] if snapshot else 0
+        records = []
+        try:
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        break
+                    if record[0] > start:
+                        records.append(record)
+        except OSError:
+            pass
+        return snapshot, records
+
+    def restore(self, orders, params):
+        '''
+        Rebuild the order manager and params from the snapshot and the journal
+        Returns: number of records replayed, -1 if there was no saved state
+        '''
+        snapshot, records = self.load()
+        if snapshot is None and not records:
+            return -1
+        orders.clear()
+        self.seq = 0
+        if snapshot is not None:
+            self.seq = snapshot['seq']
+            params.update(snapshot['params'])
+            for row in snapshot['orders']:
+                restore_row(orders, row)
+        for record in records:
+            apply_record(orders, params, record)
+            self.seq = record[0]
+        self.snapshot_seq = self.seq
+        return len(records)
+
+
+def order_row(order):
+    return [order.order_id, order.side, order.price, order.qty, order.role,
+            order.parent.order_id if order.parent is not None else None, order.client_order_id,
+            order.status, order.filled_qty, order.avg_price]
+
+
+def restore_row(orders, row):
+    order_id, side, price, qty, role, parent_id, client_order_id, status, filled_qty, avg_price = row
+    order = orders.add(order_id, side, price, qty, role, parent_id, client_order_id)
+    order.filled_qty = filled_qty
+    order.avg_price = avg_price
+    orders.set_status(order, status)
+
+
+def apply_record(orders, params, record):
+    kind = record[1]
+    if kind == ADD:
+        orders.add(*record[2:])
+    elif kind == STATUS:
+        order_id, status, filled_qty, avg_price = record[2:]
+        order = orders.get(order_id)
+        if order is not None:
+            order.filled_qty = filled_qty
+            order.avg_price = avg_price
+            orders.set_status(order, status)
+    elif kind == REPRICE:
+        orders.reprice(record[2], record[3])
+    elif kind == FORGET:
+        order = orders.get(record[2])
+        if order is not None:
+            orders.forget(order)
+    elif kind == CANCEL_OPEN:
+        orders.cancel_open()
+    elif kind == CLEAR:
+        orders.clear()
+    elif kind == PARAM:
+        params[record[2]] = record[3]
+
+
+def apply_exchange_order(orders, data):
+    '''
+    Apply an order from the REST api (openOrders or a query) to the tracked order
+    Returns: the Order, None if it is not tracked
+    '''
+    order = orders.get(data['orderId'])
+    if order is None:
+        order = orders.get_by_client_id(data.get('clientOrderId'))
+    if order is None:
+        return None
+    status = EXCHANGE_STATUS.get(data['status'])
+    if status is not None and (status != order.status or float(data['executedQty']) != order.filled_qty):
+        orders.fill(order.order_id, float(data['executedQty']), float(data.get('avgPrice') or 0), status)
+    return order
+
+
+def reconcile(orders, open_orders):
+    '''
+    Match the restored orders with the open orders on the exchange
+    Returns: (ids tracked as open but no longer open on the exchange, exchange orders that are not tracked)
+    '''
+    exchange_ids = set()
+    unknown = []
+    for data in open_orders:
+        exchange_ids.add(data['orderId'])
+        if apply_exchange_order(orders, data) is None:
+            unknown.append(data)
+    closed = [order_id for role in orders.open for order_id, order in orders.open[role].items()
+              if order.status in OPEN and order_id not in exchange_ids]
+    return closed, unknown
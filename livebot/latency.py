@@ -0,0 +1,246 @@
+import os
+import json
+import signal
+import time
+import asyncio
+
+from utility import make_path
+
+# Config
+# 2^7 sub-buckets per power of two, values are kept to within 1/64
+SUB_BUCKET_BITS = 7
+# up to 2^36 ns, about 68 seconds
+MAX_BITS = 36
+PERCENTILES = (50, 90, 99, 99.9)
+LOOP_LAG_INTERVAL = 0.1
+EXPORT_FOLDER = 'logs/latency'
+
+# stages, all in ns
+EXCHANGE_TO_RECV = 'exchange_to_recv'
+RECV_TO_BOOK = 'recv_to_book'
+BOOK_TO_DECISION = 'book_to_decision'
+ORDER_ROUND_TRIP = 'order_round_trip'
+DECISION_TO_ACK = 'decision_to_ack'
+FILL_EVENT_TO_RECV = 'fill_event_to_recv'
+FILL_TO_BRACKET_ACK = 'fill_to_bracket_ack'
+LOOP_LAG = 'loop_lag'
+LOG_LAG = 'log_lag'
+
+
+class Histogram:
+    '''
+    HDR style log-linear histogram of non negative integers
+    Values below 2^SUB_BUCKET_BITS are exact, above that every power of two is split
+    into 2^(SUB_BUCKET_BITS-1) buckets, so record is a few integer ops and one list increment
+    '''
+    __slots__ = ('name', 'sub_bits', 'sub_count', 'half', 'counts', 'count', 'total', 'min', 'max', 'clipped')
+
+    def __init__(self, name='', sub_bits=SUB_BUCKET_BITS, max_bits=MAX_BITS):
+        self.name = name
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half = self.sub_count >> 1
+        self.counts = [0] * (self.sub_count + (max_bits - sub_bits + 1) * self.half)
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.clipped = 0
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.clipped = 0
+
+    def index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+    def lowest(self, index):
+        '''
+        Returns: the smallest value that lands in a bucket
+        '''
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        return ((index - self.sub_count) % self.half + self.half) << shift
+
+    def highest(self, index):
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        return self.lowest(index) + (1 << shift) - 1
+
+    def record(self, value):
+        if value < 0:
+            # clocks of two hosts, count it but keep the buckets non negative
+            self.clipped += 1
+            value = 0
+        index = self.index(value)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q):
+        '''
+        Returns: the value at percentile q (0-100), the top of its bucket and never above max
+        '''
+        if not self.count:
+            return 0
+        target = max(1, int(round(q / 100 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.highest(index), self.max)
+        return self.max
+
+    def summary(self, unit=1000):
+        '''
+        Returns: dict of count, clipped, min, mean, percentiles and max divided by unit (ns -> us)
+        '''
+        summary = {'count': self.count, 'clipped': self.clipped}
+        if self.count:
+            summary['min'] = self.min / unit
+            summary['mean'] = self.total / self.count / unit
+            for q in PERCENTILES:
+                summary['p{}'.format(q)] = self.percentile(q) / unit
+            summary['max'] = self.max / unit
+        return summary
+
+    def buckets(self):
+        '''
+        Returns: list of (lowest value, count) of the non empty buckets
+        '''
+        return [(self.lowest(index), count) for index, count in enumerate(self.counts) if count]
+
+
+class Latency:
+    '''
+    Named histograms of pipeline stages
+    Disabled it does nothing, call sites check enabled before taking timestamps
+    '''
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram(stage)
+        return histogram
+
+    def record(self, stage, value):
+        if self.enabled:
+            self.histogram(stage).record(int(value))
+
+    def since(self, stage, start_ns):
+        '''
+        Record the ns elapsed on the wall clock since start_ns
+        '''
+        if self.enabled:
+            self.histogram(stage).record(time.time_ns() - start_ns)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def export(self, buckets=False):
+        '''
+        Returns: dict of stage to its summary in us, with the raw buckets in ns if asked
+        '''
+        export = {}
+        for stage, histogram in self.histograms.items():
+            export[stage] = histogram.summary()
+            if buckets:
+                export[stage]['buckets'] = histogram.buckets()
+        return export
+
+    def report(self):
+        lines = []
+        for stage, summary in self.export().items():
+            if summary['count']:
+                lines.append('{}: n={} p50={:.1f}us p99={:.1f}us p99.9={:.1f}us max={:.1f}us'.format(
+                    stage, summary['count'], summary['p50'], summary['p99'], summary['p99.9'], summary['max']))
+        return lines
+
+    def dump(self, name, folder=EXPORT_FOLDER):
+        '''
+        Write the export with buckets to folder/name_<time>.json
+        Returns: the file path
+        '''
+        make_path(folder)
+        path = os.path.join(folder, '{}_{}.json'.format(name, time.strftime('%Y%m%d_%H%M%S')))
+        with open(path, 'w') as f:
+            json.dump(self.export(buckets=True), f)
+        return path
+
+
+LATENCY = Latency()
+
+
+async def loop_lag_monitor(err, interval=LOOP_LAG_INTERVAL):
+    '''
+    How late the event loop wakes a sleeping task, i.e. time other callbacks held the loop
+    '''
+    interval_ns = int(interval * 1e9)
+    while not err.status:
+        start = time.perf_counter_ns()
+        await asyncio.sleep(interval)
+        LATENCY.record(LOOP_LAG, time.perf_counter_ns() - start - interval_ns)
+
+
+def dump_latency(name, logger):
+    '''
+    Export on demand, e.g. from a SIGUSR1 handler
+    '''
+    path = LATENCY.dump(name)
+    for line in LATENCY.report():
+        logger.info_nowait("latency: " + line)
+    logger.info_nowait("latency: exported to {}".format(path))
+
+
+def instrument_book(on_book_ticker):
+    '''
+    Wrap a bookTicker handler to record exchange to receive and receive to book update,
+    returned unchanged when latency is disabled
+    '''
+    if not LATENCY.enabled:
+        return on_book_ticker
+    exchange_to_recv = LATENCY.histogram(EXCHANGE_TO_RECV)
+    recv_to_book = LATENCY.histogram(RECV_TO_BOOK)
+
+    def handler(data, recv_time=0):
+        recv_time = recv_time or time.time_ns()
+        applied = on_book_ticker(data, recv_time)
+        recv_to_book.record(time.time_ns() - recv_time)
+        exchange_to_recv.record(recv_time - data.get('E', 0) * 1000000)
+        return applied
+    return handler
+
+
+def install_dump_signal(name, logger):
+    '''
+    Dump the histograms on SIGUSR1
+    Returns: False where the loop has no signal handlers
+    '''
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, dump_latency, name, logger)
+    except (NotImplementedError, AttributeError):
+        return False
+    return True
@@ -1,27 +1,108 @@
-import asyncio
+import time
+import queue
+import atexit
 import datetime
+import threading
 from utility import make_path
+from latency import LATENCY, LOG_LAG
+
+INFO = 'INFO'
+ERROR = 'ERROR'
+FLUSH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+
+_STOP = object()
 
 
 class Logger:
-    def __init__(self, path, name):
+    '''
+    Callers only enqueue (timestamp, level, message), a background thread keeps the day's
+    file open, formats the lines and flushes every FLUSH_SIZE lines or FLUSH_INTERVAL seconds
+    '''
+
+    def __init__(self, path, name, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
         self.folder = 'logs'
         self.path = self.folder + '/' + path
         self.name = name
-        self.time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.minute = None
+        self.time = None
+        self.date = None
+        self.file = None
+        self.file_date = None
+        self.queue = queue.SimpleQueue()
+
+        make_path(self.path)
+        self.writer = threading.Thread(target=self.run, name='logger-' + name, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def get_time(self, timestamp):
+        # strftime once a minute, every line in that minute reuses it
+        minute = int(timestamp // 60)
+        if minute != self.minute:
+            now = datetime.datetime.fromtimestamp(minute * 60)
+            self.minute = minute
+            self.time = now.strftime("%Y-%m-%d %H:%M")
+            self.date = now.strftime("%Y-%m-%d")
+        return self.time
 
-    def get_time(self):
-        self.time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    def info_nowait(self, message):
+        self.queue.put((time.time(), INFO, message))
 
-    def get_date(self):
-        self.date = datetime.datetime.now().strftime("%Y-%m-%d")
+    def error_nowait(self, message):
+        self.queue.put((time.time(), ERROR, message))
 
     async def info(self, message):
-        self.get_time()
-        with open(self.path + '/' + self.name + '_' + self.date + '.log', 'a') as f:
-            f.write(self.time + ', INFO: ' + message + '\n')
+        self.queue.put((time.time(), INFO, message))
 
     async def error(self, message):
-        self.get_time()
-        with open(self.path + '/' + self.name + '_' + self.date + '.log', 'a') as f:
-            f.write(self.time + ', ERROR: ' + message + '\n')
+        self.queue.put((time.time(), ERROR, message))
+
+    def close(self):
+        '''
+        Write out everything queued and stop the writer
+        '''
+        if self.writer.is_alive():
+            self.queue.put(_STOP)
+            self.writer.join()
+
+    # writer thread
+
+    def open_file(self):
+        if self.file:
+            self.file.close()
+        self.file_date = self.date
+        self.file = open(self.path + '/' + self.name + '_' + self.date + '.log', 'a')
+
+    def write(self, record):
+        timestamp, level, message = record
+        if LATENCY.enabled:
+            LATENCY.record(LOG_LAG, (time.time() - timestamp) * 1e9)
+        now = self.get_time(timestamp)
+        if self.date != self.file_date:
+            self.open_file()
+        self.file.write(now + ', ' + level + ': ' + message + '\n')
+
+    def run(self):
+        pending = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                self.write(record)
+                pending += 1
+            if pending and (pending >= self.flush_size or time.monotonic() >= deadline):
+                self.file.flush()
+                pending = 0
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+        if self.file:
+            self.file.close()
+            self.file = None
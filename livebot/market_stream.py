@@ -0,0 +1,62 @@
+import time
+import asyncio
+import websockets
+
+from decoder import stream_name, decode_payload
+
+STREAM_URL = 'wss://fstream.binance.com/stream?streams='
+# binance caps a combined stream at 200 streams
+MAX_STREAMS = 200
+RECONNECT_DELAY = 1
+
+
+def combined_stream_url(streams, base=STREAM_URL):
+    return base + '/'.join(streams)
+
+
+class StreamRouter:
+    '''
+    Routing table from combined stream name (e.g. ethusdt@bookTicker) to a handler of its payload
+    The name is read from the raw frame, frames nobody routes are never decoded
+    '''
+
+    def __init__(self):
+        self.routes = {}
+        self.unrouted = 0
+
+    def add(self, stream, handler):
+        self.routes[stream] = handler
+
+    def streams(self):
+        return list(self.routes)
+
+    def dispatch(self, frame, recv_time=0):
+        '''
+        Hand the data of a {"stream": ..., "data": ...} frame and its receive time to its handler
+        Returns: True if it was routed, False otherwise
+        '''
+        handler = self.routes.get(stream_name(frame))
+        if handler is None:
+            self.unrouted += 1
+            return False
+        handler(decode_payload(frame), recv_time)
+        return True
+
+
+async def combined_market_data_socket(url, router, logger, err):
+    '''
+    Read one combined stream and dispatch every frame through the router, reconnecting on drops
+    '''
+    while not err.status:
+        try:
+            async with websockets.connect(url) as stream:
+                logger.info_nowait("combined_market_data_socket: connected to {}".format(url))
+                async for frame in stream:
+                    if err.status:
+                        break
+                    router.dispatch(frame, time.time_ns())
+        except (OSError, websockets.WebSocketException) as e:
+            logger.error_nowait("combined_market_data_socket: {}".format(e))
+        if not err.status:
+            await asyncio.sleep(RECONNECT_DELAY)
+    logger.info_nowait("combined_market_data_socket: socket closed")
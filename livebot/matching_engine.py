@@ -0,0 +1,437 @@
+import time
+import bisect
+from collections import deque
+
+# Config
+MAKER_FEE = 0.0002
+TAKER_FEE = 0.0004
+# closed orders kept queryable, older ones are forgotten
+CLOSED_ORDERS = 100000
+# quantities below this are zero
+EPSILON = 1e-12
+
+BUY = 'BUY'
+SELL = 'SELL'
+LIMIT = 'LIMIT'
+MARKET = 'MARKET'
+GTC = 'GTC'
+IOC = 'IOC'
+# post only, expires instead of taking
+GTX = 'GTX'
+
+# order status and execution types, the exchange names
+NEW = 'NEW'
+PARTIALLY_FILLED = 'PARTIALLY_FILLED'
+FILLED = 'FILLED'
+CANCELED = 'CANCELED'
+EXPIRED = 'EXPIRED'
+TRADE = 'TRADE'
+AMENDMENT = 'AMENDMENT'
+OPEN = (NEW, PARTIALLY_FILLED)
+
+
+class SimOrder:
+    '''
+    One order on the simulated exchange, price in integer ticks
+    queue is the displayed quantity ahead of the order at its price, trades at the price
+    consume it before the order fills
+    '''
+    __slots__ = ('order_id', 'client_order_id', 'account', 'symbol', 'side', 'type', 'time_in_force', 'price',
+                 'qty', 'filled', 'quote', 'status', 'time', 'update_time', 'queue')
+
+    def __init__(self, order_id, account, symbol, side, price, qty, type=LIMIT, time_in_force=GTC,
+                 client_order_id=''):
+        self.order_id = order_id
+        self.client_order_id = client_order_id
+        self.account = account
+        self.symbol = symbol
+        self.side = side
+        self.type = type
+        self.time_in_force = time_in_force
+        self.price = price
+        self.qty = qty
+        self.filled = 0.0
+        # filled quantity times price in ticks, for the average price
+        self.quote = 0.0
+        self.status = NEW
+        self.time = self.update_time = int(time.time() * 1000)
+        self.queue = 0.0
+
+    @property
+    def remaining(self):
+        return self.qty - self.filled
+
+    @property
+    def is_open(self):
+        return self.status in OPEN
+
+    def __repr__(self):
+        return 'SimOrder(id={}, side={}, price={}, qty={}, filled={}, status={}, queue={})'.format(
+            self.order_id, self.side, self.price, self.qty, self.filled, self.status, self.queue)
+
+
+class Position:
+    __slots__ = ('amount', 'entry', 'realized', 'fees')
+
+    def __init__(self):
+        self.amount = 0.0
+        self.entry = 0.0
+        self.realized = 0.0
+        self.fees = 0.0
+
+    def fill(self, side, qty, price, fee):
+        '''
+        Apply a fill at a price, the entry price averages in and closing realises pnl
+        Returns: the pnl realised by this fill
+        '''
+        signed = qty if side == BUY else -qty
+        amount = self.amount
+        realized = 0.0
+        if amount == 0 or (amount > 0) == (signed > 0):
+            self.entry = (self.entry * abs(amount) + price * qty) / (abs(amount) + qty)
+        else:
+            closed = min(qty, abs(amount))
+            realized = closed * (price - self.entry) * (1 if amount > 0 else -1)
+            if qty > abs(amount) + EPSILON:
+                self.entry = price
+        self.amount = amount + signed
+        if abs(self.amount) < EPSILON:
+            self.amount = self.entry = 0.0
+        self.realized += realized
+        self.fees += fee
+        return realized
+
+    def unrealized(self, mark):
+        return self.amount * (mark - self.entry) if self.amount else 0.0
+
+
+class Account:
+    def __init__(self, name):
+        self.name = name
+        self.positions = {}
+
+    def position(self, symbol):
+        position = self.positions.get(symbol)
+        if position is None:
+            position = self.positions[symbol] = Position()
+        return position
+
+
+class Book:
+    '''
+    Price-time priority book of the resting orders of one symbol, next to the top of book of the
+    market it is driven by
+    An order takes the resting orders of the other side and the displayed market quantity it
+    crosses, best price first and oldest first within a price, the rest rests
+    Resting orders fill as makers when the market quote moves through them or trades print at
+    their price, after the queue ahead of them
+    Every change is appended to events as (order, execution type, last qty, last price in ticks, maker)
+    '''
+
+    def __init__(self, symbol, tick_size, maker_fee=MAKER_FEE, taker_fee=TAKER_FEE):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        # price -> deque of orders in time priority, and the sorted prices of each side
+        self.levels = {BUY: {}, SELL: {}}
+        self.prices = {BUY: [], SELL: []}
+        self.orders = {}
+        # market top of book in ticks, quantities left after our takers consumed some
+        self.update_id = 0
+        self.bid = self.ask = 0
+        self.bid_qty = self.ask_qty = 0.0
+        self.last_price = 0
+        self.events = []
+        self.trades = 0
+
+    # resting orders
+
+    def best(self, side):
+        '''
+        Returns: best resting price of a side, None if the side is empty
+        '''
+        prices = self.prices[side]
+        if not prices:
+            return None
+        return prices[-1] if side == BUY else prices[0]
+
+    def rest(self, order):
+        level = self.levels[order.side].get(order.price)
+        if level is None:
+            level = self.levels[order.side][order.price] = deque()
+            bisect.insort(self.prices[order.side], order.price)
+        level.append(order)
+        self.orders[order.order_id] = order
+        # joining the market best waits behind what is displayed there
+        if order.side == BUY:
+            order.queue = self.bid_qty if order.price == self.bid else 0.0
+        else:
+            order.queue = self.ask_qty if order.price == self.ask else 0.0
+
+    def unrest(self, order):
+        levels = self.levels[order.side]
+        level = levels.get(order.price)
+        if level is None:
+            return
+        try:
+            level.remove(order)
+        except ValueError:
+            return
+        if not level:
+            del levels[order.price]
+            prices = self.prices[order.side]
+            del prices[bisect.bisect_left(prices, order.price)]
+        self.orders.pop(order.order_id, None)
+
+    # fills
+
+    def fill(self, order, qty, price, maker):
+        order.filled += qty
+        order.quote += qty * price
+        order.status = FILLED if order.remaining <= EPSILON else PARTIALLY_FILLED
+        order.update_time = int(time.time() * 1000)
+        notional = qty * price * self.tick_size
+        order.account.position(self.symbol).fill(order.side, qty, price * self.tick_size,
+                                                 notional * (self.maker_fee if maker else self.taker_fee))
+        self.events.append((order, TRADE, qty, price, maker))
+        self.last_price = price
+        self.trades += 1
+        if order.status == FILLED:
+            self.unrest(order)
+
+    def crosses(self, side, price, other):
+        return price >= other if side == BUY else price <= other
+
+    def match(self, order):
+        '''
+        Take liquidity best price first, from resting orders oldest first and from the displayed
+        market quantity, which was there before any resting order at the same price
+        '''
+        other = SELL if order.side == BUY else BUY
+        levels = self.levels[other]
+        while order.remaining > EPSILON:
+            best = self.best(other)
+            resting = best is not None and self.crosses(order.side, order.price, best)
+            if order.side == BUY:
+                market, market_qty = self.ask, self.ask_qty
+            else:
+                market, market_qty = self.bid, self.bid_qty
+            displayed = market and market_qty > EPSILON and self.crosses(order.side, order.price, market)
+            if displayed and (not resting or self.crosses(order.side, best, market)):
+                qty = min(order.remaining, market_qty)
+                if order.side == BUY:
+                    self.ask_qty -= qty
+                else:
+                    self.bid_qty -= qty
+                self.fill(order, qty, market, False)
+            elif resting:
+                maker = levels[best][0]
+                qty = min(order.remaining, maker.remaining)
+                self.fill(maker, qty, best, True)
+                self.fill(order, qty, best, False)
+            else:
+                return
+
+    def would_take(self, order):
+        other = SELL if order.side == BUY else BUY
+        best = self.best(other)
+        if best is not None and self.crosses(order.side, order.price, best):
+            return True
+        market = self.ask if order.side == BUY else self.bid
+        return bool(market) and self.crosses(order.side, order.price, market)
+
+    # order entry
+
+    def submit(self, order):
+        '''
+        Match a new order and rest what is left of a GTC or GTX limit order
+        Returns: the order
+        '''
+        if order.type == MARKET:
+            order.price = 1 << 62 if order.side == BUY else 0
+        elif order.time_in_force == GTX and self.would_take(order):
+            order.status = EXPIRED
+            self.events.append((order, EXPIRED, 0.0, 0, False))
+            return order
+        self.events.append((order, NEW, 0.0, 0, False))
+        self.execute(order)
+        return order
+
+    def execute(self, order):
+        self.match(order)
+        if order.remaining > EPSILON:
+            if order.type == MARKET or order.time_in_force == IOC:
+                order.status = EXPIRED
+                self.events.append((order, EXPIRED, 0.0, 0, False))
+            else:
+                self.rest(order)
+
+    def cancel(self, order):
+        '''
+        Returns: the order, None if it is not open
+        '''
+        if not order.is_open:
+            return None
+        self.unrest(order)
+        order.status = CANCELED
+        order.update_time = int(time.time() * 1000)
+        self.events.append((order, CANCELED, 0.0, 0, False))
+        return order
+
+    def amend(self, order, price, qty):
+        '''
+        Change price and quantity of an open order, a new price or a larger quantity
+        loses the time priority, a smaller one at the same price keeps it
+        Returns: the order, None if it is not open or the quantity is already filled
+        '''
+        if not order.is_open or qty <= order.filled:
+            return None
+        order.update_time = int(time.time() * 1000)
+        if price == order.price and qty <= order.qty:
+            order.qty = qty
+            self.events.append((order, AMENDMENT, 0.0, 0, False))
+            return order
+        self.unrest(order)
+        order.price = price
+        order.qty = qty
+        self.events.append((order, AMENDMENT, 0.0, 0, False))
+        self.execute(order)
+        return order
+
+    # market data
+
+    def on_quote(self, update_id, bid, bid_qty, ask, ask_qty):
+        '''
+        Apply a market top of book in ticks, resting orders it moved through fill at their price
+        '''
+        if update_id <= self.update_id:
+            return
+        self.update_id = update_id
+        self.bid, self.bid_qty, self.ask, self.ask_qty = bid, bid_qty, ask, ask_qty
+        # a shrinking best level means orders ahead of ours were cancelled or traded
+        for side, price, qty in ((BUY, bid, bid_qty), (SELL, ask, ask_qty)):
+            level = self.levels[side].get(price)
+            if level:
+                for order in level:
+                    if order.queue > qty:
+                        order.queue = qty
+        self.sweep(BUY, ask)
+        self.sweep(SELL, bid)
+
+    def sweep(self, side, price):
+        '''
+        Fill the resting orders of a side the market quote on the other side crossed
+        '''
+        if not price:
+            return
+        levels = self.levels[side]
+        while True:
+            best = self.best(side)
+            if best is None or not self.crosses(side, best, price):
+                return
+            level = levels[best]
+            while level:
+                self.fill(level[0], level[0].remaining, best, True)
+
+    def on_trade(self, price, qty, buyer_maker):
+        '''
+        Apply a market trade in ticks, a sell aggressor trades against resting buys at or above its
+        price and a buy aggressor against resting sells at or below, up to its quantity
+        '''
+        self.last_price = price
+        side = BUY if buyer_maker else SELL
+        levels = self.levels[side]
+        prices = self.prices[side]
+        if not prices:
+            return
+        if side == BUY:
+            eligible = [p for p in reversed(prices[bisect.bisect_left(prices, price):])]
+        else:
+            eligible = prices[:bisect.bisect_right(prices, price)]
+        for level_price in eligible:
+            level = levels.get(level_price)
+            for order in list(level or ()):
+                if qty <= EPSILON:
+                    return
+                if level_price == price and order.queue > 0:
+                    ahead = min(order.queue, qty)
+                    order.queue -= ahead
+                    qty -= ahead
+                    if qty <= EPSILON:
+                        return
+                filled = min(order.remaining, qty)
+                qty -= filled
+                self.fill(order, filled, level_price, True)
+
+
+class MatchingEngine:
+    '''
+    Books of every simulated symbol and the accounts trading them
+    '''
+
+    def __init__(self, maker_fee=MAKER_FEE, taker_fee=TAKER_FEE):
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.books = {}
+        self.accounts = {}
+        self.orders = {}
+        self.by_client_id = {}
+        self.closed = deque()
+        self.next_id = 1
+
+    def add_symbol(self, symbol, tick_size):
+        book = self.books[symbol] = Book(symbol, tick_size, self.maker_fee, self.taker_fee)
+        return book
+
+    def account(self, name):
+        account = self.accounts.get(name)
+        if account is None:
+            account = self.accounts[name] = Account(name)
+        return account
+
+    def new_order(self, account, symbol, side, price, qty, type=LIMIT, time_in_force=GTC, client_order_id=''):
+        '''
+        Returns: the submitted SimOrder
+        '''
+        order_id = self.next_id
+        self.next_id += 1
+        order = SimOrder(order_id, account, symbol, side, price, qty, type, time_in_force,
+                         client_order_id or 'sim_{}'.format(order_id))
+        self.orders[order_id] = order
+        self.by_client_id[(account.name, order.client_order_id)] = order
+        return self.books[symbol].submit(order)
+
+    def get(self, account, order_id=None, client_order_id=None):
+        '''
+        Returns: the order of an account by id or client id, None if there is none
+        '''
+        if order_id is not None:
+            order = self.orders.get(order_id)
+        else:
+            order = self.by_client_id.get((account.name, client_order_id))
+        if order is None or order.account is not account:
+            return None
+        return order
+
+    def open_orders(self, account, symbol=None):
+        books = [self.books[symbol]] if symbol is not None else self.books.values()
+        return [order for book in books for order in book.orders.values() if order.account is account]
+
+    def drain(self):
+        '''
+        Returns: the events of every book since the last drain
+        '''
+        events = []
+        for book in self.books.values():
+            if book.events:
+                events.extend(book.events)
+                book.events = []
+        for order, execution, _, _, _ in events:
+            if execution != AMENDMENT and not order.is_open and order.order_id in self.orders:
+                self.closed.append(order)
+        while len(self.closed) > CLOSED_ORDERS:
+            order = self.closed.popleft()
+            self.orders.pop(order.order_id, None)
+            self.by_client_id.pop((order.account.name, order.client_order_id), None)
+        return events
@@ -0,0 +1,181 @@
+import asyncio
+from binance import BinanceSocketManager
+
+from logger import Logger
+from utility import create_client
+from order_gateway import OrderGateway, FUTURES_URL
+from symbol_cache import SymbolCache
+from decoder import EventFilter, install, USER_EVENTS
+from latency import LATENCY, loop_lag_monitor, dump_latency, install_dump_signal
+from journal import JOURNAL_FOLDER
+from risk import RISK_KEYWORDS, RiskEngine, read_limits
+import runtime
+from market_stream import (STREAM_URL, MAX_STREAMS, StreamRouter, combined_stream_url,
+                           combined_market_data_socket)
+from simple_strat import (Error, setup_symbol, handle_user_event, regular_order_stream, event_quote_stream,
+                          book_handler, QuoteTrigger, open_journal, load_risk_positions, MAX_ORDER, TAKE_PROFIT, STOP_LOSS, REQUOTE_TICKS)
+
+
+class SymbolState:
+    def __init__(self, symbol, logger, orderbook, params, orders, trigger=None):
+        self.symbol = symbol
+        self.logger = logger
+        self.orderbook = orderbook
+        self.params = params
+        self.orders = orders
+        self.trigger = trigger
+        # user events of this symbol, handled in order by user_event_worker
+        self.events = asyncio.Queue()
+
+
+def user_event_symbols(res):
+    '''
+    Returns: the symbols a user data event is about
+    '''
+    if res.get('e') == 'ORDER_TRADE_UPDATE':
+        return [res['o']['s']]
+    if res.get('e') == 'ACCOUNT_UPDATE':
+        return list({pos['s'] for pos in res['a']['P']})
+    return []
+
+
+async def user_event_worker(gateway, state, err):
+    '''
+    Handle the user events of one symbol in arrival order until None is queued
+    '''
+    while True:
+        res = await state.events.get()
+        if res is None:
+            break
+        await handle_user_event(gateway, state.symbol, state.logger, err,
+                                state.orderbook, state.params, state.orders, res)
+
+
+async def user_data_socket(client, gateway, states, logger, err):
+    '''
+    One user data stream for every symbol, events are queued to the state of the symbol they are about
+    and every symbol handles its own, a fill waiting on its order requests does not hold up the others
+    '''
+    workers = [asyncio.ensure_future(user_event_worker(gateway, state, err)) for state in states.values()]
+    try:
+        bsm = BinanceSocketManager(client)
+        async with bsm.futures_user_socket() as stream:
+            install(stream, EventFilter(USER_EVENTS))
+            while True:
+                if err.status:
+                    await stream.close()
+                    await bsm.stop()
+                    logger.error_nowait("user_data_socket: socket closed")
+                    break
+                try:
+                    res = await stream.recv()
+                except Exception as e:
+                    logger.error_nowait("user_data_socket: {}".format(e))
+                    continue
+                for symbol in user_event_symbols(res):
+                    state = states.get(symbol)
+                    if state is not None:
+                        state.events.put_nowait(res)
+    finally:
+        for state in states.values():
+            state.events.put_nowait(None)
+    await asyncio.gather(*workers)
+
+
+async def run_multi_strat(symbols, api_key, api_secret, url, init_amount, order_interval,
+                          max_order=MAX_ORDER, take_profit=TAKE_PROFIT, stop_loss=STOP_LOSS,
+                          stream_url=STREAM_URL, futures_url=FUTURES_URL, enable_latency=False,
+                          event_quoting=False, requote_ticks=REQUOTE_TICKS, journal_folder=JOURNAL_FOLDER,
+                          risk_limits=None):
+    '''
+    Trade several symbols from one event loop, one client and one symbol cache,
+    with bookTicker for all of them read over combined streams
+    With risk_limits one RiskEngine checks the orders of every symbol against portfolio limits,
+    an empty dict uses the defaults of risk.py
+    '''
+    client = await create_client(api_key, api_secret, url)
+    logger = Logger('multi_strat', 'main')
+    LATENCY.enable(enable_latency)
+    gateway = await OrderGateway(api_key, api_secret, futures_url, logger=logger).start()
+    symbol_cache = await SymbolCache(logger=logger).ensure(client, gateway.limiter)
+    err = Error()
+    risk = RiskEngine(logger=logger, **risk_limits) if risk_limits is not None else None
+
+    states = {}
+    journals = []
+    router = StreamRouter()
+    for symbol in symbols:
+        symbol_logger = Logger('multi_strat', symbol)
+        setup = await setup_symbol(client, gateway.limiter, symbol, symbol_cache, symbol_logger, init_amount,
+                                   order_interval, max_order, take_profit, stop_loss)
+        if setup is None:
+            print("Invalid symbol: {}".format(symbol))
+            continue
+        orderbook, params, orders = setup
+        if risk is not None:
+            orders.risk = risk.add(symbol, orderbook)
+        if journal_folder:
+            journals.append(await open_journal(gateway, symbol, symbol_logger, params, orders, journal_folder))
+        trigger = QuoteTrigger(orderbook, requote_ticks) if event_quoting else None
+        states[symbol] = SymbolState(symbol, symbol_logger, orderbook, params, orders, trigger)
+        router.add(symbol.lower() + '@bookTicker', book_handler(orderbook, trigger))
+    if risk is not None:
+        await load_risk_positions(client, gateway.limiter, risk, logger)
+
+    streams = router.streams()
+    events = [asyncio.ensure_future(combined_market_data_socket(
+        combined_stream_url(streams[i:i + MAX_STREAMS], stream_url), router, logger, err))
+        for i in range(0, len(streams), MAX_STREAMS)]
+    events.append(asyncio.ensure_future(user_data_socket(client, gateway, states, logger, err)))
+    events.append(asyncio.ensure_future(symbol_cache.refresh_loop(client, gateway.limiter, err)))
+    if enable_latency:
+        events.append(asyncio.ensure_future(loop_lag_monitor(err)))
+        install_dump_signal('multi_strat', logger)
+    for state in states.values():
+        if state.orders.journal is not None:
+            events.append(asyncio.ensure_future(state.orders.journal.snapshot_loop(state.orders, state.params, err)))
+        if state.trigger is not None:
+            events.append(asyncio.ensure_future(event_quote_stream(
+                client, gateway, state.symbol, state.logger, err, state.orderbook, state.params, state.orders,
+                state.trigger)))
+        else:
+            events.append(asyncio.ensure_future(regular_order_stream(
+                client, gateway, state.symbol, state.logger, err, state.orderbook, state.params, state.orders)))
+
+    await asyncio.gather(*events)
+    for journal in journals:
+        journal.close()
+    await gateway.close()
+    await client.close_connection()
+    if enable_latency:
+        dump_latency('multi_strat', logger)
+    if risk is not None:
+        logger.info_nowait("run_multi_strat: risk: {}".format(risk.summary()))
+    logger.info_nowait("run_multi_strat: terminated")
+
+
+if __name__ == '__main__':
+    config_keywords = set(
+        ['symbols', 'api_key', 'api_secret', 'url', 'init_amount', 'order_interval'])
+    config_ini = 'config.ini'
+    param = {}
+    with open(config_ini, 'r') as f:
+        for line in f:
+            key, value = line.split(',')
+            if key in config_keywords:
+                param[key] = value.strip('\n')
+                config_keywords.remove(key)
+            elif key in RISK_KEYWORDS:
+                param[key] = value.strip('\n')
+    if len(config_keywords) > 0:
+        print("Missing config keywords: {}".format(config_keywords))
+        exit(1)
+    # symbols are space separated, e.g. symbols,BTCUSDT ETHUSDT
+    symbols = param['symbols'].split()
+    api_key = param['api_key']
+    api_secret = param['api_secret']
+    url = param['url']
+    init_amount = float(param['init_amount'])
+    order_interval = int(param['order_interval'])
+    runtime.run(run_multi_strat(symbols, api_key, api_secret,
+                url, init_amount, order_interval, risk_limits=read_limits(param)))
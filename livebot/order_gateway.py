@@ -0,0 +1,205 @@
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import aiohttp
+from yarl import URL
+from urllib.parse import urlencode
+
+from rate_limiter import RateLimiter
+
+FUTURES_URL = 'https://fapi.binance.com'
+POOL_SIZE = 16
+RECV_WINDOW = 5000
+TIMEOUT = 10
+# batch endpoint limits
+MAX_BATCH_ORDERS = 5
+MAX_BATCH_CANCELS = 10
+
+ORDER = '/fapi/v1/order'
+BATCH_ORDERS = '/fapi/v1/batchOrders'
+ALL_OPEN_ORDERS = '/fapi/v1/allOpenOrders'
+OPEN_ORDERS = '/fapi/v1/openOrders'
+
+# (IP weight, 10s order count, 1m order count) per endpoint
+COSTS = {
+    ('POST', ORDER): (0, 1, 1),
+    ('PUT', ORDER): (1, 1, 1),
+    ('GET', ORDER): (1, 0, 0),
+    ('DELETE', ORDER): (1, 0, 0),
+    ('POST', BATCH_ORDERS): (5, 5, 1),
+    ('DELETE', BATCH_ORDERS): (1, 0, 0),
+    ('DELETE', ALL_OPEN_ORDERS): (1, 0, 0),
+    ('GET', OPEN_ORDERS): (1, 0, 0),
+}
+# openOrders without a symbol
+ALL_SYMBOLS_WEIGHT = 40
+# hosts of a simulator, orders sent there never reach the exchange
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+class OrderResult:
+    '''
+    Outcome of one order action: the exchange payload or error and the round trip latency in ms
+    '''
+    __slots__ = ('data', 'error', 'status', 'latency')
+
+    def __init__(self, data=None, error=None, status=0, latency=0.0):
+        self.data = data
+        self.error = error
+        self.status = status
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return 'OrderResult(ok={}, status={}, latency={:.2f}ms, data={}, error={})'.format(
+            self.ok, self.status, self.latency, self.data, self.error)
+
+
+def split_batch(result):
+    '''
+    Split one batch response into one OrderResult per entry, sharing the request latency
+    '''
+    if not result.ok:
+        return None
+    return [OrderResult(data=entry, status=result.status, latency=result.latency)
+            if 'code' not in entry or 'orderId' in entry else
+            OrderResult(error=entry, status=result.status, latency=result.latency)
+            for entry in result.data]
+
+
+def is_local_url(url):
+    '''
+    Returns: True if url points at this host, as the simulator does
+    '''
+    return URL(url).host in LOCAL_HOSTS
+
+
+class OrderGateway:
+    '''
+    Signed futures REST calls over one keep-alive connection pool
+    Independent actions are sent concurrently, batch endpoints are used where they exist
+    '''
+
+    def __init__(self, api_key, api_secret, url=FUTURES_URL, pool_size=POOL_SIZE, logger=None, limiter=None):
+        self.api_key = api_key
+        self.api_secret = api_secret.encode()
+        self.url = url
+        self.pool_size = pool_size
+        self.logger = logger
+        self.limiter = limiter or RateLimiter(logger=logger)
+        self.session = None
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'X-MBX-APIKEY': self.api_key},
+                timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+            )
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def sign(self, params):
+        params = {key: value for key, value in params.items() if value is not None}
+        params['recvWindow'] = RECV_WINDOW
+        params['timestamp'] = int(time.time() * 1000)
+        query = urlencode(params)
+        signature = hmac.new(self.api_secret, query.encode(), hashlib.sha256).hexdigest()
+        return query + '&signature=' + signature
+
+    async def request(self, method, path, params, cost=None):
+        '''
+        Returns: OrderResult of one signed request
+        '''
+        await self.start()
+        weight, orders_10s, orders_1m = cost or COSTS.get((method, path), (1, 0, 0))
+        await self.limiter.acquire(weight, orders_10s, orders_1m)
+        # the query is sent exactly as signed, yarl would otherwise requote it
+        url = URL(self.url + path + '?' + self.sign(params), encoded=True)
+        timer = time.perf_counter()
+        try:
+            async with self.session.request(method, url) as response:
+                self.limiter.update(response.headers, response.status)
+                data = await response.json(content_type=None)
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            return OrderResult(error={'msg': str(e)}, latency=(time.perf_counter() - timer) * 1000)
+        latency = (time.perf_counter() - timer) * 1000
+        if status >= 400:
+            return OrderResult(error=data, status=status, latency=latency)
+        return OrderResult(data=data, status=status, latency=latency)
+
+    # single actions
+
+    async def create_order(self, symbol, side, type, quantity, price=None, timeInForce=None, **kwargs):
+        params = dict(symbol=symbol, side=side, type=type, quantity=quantity,
+                      price=price, timeInForce=timeInForce, **kwargs)
+        return await self.request('POST', ORDER, params)
+
+    async def cancel_order(self, symbol, orderId=None, origClientOrderId=None):
+        return await self.request('DELETE', ORDER, dict(symbol=symbol, orderId=orderId,
+                                                        origClientOrderId=origClientOrderId))
+
+    async def modify_order(self, symbol, side, quantity, price, orderId=None, origClientOrderId=None):
+        return await self.request('PUT', ORDER, dict(symbol=symbol, side=side, quantity=quantity, price=price,
+                                                     orderId=orderId, origClientOrderId=origClientOrderId))
+
+    async def query_order(self, symbol, orderId=None, origClientOrderId=None):
+        return await self.request('GET', ORDER, dict(symbol=symbol, orderId=orderId,
+                                                     origClientOrderId=origClientOrderId))
+
+    async def cancel_all(self, symbol):
+        return await self.request('DELETE', ALL_OPEN_ORDERS, dict(symbol=symbol))
+
+    async def open_orders(self, symbol=None):
+        cost = None if symbol else (ALL_SYMBOLS_WEIGHT, 0, 0)
+        return await self.request('GET', OPEN_ORDERS, dict(symbol=symbol), cost)
+
+    # batches
+
+    async def create_orders(self, orders):
+        '''
+        Place order dicts through batchOrders, chunks of MAX_BATCH_ORDERS go out concurrently
+        Returns: list of OrderResult, one per order in the same order
+        '''
+        chunks = [orders[i:i + MAX_BATCH_ORDERS] for i in range(0, len(orders), MAX_BATCH_ORDERS)]
+        responses = await asyncio.gather(*(self.request('POST', BATCH_ORDERS, {
+            'batchOrders': json.dumps([{key: str(value) for key, value in order.items() if value is not None}
+                                       for order in chunk], separators=(',', ':'))
+        }) for chunk in chunks))
+        results = []
+        for chunk, response in zip(chunks, responses):
+            results.extend(split_batch(response) or [response] * len(chunk))
+        return results
+
+    async def cancel_orders(self, symbol, order_ids):
+        '''
+        Cancel order ids through batchOrders, chunks of MAX_BATCH_CANCELS go out concurrently
+        Returns: list of OrderResult, one per id in the same order
+        '''
+        order_ids = list(order_ids)
+        chunks = [order_ids[i:i + MAX_BATCH_CANCELS] for i in range(0, len(order_ids), MAX_BATCH_CANCELS)]
+        responses = await asyncio.gather(*(self.request('DELETE', BATCH_ORDERS, {
+            'symbol': symbol,
+            'orderIdList': json.dumps(chunk, separators=(',', ':')),
+        }) for chunk in chunks))
+        results = []
+        for chunk, response in zip(chunks, responses):
+            results.extend(split_batch(response) or [response] * len(chunk))
+        return results
@@ -0,0 +1,159 @@
+import time
+import asyncio
+
+# binance futures defaults, per IP for weight and per account for orders
+WEIGHT_LIMIT = 2400
+ORDER_LIMIT_1M = 1200
+ORDER_LIMIT_10S = 300
+# only plan up to this share of a limit, the rest covers other processes and clock skew
+SAFETY = 0.9
+# informational calls may not take the weight budget past this share, orders keep the rest
+INFO_SHARE = 0.7
+
+ORDER = 0
+INFO = 1
+
+WEIGHT_HEADER = 'X-MBX-USED-WEIGHT-1M'
+ORDER_1M_HEADER = 'X-MBX-ORDER-COUNT-1M'
+ORDER_10S_HEADER = 'X-MBX-ORDER-COUNT-10S'
+
+
+class TokenBucket:
+    '''
+    Budget of one binance limit. Binance counts in fixed windows aligned to the clock,
+    so the bucket refills completely at each window boundary instead of continuously
+    used is our estimate, raised to what the response headers report
+    '''
+    __slots__ = ('name', 'limit', 'interval', 'window', 'used')
+
+    def __init__(self, name, limit, interval):
+        self.name = name
+        self.limit = limit
+        self.interval = interval
+        self.window = 0
+        self.used = 0
+
+    def roll(self, now):
+        window = int(now // self.interval)
+        if window != self.window:
+            self.window = window
+            self.used = 0
+
+    def wait(self, cost, now, share=1.0):
+        '''
+        Returns: seconds until cost fits under share of the limit, 0 if it fits now
+        '''
+        self.roll(now)
+        if not cost or self.used + cost <= self.limit * SAFETY * share:
+            return 0.0
+        return (self.window + 1) * self.interval - now
+
+    def take(self, cost):
+        self.used += cost
+
+    def observe(self, used, now):
+        # requests still in flight are not in the header yet, never lower the estimate
+        self.roll(now)
+        if used > self.used:
+            self.used = used
+
+
+class RateLimiter:
+    '''
+    Shared async limiter for request weight and order counts
+    Callers await acquire before a request and pass the response headers to update
+    Order actions wait only on the full budget, informational calls leave INFO_SHARE
+    of the weight to orders and also wait while any order action is queued
+    '''
+
+    def __init__(self, weight_limit=WEIGHT_LIMIT, order_limit_1m=ORDER_LIMIT_1M,
+                 order_limit_10s=ORDER_LIMIT_10S, logger=None):
+        self.weight = TokenBucket('weight', weight_limit, 60)
+        self.orders_1m = TokenBucket('orders_1m', order_limit_1m, 60)
+        self.orders_10s = TokenBucket('orders_10s', order_limit_10s, 10)
+        self.logger = logger
+        self.blocked_until = 0.0
+        self.waiting_orders = 0
+        self.throttled = 0
+
+    def delay(self, weight, orders_10s, orders_1m, priority, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if priority == INFO and self.waiting_orders:
+            return 0.01
+        share = INFO_SHARE if priority == INFO else 1.0
+        return max(self.weight.wait(weight, now, share),
+                   self.orders_10s.wait(orders_10s, now),
+                   self.orders_1m.wait(orders_1m, now))
+
+    async def acquire(self, weight=1, orders_10s=0, orders_1m=None, priority=ORDER):
+        '''
+        Wait until the request fits every budget, then reserve it
+        orders_1m defaults to orders_10s
+        '''
+        if orders_1m is None:
+            orders_1m = orders_10s
+        if priority == ORDER:
+            self.waiting_orders += 1
+        try:
+            while True:
+                now = time.time()
+                wait = self.delay(weight, orders_10s, orders_1m, priority, now)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            if priority == ORDER:
+                self.waiting_orders -= 1
+        self.weight.take(weight)
+        self.orders_10s.take(orders_10s)
+        self.orders_1m.take(orders_1m)
+
+    def update(self, headers, status=200):
+        '''
+        Sync the budgets from the headers of a response, back off on 429/418
+        '''
+        now = time.time()
+        used = headers.get(WEIGHT_HEADER)
+        if used is not None:
+            self.weight.observe(int(used), now)
+        used = headers.get(ORDER_1M_HEADER)
+        if used is not None:
+            self.orders_1m.observe(int(used), now)
+        used = headers.get(ORDER_10S_HEADER)
+        if used is not None:
+            self.orders_10s.observe(int(used), now)
+        if status in (418, 429):
+            self.throttled += 1
+            retry_after = headers.get('Retry-After')
+            # without Retry-After wait for the weight window to roll over
+            self.weight.roll(now)
+            until = now + int(retry_after) if retry_after else (self.weight.window + 1) * self.weight.interval
+            self.blocked_until = max(self.blocked_until, until)
+            if self.logger:
+                self.logger.error_nowait("RateLimiter: throttled with status {}, blocked for {:.1f}s".format(
+                    status, self.blocked_until - now))
+
+    def remaining(self):
+        '''
+        Returns: dict of predicted remaining budget per limit
+        '''
+        now = time.time()
+        budget = {}
+        for bucket in (self.weight, self.orders_1m, self.orders_10s):
+            bucket.roll(now)
+            budget[bucket.name] = bucket.limit - bucket.used
+        return budget
+
+
+async def limited_call(limiter, client, weight, method, *args, **kwargs):
+    '''
+    Run an informational python-binance call under the limiter and sync from its response
+    '''
+    await limiter.acquire(weight, priority=INFO)
+    try:
+        return await method(*args, **kwargs)
+    finally:
+        response = getattr(client, 'response', None)
+        if response is not None:
+            limiter.update(response.headers, response.status)
@@ -0,0 +1,271 @@
+import os
+import glob
+import mmap
+import time
+import struct
+import heapq
+import asyncio
+
+import numpy as np
+
+from utility import make_path
+
+# Config
+RECORD_FOLDER = 'recordings'
+# one writer per stream, the feed may run on another thread than the user data socket
+MARKET = 'market'
+USER = 'user'
+# records per segment file, 72MB at 72 bytes a record
+SEGMENT_RECORDS = 1 << 20
+# full speed replay yields to the loop every this many records
+REPLAY_BATCH = 1000
+
+# record kinds
+BOOK_TICKER = 1
+AGG_TRADE = 2
+ORDER_UPDATE = 3
+ACCOUNT_UPDATE = 4
+MARKET_KINDS = (BOOK_TICKER, AGG_TRADE)
+
+SIDES = ('', 'BUY', 'SELL')
+SIDE_CODES = {side: code for code, side in enumerate(SIDES)}
+STATUSES = ('', 'NEW', 'PARTIALLY_FILLED', 'FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'NEW_INSURANCE', 'NEW_ADL')
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# one fixed width record for every kind, little endian and packed
+#   bookTicker:     id=u, p1..p4 = bid, bid qty, ask, ask qty
+#   aggTrade:       id=a, side=1 if the buyer is the maker, p1 = price, p2 = qty, p3 = trade time
+#   order update:   id=i, side, status, p1 = price, p2 = qty, p3 = filled qty, p4 = average price, p5 = last price
+#   account update: one record per position of the symbol, p1 = amount, p2 = unrealised pnl, p3 = entry price
+RECORD = struct.Struct('<qqqBBB5xddddd')
+DTYPE = np.dtype([('recv_ns', '<i8'), ('event_ms', '<i8'), ('id', '<i8'), ('kind', 'u1'), ('side', 'u1'),
+                  ('status', 'u1'), ('pad', 'V5'), ('p1', '<f8'), ('p2', '<f8'), ('p3', '<f8'),
+                  ('p4', '<f8'), ('p5', '<f8')])
+assert DTYPE.itemsize == RECORD.size
+
+
+class Recorder:
+    '''
+    Feed or user events of one symbol as fixed width records in .npy segment files
+    A segment is preallocated and memory mapped, a record is packed straight into the map,
+    so recording allocates nothing beyond the float conversions and never calls write
+    Unused rows stay zero: the valid rows of a segment are the prefix with recv_ns > 0,
+    also after a crash, since the kernel keeps the mapped pages
+    '''
+
+    def __init__(self, symbol, folder=RECORD_FOLDER, stream=MARKET, segment_records=SEGMENT_RECORDS):
+        self.symbol = symbol
+        self.stream = stream
+        self.folder = os.path.join(folder, symbol)
+        self.segment_records = segment_records
+        self.file = None
+        self.map = None
+        self.offset = 0
+        self.end = 0
+        self.segments = 0
+        self.count = 0
+        self.pack_into = RECORD.pack_into
+        make_path(self.folder)
+
+    def open_segment(self):
+        self.close()
+        path = os.path.join(self.folder, '{}_{}_{:04d}.npy'.format(
+            self.stream, time.strftime('%Y%m%d_%H%M%S'), self.segments))
+        # writes the header and sizes the file
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=DTYPE, shape=(self.segment_records,))
+        header = array.offset
+        del array
+        self.file = open(path, 'r+b')
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self.file.fileno(), 0, header + self.segment_records * RECORD.size)
+        # fault the pages in now rather than one by one on the hot path
+        self.map = mmap.mmap(self.file.fileno(), 0, flags=mmap.MAP_SHARED | getattr(mmap, 'MAP_POPULATE', 0))
+        self.offset = header
+        self.end = header + self.segment_records * RECORD.size
+        self.segments += 1
+
+    def write(self, recv_ns, event_ms, record_id, kind, side=0, status=0, p1=0.0, p2=0.0, p3=0.0, p4=0.0, p5=0.0):
+        if self.offset >= self.end:
+            self.open_segment()
+        self.pack_into(self.map, self.offset, recv_ns, event_ms, record_id, kind, side, status, p1, p2, p3, p4, p5)
+        self.offset += RECORD.size
+        self.count += 1
+
+    def on_book_ticker(self, data, recv_time=0):
+        self.write(recv_time or time.time_ns(), data.get('E', 0), data['u'], BOOK_TICKER, 0, 0,
+                   float(data['b']), float(data['B']), float(data['a']), float(data['A']))
+
+    def on_book(self, state, tick_size=0.0):
+        '''
+        Record a TopOfBook state tuple the handler already parsed, ticks are turned back into prices
+        '''
+        if self.offset >= self.end:
+            self.open_segment()
+        update_id, bid, bid_qty, ask, ask_qty, event_time, recv_time = state
+        if tick_size:
+            bid *= tick_size
+            ask *= tick_size
+        self.pack_into(self.map, self.offset, recv_time, event_time, update_id, BOOK_TICKER, 0, 0,
+                       bid, bid_qty, ask, ask_qty, 0.0)
+        self.offset += RECORD.size
+        self.count += 1
+
+    def recording_book(self, handler, orderbook):
+        '''
+        Wrap a bookTicker handler to record the book after every applied update
+        '''
+        on_book = self.on_book
+        tick_size = orderbook.scale.tick_size if orderbook.scale is not None else 0.0
+
+        def recorded(data, recv_time=0):
+            applied = handler(data, recv_time)
+            if applied:
+                on_book(orderbook.state, tick_size)
+            return applied
+        return recorded
+
+    def on_agg_trade(self, data, recv_time=0):
+        self.write(recv_time or time.time_ns(), data.get('E', 0), data['a'], AGG_TRADE, 1 if data.get('m') else 0, 0,
+                   float(data['p']), float(data['q']), float(data['T']))
+
+    def on_user_event(self, res, recv_time=0):
+        recv_time = recv_time or time.time_ns()
+        if res['e'] == 'ORDER_TRADE_UPDATE':
+            o = res['o']
+            if o['s'] == self.symbol:
+                self.write(recv_time, res['E'], o['i'], ORDER_UPDATE, SIDE_CODES.get(o['S'], 0),
+                           STATUS_CODES.get(o['X'], 0), float(o['p']), float(o['q']), float(o['z']),
+                           float(o.get('ap') or 0), float(o.get('L') or 0))
+        elif res['e'] == 'ACCOUNT_UPDATE':
+            for pos in res['a']['P']:
+                if pos['s'] == self.symbol and pos['ps'] == 'BOTH':
+                    self.write(recv_time, res['E'], 0, ACCOUNT_UPDATE, 0, 0,
+                               float(pos['pa']), float(pos['up']), float(pos.get('ep') or 0))
+
+    def recording(self, handler, record):
+        '''
+        Wrap a feed handler to record every message it is given
+        '''
+        def recorded(data, recv_time=0):
+            recv_time = recv_time or time.time_ns()
+            record(data, recv_time)
+            return handler(data, recv_time)
+        return recorded
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
+            self.offset = self.end = 0
+
+
+def segment_paths(folder, symbol, stream):
+    return sorted(glob.glob(os.path.join(folder, symbol, stream + '_*.npy')))
+
+
+def valid_rows(records):
+    '''
+    Returns: number of written rows, found by bisection on recv_ns > 0
+    '''
+    recv_ns = records['recv_ns']
+    low, high = 0, len(recv_ns)
+    while low < high:
+        middle = (low + high) // 2
+        if recv_ns[middle] > 0:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def load_segment(path):
+    '''
+    Returns: the written records of a segment as a read only structured array
+    '''
+    records = np.load(path, mmap_mode='r')
+    return records[:valid_rows(records)]
+
+
+def load_records(symbol, folder=RECORD_FOLDER, start_ns=0, end_ns=None, kinds=None):
+    '''
+    Returns: the records of a symbol received in [start_ns, end_ns) over all streams and segments
+    '''
+    parts = []
+    for path in segment_paths(folder, symbol, MARKET) + segment_paths(folder, symbol, USER):
+        records = load_segment(path)
+        if not len(records):
+            continue
+        records = records[records['recv_ns'] >= start_ns]
+        if end_ns is not None:
+            records = records[records['recv_ns'] < end_ns]
+        if kinds is not None:
+            records = records[np.isin(records['kind'], kinds)]
+        parts.append(np.asarray(records))
+    if not parts:
+        return np.zeros(0, dtype=DTYPE)
+    records = np.concatenate(parts)
+    return records[np.argsort(records['recv_ns'], kind='stable')]
+
+
+def to_message(symbol, row):
+    '''
+    Rebuild the payload the live handlers get from a record, prices stay floats
+    '''
+    recv_ns, event_ms, record_id, kind, side, status, _, p1, p2, p3, p4, p5 = row
+    if kind == BOOK_TICKER:
+        return {'e': 'bookTicker', 'u': record_id, 's': symbol, 'E': event_ms, 'b': p1, 'B': p2, 'a': p3, 'A': p4}
+    if kind == AGG_TRADE:
+        return {'e': 'aggTrade', 'a': record_id, 's': symbol, 'E': event_ms, 'p': p1, 'q': p2, 'T': int(p3), 'm': side == 1}
+    if kind == ORDER_UPDATE:
+        return {'e': 'ORDER_TRADE_UPDATE', 'E': event_ms, 'T': event_ms, 'o': {
+            's': symbol, 'i': record_id, 'c': '', 'S': SIDES[side], 'X': STATUSES[status], 'p': str(p1), 'q': str(p2),
+            'z': str(p3), 'ap': str(p4), 'L': str(p5)}}
+    return {'e': 'ACCOUNT_UPDATE', 'E': event_ms, 'T': event_ms, 'a': {'P': [
+        {'s': symbol, 'ps': 'BOTH', 'pa': str(p1), 'up': str(p2), 'ep': str(p3)}]}}
+
+
+def iter_stream(symbol, paths, kinds=None):
+    for path in paths:
+        for row in load_segment(path).tolist():
+            if kinds is None or row[3] in kinds:
+                yield row[3], to_message(symbol, row), row[0]
+
+
+def iter_messages(symbol, folder=RECORD_FOLDER, kinds=None):
+    '''
+    Yield (kind, message, recv_ns) of a symbol in receive order, the streams merged
+    '''
+    streams = [iter_stream(symbol, segment_paths(folder, symbol, stream), kinds) for stream in (MARKET, USER)]
+    return heapq.merge(*streams, key=lambda message: message[2])
+
+
+async def replay(symbol, handlers, folder=RECORD_FOLDER, speed=0, err=None):
+    '''
+    Feed recorded messages to handlers {kind: handler(message, recv_time)}, kinds without a
+    handler are skipped and coroutine handlers are awaited
+    speed 0 replays as fast as possible, 1 at the recorded pace, 2 twice as fast, ...
+    recv_time is the recorded receive time, keep latency disabled while replaying
+    Returns: number of messages replayed
+    '''
+    kinds = tuple(handlers)
+    count = 0
+    first = start = None
+    for kind, message, recv_ns in iter_messages(symbol, folder, kinds):
+        if err is not None and err.status:
+            break
+        if speed:
+            if first is None:
+                first, start = recv_ns, time.perf_counter()
+            delay = (recv_ns - first) / 1e9 / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif count % REPLAY_BATCH == 0:
+            await asyncio.sleep(0)
+        result = handlers[kind](message, recv_ns)
+        if asyncio.iscoroutine(result):
+            await result
+        count += 1
+    return count
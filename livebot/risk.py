@@ -0,0 +1,277 @@
+from data_structure.order_manager import REGULAR_ORDER
+from rate_limiter import limited_call
+
+# Config
+# limits of one symbol, 0 disables a check
+# position plus the open regular orders of a side if they all fill, in the quote asset
+MAX_NOTIONAL = 1000.0
+# open orders of every role
+MAX_OPEN_ORDERS = 10
+# farthest a regular limit price may be from the mid, as a fraction of the mid
+PRICE_BAND = 0.02
+# limits of the portfolio, 0 disables a check
+MAX_PORTFOLIO_NOTIONAL = 5000.0
+MAX_PORTFOLIO_ORDERS = 50
+# the kill switch trips once the unrealised pnl of the portfolio falls below -MAX_LOSS
+MAX_LOSS = 500.0
+POSITION_WEIGHT = 5
+
+# optional config.ini keys of the limits, the risk engine only runs when at least one is set,
+# e.g. max_notional,1000, and the limits left out are disabled, not the defaults above
+RISK_KEYWORDS = {
+    'max_notional': float,
+    'max_open_orders': int,
+    'price_band': float,
+    'max_portfolio_notional': float,
+    'max_portfolio_orders': int,
+    'max_loss': float,
+}
+
+# rejection reasons, a rejected order is not sent and logged as an error:
+#   Order rejected - side: BUY, price: 100.0, amount: 1.0, risk: max notional
+#   Amend rejected - id: 123, side: BUY, price: 100.0, risk: outside price band
+# the kill switch logs once: Kill switch: unrealised pnl -501.00 below -500.0
+KILL_SWITCH = 'kill switch'
+NOTIONAL_LIMIT = 'max notional'
+PORTFOLIO_NOTIONAL_LIMIT = 'max portfolio notional'
+OPEN_ORDER_LIMIT = 'max open orders'
+PORTFOLIO_ORDER_LIMIT = 'max portfolio open orders'
+OUTSIDE_BAND = 'outside price band'
+NO_BOOK = 'no book'
+
+BUY = 'BUY'
+
+
+class RiskEngine:
+    '''
+    Pre-trade checks over every traded symbol
+    Position, open order exposure and unrealised pnl are kept as running totals per symbol
+    and for the portfolio, every change applies a delta, so a check reads a few numbers and
+    never walks orders or symbols
+    '''
+
+    def __init__(self, max_notional=MAX_NOTIONAL, max_open_orders=MAX_OPEN_ORDERS, price_band=PRICE_BAND,
+                 max_portfolio_notional=MAX_PORTFOLIO_NOTIONAL, max_portfolio_orders=MAX_PORTFOLIO_ORDERS,
+                 max_loss=MAX_LOSS, logger=None):
+        self.max_notional = max_notional
+        self.max_open_orders = max_open_orders
+        self.price_band = price_band
+        self.max_portfolio_notional = max_portfolio_notional
+        self.max_portfolio_orders = max_portfolio_orders
+        self.max_loss = max_loss
+        self.logger = logger
+        self.symbols = {}
+        # portfolio aggregates, the sums of the symbol aggregates
+        self.exposure = 0.0
+        self.open_orders = 0
+        self.unrealized = 0.0
+        self.killed = None
+        self.rejected = {}
+
+    def add(self, symbol, orderbook=None):
+        '''
+        Returns: the SymbolRisk of a symbol, hook it into its OrderManager as orders.risk
+        '''
+        risk = self.symbols.get(symbol)
+        if risk is None:
+            risk = self.symbols[symbol] = SymbolRisk(self, symbol, orderbook)
+        elif orderbook is not None:
+            risk.set_book(orderbook)
+        return risk
+
+    def kill(self, reason):
+        '''
+        Block every new regular order until reset, bracket orders still go through
+        '''
+        if self.killed is None:
+            self.killed = reason
+            if self.logger:
+                self.logger.error_nowait("Kill switch: {}".format(reason))
+
+    def reset(self):
+        self.killed = None
+
+    def reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return reason
+
+    def on_position(self, symbol, amount, unrealized, entry_price):
+        risk = self.symbols.get(symbol)
+        if risk is not None:
+            risk.on_position(amount, unrealized, entry_price)
+
+    def summary(self):
+        return {'exposure': self.exposure, 'open_orders': self.open_orders, 'unrealized': self.unrealized,
+                'killed': self.killed, 'rejected': dict(self.rejected),
+                'symbols': {symbol: risk.summary() for symbol, risk in self.symbols.items()}}
+
+
+class SymbolRisk:
+    '''
+    Risk aggregates of one symbol, updated through the same hooks as the journal
+    position: signed notional of the position at the mark price, long positive
+    buy/sell: notional left to fill of the open regular orders of a side
+    exposure: the larger of the position if every open buy fills or if every open sell fills
+    '''
+    __slots__ = ('engine', 'symbol', 'orderbook', 'tick_size', 'position', 'unrealized', 'buy', 'sell',
+                 'exposure', 'working')
+
+    def __init__(self, engine, symbol, orderbook=None):
+        self.engine = engine
+        self.symbol = symbol
+        self.orderbook = None
+        self.tick_size = 0.0
+        self.position = 0.0
+        self.unrealized = 0.0
+        self.buy = 0.0
+        self.sell = 0.0
+        self.exposure = 0.0
+        # order_id -> (side, notional counted in buy/sell) of the open orders
+        self.working = {}
+        if orderbook is not None:
+            self.set_book(orderbook)
+
+    def set_book(self, orderbook):
+        self.orderbook = orderbook
+        self.tick_size = orderbook.scale.tick_size if orderbook.scale is not None else 0.0
+
+    def refresh(self):
+        exposure = max(abs(self.position + self.buy), abs(self.position - self.sell))
+        self.engine.exposure += exposure - self.exposure
+        self.exposure = exposure
+
+    def check(self, side, qty, price, role=REGULAR_ORDER, replaces=None):
+        '''
+        Pre-trade check of a new order, or of an amend when replaces is the amended Order
+        Bracket orders only close the position and always pass
+        Returns: None if the order may be sent, else the rejection reason
+        '''
+        if role != REGULAR_ORDER:
+            return None
+        engine = self.engine
+        if engine.killed is not None:
+            return engine.reject(KILL_SWITCH)
+        notional = qty * price
+        buy, sell = self.buy, self.sell
+        added = 1
+        if replaces is not None:
+            counted = self.working.get(replaces.order_id)
+            if counted is not None:
+                added = 0
+                if counted[0] == BUY:
+                    buy -= counted[1]
+                else:
+                    sell -= counted[1]
+        if added:
+            if engine.max_open_orders and len(self.working) >= engine.max_open_orders:
+                return engine.reject(OPEN_ORDER_LIMIT)
+            if engine.max_portfolio_orders and engine.open_orders >= engine.max_portfolio_orders:
+                return engine.reject(PORTFOLIO_ORDER_LIMIT)
+        if side == BUY:
+            buy += notional
+        else:
+            sell += notional
+        exposure = max(abs(self.position + buy), abs(self.position - sell))
+        # an order that lowers the exposure is always allowed
+        if exposure > self.exposure:
+            if engine.max_notional and exposure > engine.max_notional:
+                return engine.reject(NOTIONAL_LIMIT)
+            if engine.max_portfolio_notional and \
+                    engine.exposure + exposure - self.exposure > engine.max_portfolio_notional:
+                return engine.reject(PORTFOLIO_NOTIONAL_LIMIT)
+        if engine.price_band and self.orderbook is not None:
+            state = self.orderbook.state
+            if state[0] < 0:
+                return engine.reject(NO_BOOK)
+            mid = (state[1] + state[3]) * 0.5
+            if self.tick_size:
+                mid *= self.tick_size
+            if abs(price - mid) > mid * engine.price_band:
+                return engine.reject(OUTSIDE_BAND)
+        return None
+
+    def on_position(self, amount, unrealized, entry_price):
+        '''
+        Apply the position of an ACCOUNT_UPDATE, trips the kill switch past the loss limit
+        '''
+        engine = self.engine
+        # the notional at the mark price, entry notional plus the unrealised pnl
+        self.position = amount * entry_price + unrealized
+        self.refresh()
+        engine.unrealized += unrealized - self.unrealized
+        self.unrealized = unrealized
+        if engine.max_loss and engine.unrealized < -engine.max_loss:
+            engine.kill("unrealised pnl {:.2f} below -{}".format(engine.unrealized, engine.max_loss))
+
+    def summary(self):
+        return {'position': self.position, 'unrealized': self.unrealized, 'buy': self.buy, 'sell': self.sell,
+                'exposure': self.exposure, 'open_orders': len(self.working)}
+
+    # order manager hooks
+
+    def count(self, order):
+        '''
+        Move the order from what it counted in the aggregates to what it counts now
+        '''
+        counted = self.working.pop(order.order_id, None)
+        if counted is not None:
+            self.remove(counted)
+        is_open = order.is_open
+        if is_open:
+            notional = (order.qty - order.filled_qty) * order.price if order.role == REGULAR_ORDER else 0.0
+            self.working[order.order_id] = (order.side, notional)
+            if order.side == BUY:
+                self.buy += notional
+            else:
+                self.sell += notional
+        self.engine.open_orders += is_open - (counted is not None)
+        self.refresh()
+
+    def remove(self, counted):
+        if counted[0] == BUY:
+            self.buy -= counted[1]
+        else:
+            self.sell -= counted[1]
+
+    def add(self, order):
+        self.count(order)
+
+    def status(self, order):
+        self.count(order)
+
+    def reprice(self, order):
+        self.count(order)
+
+    def cancel_open(self):
+        self.engine.open_orders -= len(self.working)
+        self.working = {}
+        self.buy = self.sell = 0.0
+        self.refresh()
+
+    def clear(self):
+        self.cancel_open()
+
+
+def read_limits(param):
+    '''
+    Limits from the config.ini values of RISK_KEYWORDS, a key that is not set is 0 and its check disabled
+    Returns: dict of RiskEngine keyword -> limit, None when no limit is set
+    '''
+    if not any(key in param for key in RISK_KEYWORDS):
+        return None
+    return {key: cast(param[key]) if key in param else cast(0) for key, cast in RISK_KEYWORDS.items()}
+
+
+async def load_positions(client, limiter, engine):
+    '''
+    Seed the positions from positionRisk, ACCOUNT_UPDATE only reports changes
+    Returns: number of positions applied
+    '''
+    positions = await limited_call(limiter, client, POSITION_WEIGHT, client.futures_position_information)
+    count = 0
+    for pos in positions:
+        if pos.get('positionSide', 'BOTH') == 'BOTH' and pos['symbol'] in engine.symbols:
+            engine.on_position(pos['symbol'], float(pos['positionAmt']), float(pos['unRealizedProfit']),
+                               float(pos['entryPrice']))
+            count += 1
+    return count
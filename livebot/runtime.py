@@ -0,0 +1,335 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from logger import Logger
+from data_structure.orderbook import TopOfBook
+
+# Config
+# 'auto' uses uvloop when it is installed, 'uvloop' requires it, 'asyncio' is the default loop
+LOOP_POLICY = 'auto'
+INLINE = 'inline'
+THREAD = 'thread'
+PROCESS = 'process'
+FEED_MODES = (INLINE, THREAD, PROCESS)
+FEED_CHECK = 1
+FEED_JOIN_TIMEOUT = 5
+
+# shared top of book layout, int64 slots then float64 slots
+SEQ, UPDATE_ID, EVENT_TIME, RECV_TIME, PENDING = range(5)
+INT_SLOTS = 5
+BID, BID_QTY, ASK, ASK_QTY = range(4)
+FLOAT_SLOTS = 4
+SHARED_SIZE = (INT_SLOTS + FLOAT_SLOTS) * 8
+# reads of a torn snapshot before the reader gives up, a writer that died mid write leaves seq odd
+SEQLOCK_SPINS = 100000
+
+
+def new_event_loop(policy=LOOP_POLICY):
+    '''
+    Returns: a new event loop of the policy, uvloop if asked for and installed
+    '''
+    if policy not in ('auto', 'uvloop', 'asyncio'):
+        raise ValueError("unknown event loop policy: {}".format(policy))
+    if policy != 'asyncio':
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            if policy == 'uvloop':
+                raise
+    return asyncio.new_event_loop()
+
+
+def loop_name(loop):
+    return type(loop).__module__.split('.')[0]
+
+
+def parse_cpus(cpus):
+    '''
+    CPU set from "2,3", "4-7" or an iterable of ints
+    Returns: set of cpu ids, empty for None or ""
+    '''
+    if not cpus:
+        return set()
+    if not isinstance(cpus, str):
+        return set(int(cpu) for cpu in cpus)
+    result = set()
+    for part in cpus.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            result.update(range(int(first), int(last) + 1))
+        elif part:
+            result.add(int(part))
+    return result
+
+
+def pin(cpus, tid=0):
+    '''
+    Pin a thread (tid 0 is the calling thread) to cpus
+    Returns: False where the platform has no affinity control or cpus is empty
+    '''
+    cpus = parse_cpus(cpus)
+    if not cpus or not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(tid, cpus)
+    return True
+
+
+def run(coro, policy=LOOP_POLICY, cpus=None):
+    '''
+    asyncio.run on a loop of the policy, with the main thread pinned to cpus
+    '''
+    pin(cpus)
+    loop = new_event_loop(policy)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class Mailbox:
+    '''
+    Wake-up of a loop from another thread with at most one call in flight
+    The data itself is the single slot the producer overwrites (e.g. the TopOfBook state tuple),
+    the consumer reads whatever is latest when it runs, so a burst of updates costs one callback
+    '''
+
+    def __init__(self, loop, on_update):
+        self.loop = loop
+        self.on_update = on_update
+        self.pending = False
+
+    def notify(self):
+        if not self.pending:
+            self.pending = True
+            self.loop.call_soon_threadsafe(self.deliver)
+
+    def deliver(self):
+        self.pending = False
+        self.on_update()
+
+    # stands in for a QuoteTrigger on the feed side
+    on_book = notify
+
+
+class SharedTopOfBook(TopOfBook):
+    '''
+    TopOfBook whose state lives in shared memory, written by the feed process and read by the
+    strategy process without a lock: a seqlock, the writer makes seq odd while it writes
+    and readers retry until they read the same even seq before and after the fields,
+    up to SEQLOCK_SPINS times, then the book reads as empty
+    The writer sends one byte through conn when the reader has no pending wake-up
+    '''
+    __slots__ = ('shm', 'ints', 'floats', 'conn', 'owner')
+
+    def __init__(self, symbol='', scale=None, name=None, conn=None):
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=SHARED_SIZE)
+        self.ints = self.shm.buf[:INT_SLOTS * 8].cast('q')
+        self.floats = self.shm.buf[INT_SLOTS * 8:SHARED_SIZE].cast('d')
+        self.conn = conn
+        if self.owner:
+            self.ints[SEQ] = 0
+            self.ints[PENDING] = 0
+        TopOfBook.__init__(self, symbol, scale)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def state(self):
+        ints, floats = self.ints, self.floats
+        for _ in range(SEQLOCK_SPINS):
+            seq = ints[SEQ]
+            if seq & 1:
+                continue
+            state = (ints[UPDATE_ID], floats[BID], floats[BID_QTY], floats[ASK], floats[ASK_QTY],
+                     ints[EVENT_TIME], ints[RECV_TIME])
+            if ints[SEQ] == seq:
+                break
+        else:
+            return TopOfBook.EMPTY
+        if self.scale is not None and state[0] >= 0:
+            return (state[0], int(state[1]), state[2], int(state[3]), state[4], state[5], state[6])
+        return state
+
+    @state.setter
+    def state(self, state):
+        ints, floats = self.ints, self.floats
+        ints[SEQ] += 1
+        ints[UPDATE_ID], floats[BID], floats[BID_QTY], floats[ASK], floats[ASK_QTY], \
+            ints[EVENT_TIME], ints[RECV_TIME] = state
+        ints[SEQ] += 1
+
+    def update(self, update_id, bid, bid_qty, ask, ask_qty, event_time=0, recv_time=0):
+        applied = TopOfBook.update(self, update_id, bid, bid_qty, ask, ask_qty, event_time, recv_time)
+        if applied and self.conn is not None and not self.ints[PENDING]:
+            self.ints[PENDING] = 1
+            self.conn.send_bytes(b'\0')
+        return applied
+
+    def drain(self):
+        '''
+        Reader side: consume the wake-ups and re-arm the writer
+        Returns: False once the writer end of the pipe is gone
+        '''
+        try:
+            while self.conn.poll():
+                self.conn.recv_bytes()
+        except (EOFError, OSError):
+            return False
+        self.ints[PENDING] = 0
+        return True
+
+    def close(self):
+        self.ints.release()
+        self.floats.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class StopFlag:
+    '''
+    err.status over a multiprocessing.Event, for the feed process
+    '''
+
+    def __init__(self, event):
+        self.event = event
+
+    @property
+    def status(self):
+        return self.event.is_set()
+
+
+class FeedThread:
+    '''
+    Market data feed on its own event loop in a daemon thread, optionally pinned
+    feed(loop) builds the feed coroutine on that loop. Order acks and user events keep the
+    strategy loop to themselves; the threads still share the GIL, PROCESS mode avoids that too
+    A feed that raises is logged and sets err, so the strategy stops as with a dead feed process
+    '''
+
+    def __init__(self, feed, cpus=None, policy=LOOP_POLICY, name='feed', err=None, logger=None):
+        self.feed = feed
+        self.cpus = cpus
+        self.policy = policy
+        self.err = err
+        self.logger = logger
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        pin(self.cpus)
+        loop = new_event_loop(self.policy)
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.feed(loop))
+        except Exception as e:
+            self.error = e
+            if self.logger is not None:
+                self.logger.error_nowait("FeedThread: {} failed: {!r}".format(self.thread.name, e))
+            if self.err is not None and not self.err.status:
+                self.err.message = "feed thread failed: {!r}".format(e)
+                self.err.status = True
+        finally:
+            loop.close()
+
+    async def wait(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+
+def feed_process(feed, symbol, scale, name, conn, stop, cpus, policy, args):
+    '''
+    Target of the feed process: attach to the shared book and run
+    feed(symbol, logger, err, orderbook, *args) until stop is set
+    '''
+    pin(cpus)
+    orderbook = SharedTopOfBook(symbol, scale, name, conn)
+    logger = Logger('feed', symbol)
+    try:
+        run(feed(symbol, logger, StopFlag(stop), orderbook, *args), policy)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        orderbook.close()
+
+
+class FeedProcess:
+    '''
+    Market data feed in a child process writing a SharedTopOfBook, the strategy loop
+    is woken through a pipe registered with add_reader and reads the latest snapshot
+    feed must be a module level coroutine function, it is pickled by reference
+    '''
+
+    def __init__(self, feed, orderbook, args=(), cpus=None, policy=LOOP_POLICY):
+        self.orderbook = orderbook
+        self.stop = mp.Event()
+        reader, writer = mp.Pipe(duplex=False)
+        self.reader = reader
+        self.orderbook.conn = reader
+        self.process = mp.Process(
+            target=feed_process, name='feed-' + orderbook.symbol, daemon=True,
+            args=(feed, orderbook.symbol, orderbook.scale, orderbook.name, writer, self.stop, cpus, policy, args))
+        self.writer = writer
+
+    def start(self, on_book=None, err=None):
+        self.process.start()
+        # the child holds its own copy
+        self.writer.close()
+        asyncio.get_running_loop().add_reader(self.reader.fileno(), self.on_readable, on_book, err)
+        return self
+
+    def on_readable(self, on_book, err):
+        if not self.orderbook.drain():
+            # the pipe stays readable at EOF, stop polling it and stop the strategy
+            asyncio.get_running_loop().remove_reader(self.reader.fileno())
+            if err is not None and not err.status:
+                err.status = True
+                err.message = "feed process pipe closed, exit code {}".format(self.process.exitcode)
+            return
+        if on_book is not None:
+            on_book()
+
+    async def watch(self, err):
+        '''
+        Stop the strategy if the feed process dies, stop the feed once the strategy stops
+        '''
+        while not err.status:
+            if not self.process.is_alive():
+                err.status = True
+                err.message = "feed process exited with code {}".format(self.process.exitcode)
+                break
+            await asyncio.sleep(FEED_CHECK)
+        await self.close()
+
+    async def close(self):
+        if self.stop.is_set():
+            return
+        self.stop.set()
+        asyncio.get_running_loop().remove_reader(self.reader.fileno())
+        deadline = time.time() + FEED_JOIN_TIMEOUT
+        while self.process.is_alive() and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.reader.close()
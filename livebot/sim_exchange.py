@@ -0,0 +1,782 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import secrets
+
+from aiohttp import web
+
+from decoder import orjson
+from latency import Histogram
+from rate_limiter import RateLimiter, TokenBucket, WEIGHT_HEADER, ORDER_1M_HEADER, ORDER_10S_HEADER
+from symbol_cache import SymbolInfo, decimals
+from recorder import RECORD_FOLDER, MARKET_KINDS, BOOK_TICKER, AGG_TRADE, iter_messages
+from matching_engine import (MatchingEngine, MAKER_FEE, TAKER_FEE, BUY, SELL, LIMIT, MARKET, GTC, IOC, GTX,
+                             TRADE)
+from order_gateway import OrderGateway
+import runtime
+
+# Config
+HOST = '127.0.0.1'
+PORT = 8900
+# injected one way delays in ms, every delay adds a uniform draw in [0, JITTER)
+REST_LATENCY = 0.0
+STREAM_LATENCY = 0.0
+JITTER = 0.0
+SEED = 1
+# synthetic market: ticks per second per symbol, share of ticks that print a trade,
+# chance of a one tick move per tick and the quantity shown at each side
+SYNTHETIC_RATE = 100
+TRADE_SHARE = 0.3
+MOVE_SHARE = 0.2
+TOP_QTY = 5.0
+# a feed at full speed yields to the loop every this many ticks
+FEED_BATCH = 100
+# limits of the bench gateway, the simulator does not enforce any and the bench measures the round trips
+BENCH_LIMIT = 1 << 30
+# unsigned headers and parameters
+API_KEY_HEADER = 'X-MBX-APIKEY'
+DEFAULT_ACCOUNT = 'sim'
+ORDER_TYPES = (LIMIT, MARKET)
+TIME_IN_FORCE = (GTC, IOC, GTX)
+
+# binance error codes
+UNKNOWN_ORDER = -2011
+NO_SUCH_ORDER = -2013
+INVALID_SYMBOL = -1121
+MANDATORY_PARAM = -1102
+INVALID_PARAM = -1130
+BAD_QUANTITY = -4003
+BAD_NOTIONAL = -4164
+
+# paths, python-binance prefixes /api and /fapi to its calls
+TICKER_PATHS = ('/api/v3/ticker/price', '/fapi/v1/ticker/price')
+EXCHANGE_INFO_PATH = '/fapi/v1/exchangeInfo'
+DEPTH_PATH = '/fapi/v1/depth'
+POSITION_PATH = '/fapi/v2/positionRisk'
+LISTEN_KEY_PATHS = ('/api/v3/userDataStream', '/fapi/v1/listenKey')
+ORDER_PATH = '/fapi/v1/order'
+BATCH_PATH = '/fapi/v1/batchOrders'
+ALL_OPEN_PATH = '/fapi/v1/allOpenOrders'
+OPEN_ORDERS_PATH = '/fapi/v1/openOrders'
+STATS_PATH = '/sim/stats'
+# futures_user_socket connects to {FSTREAM_URL}private/ws?listenKey=...
+USER_SOCKET_PATHS = ('/ws', '/private/ws')
+
+if orjson is not None:
+    def dumps(data):
+        return orjson.dumps(data).decode()
+else:
+    def dumps(data):
+        return json.dumps(data, separators=(',', ':'))
+
+
+class SimError(Exception):
+    def __init__(self, code, msg):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+
+
+class Subscriber:
+    '''
+    One websocket client, frames are sent in order by a task that holds each until its injected delay passed
+    '''
+
+    def __init__(self, ws, raw=False):
+        self.ws = ws
+        self.raw = raw
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.run())
+        self.sent = 0
+
+    def send(self, frame, due):
+        self.queue.put_nowait((due, frame))
+
+    async def run(self):
+        while True:
+            due, frame = await self.queue.get()
+            wait = due - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await self.ws.send_str(frame)
+            except (ConnectionError, RuntimeError):
+                return
+            self.sent += 1
+
+    def close(self):
+        self.task.cancel()
+
+
+class SimExchange:
+    '''
+    Local stand-in for the binance futures endpoints the bot uses, for end to end load tests
+    REST: order, batchOrders, allOpenOrders, openOrders, exchangeInfo, ticker price, depth,
+    positionRisk and listen keys, websockets: combined market streams (bookTicker, aggTrade)
+    and user data by listen key
+    Orders go to a MatchingEngine driven by synthetic or recorded ticks, accounts are the api keys
+    Every REST call and every frame can be held back by an injected latency
+    Tick to trade is measured here: from a tick leaving the exchange to the next order on the symbol
+    '''
+
+    def __init__(self, symbols, rest_latency=REST_LATENCY, stream_latency=STREAM_LATENCY, jitter=JITTER,
+                 seed=SEED, maker_fee=MAKER_FEE, taker_fee=TAKER_FEE):
+        self.symbols = {info.symbol: info for info in symbols}
+        # price and quantity format strings per symbol
+        self.formats = {info.symbol: ('{{:.{}f}}'.format(info.price_precision),
+                                      '{{:.{}f}}'.format(info.quantity_precision)) for info in symbols}
+        self.rest_latency = rest_latency
+        self.stream_latency = stream_latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.engine = MatchingEngine(maker_fee, taker_fee)
+        for info in symbols:
+            self.engine.add_symbol(info.symbol, info.tick_size)
+        # stream name -> subscribers, account name -> subscribers of its user data
+        self.streams = {}
+        self.users = {}
+        self.listen_keys = {}
+        self.update_ids = {symbol: 0 for symbol in self.symbols}
+        self.trade_ids = {symbol: 0 for symbol in self.symbols}
+        # perf_counter of the last tick sent per symbol, 0 before the first
+        self.tick_time = {symbol: 0 for symbol in self.symbols}
+        self.weight = TokenBucket('weight', 0, 60)
+        self.orders_1m = TokenBucket('orders_1m', 0, 60)
+        self.orders_10s = TokenBucket('orders_10s', 0, 10)
+        self.tick_to_trade = Histogram('tick_to_trade')
+        self.counts = {'ticks': 0, 'trades': 0, 'orders': 0, 'amends': 0, 'cancels': 0, 'fills': 0,
+                       'rejects': 0, 'requests': 0, 'frames': 0}
+        self.start_time = time.time()
+        self.app = web.Application()
+        self.add_routes()
+        self.runner = None
+
+    # setup
+
+    def add_routes(self):
+        routes = [
+            ('POST', ORDER_PATH, self.new_order, (0, 1)),
+            ('PUT', ORDER_PATH, self.modify_order, (1, 1)),
+            ('GET', ORDER_PATH, self.query_order, (1, 0)),
+            ('DELETE', ORDER_PATH, self.cancel_order, (1, 0)),
+            ('POST', BATCH_PATH, self.new_orders, (5, 0)),
+            ('DELETE', BATCH_PATH, self.cancel_orders, (1, 0)),
+            ('DELETE', ALL_OPEN_PATH, self.cancel_all, (1, 0)),
+            ('GET', OPEN_ORDERS_PATH, self.open_orders, (1, 0)),
+            ('GET', EXCHANGE_INFO_PATH, self.exchange_info, (1, 0)),
+            ('GET', DEPTH_PATH, self.depth, (20, 0)),
+            ('GET', POSITION_PATH, self.position_risk, (5, 0)),
+        ]
+        routes += [('GET', path, self.ticker_price, (2, 0)) for path in TICKER_PATHS]
+        for path in LISTEN_KEY_PATHS:
+            routes += [('POST', path, self.new_listen_key, (1, 0)), ('PUT', path, self.keep_listen_key, (1, 0)),
+                       ('DELETE', path, self.keep_listen_key, (1, 0))]
+        for method, path, handler, cost in routes:
+            self.app.router.add_route(method, path, self.rest(handler, cost))
+        self.app.router.add_get(STATS_PATH, self.stats_handler)
+        self.app.router.add_get('/stream', self.market_socket)
+        self.app.router.add_get('/ws/{name}', self.raw_socket)
+        for path in USER_SOCKET_PATHS:
+            self.app.router.add_get(path, self.user_socket)
+
+    async def start(self, host=HOST, port=PORT):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.start_time = time.time()
+        return self
+
+    async def close(self):
+        for subscribers in list(self.streams.values()) + list(self.users.values()):
+            for subscriber in subscribers:
+                subscriber.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def delay(self, latency):
+        '''
+        Returns: an injected delay in seconds
+        '''
+        if not latency and not self.jitter:
+            return 0.0
+        return (latency + self.random.random() * self.jitter) / 1000
+
+    # rest
+
+    def rest(self, handler, cost):
+        weight, orders = cost
+
+        async def handle(request):
+            params = dict(request.query)
+            if request.can_read_body:
+                params.update(await request.post())
+            account = self.engine.account(request.headers.get(API_KEY_HEADER, DEFAULT_ACCOUNT))
+            delay = self.delay(self.rest_latency)
+            if delay:
+                await asyncio.sleep(delay)
+            # the request reaches the engine now, nothing below awaits
+            arrival = time.perf_counter()
+            now = time.time()
+            for bucket, taken in ((self.weight, weight), (self.orders_1m, orders), (self.orders_10s, orders)):
+                bucket.roll(now)
+                bucket.take(taken)
+            self.counts['requests'] += 1
+            try:
+                status, data = 200, handler(account, params, arrival)
+            except SimError as e:
+                self.counts['rejects'] += 1
+                status, data = 400, {'code': e.code, 'msg': e.msg}
+            self.publish_events()
+            headers = {WEIGHT_HEADER: str(self.weight.used), ORDER_1M_HEADER: str(self.orders_1m.used),
+                       ORDER_10S_HEADER: str(self.orders_10s.used)}
+            return web.Response(text=dumps(data), status=status, content_type='application/json', headers=headers)
+        return handle
+
+    def info(self, params):
+        symbol = params.get('symbol')
+        if symbol is None:
+            raise SimError(MANDATORY_PARAM, "Mandatory parameter 'symbol' was not sent.")
+        info = self.symbols.get(symbol)
+        if info is None:
+            raise SimError(INVALID_SYMBOL, 'Invalid symbol.')
+        return info
+
+    def order_json(self, order):
+        info = self.symbols[order.symbol]
+        tick_size = info.tick_size
+        price_format, qty_format = self.formats[order.symbol]
+        price = order.price * tick_size if order.type == LIMIT else 0.0
+        return {
+            'orderId': order.order_id,
+            'symbol': order.symbol,
+            'status': order.status,
+            'clientOrderId': order.client_order_id,
+            'price': price_format.format(price),
+            'avgPrice': price_format.format(order.quote / order.filled * tick_size if order.filled else 0.0),
+            'origQty': qty_format.format(order.qty),
+            'executedQty': qty_format.format(order.filled),
+            'cumQuote': '{:.8f}'.format(order.quote * tick_size),
+            'timeInForce': order.time_in_force,
+            'type': order.type,
+            'origType': order.type,
+            'reduceOnly': False,
+            'closePosition': False,
+            'side': order.side,
+            'positionSide': 'BOTH',
+            'stopPrice': '0',
+            'workingType': 'CONTRACT_PRICE',
+            'priceProtect': False,
+            'updateTime': order.update_time,
+        }
+
+    def find(self, account, params, code=UNKNOWN_ORDER):
+        info = self.info(params)
+        order_id = params.get('orderId')
+        order = self.engine.get(account, int(order_id) if order_id is not None else None,
+                                params.get('origClientOrderId'))
+        if order is None or order.symbol != info.symbol:
+            raise SimError(code, 'Unknown order sent.' if code == UNKNOWN_ORDER else 'Order does not exist.')
+        return order
+
+    def parse_order(self, info, params):
+        '''
+        Returns: (side, price in ticks, qty, type, time in force) of an order, validated
+        '''
+        side = params.get('side')
+        order_type = params.get('type', LIMIT)
+        if side not in (BUY, SELL) or order_type not in ORDER_TYPES:
+            raise SimError(INVALID_PARAM, 'Invalid side or type.')
+        try:
+            qty = float(params['quantity'])
+        except (KeyError, ValueError):
+            raise SimError(MANDATORY_PARAM, "Mandatory parameter 'quantity' was not sent.")
+        if qty <= 0 or qty < info.min_qty:
+            raise SimError(BAD_QUANTITY, 'Quantity less than or equal to zero.')
+        if order_type == MARKET:
+            return side, 0, qty, order_type, IOC
+        time_in_force = params.get('timeInForce', GTC)
+        if time_in_force not in TIME_IN_FORCE:
+            raise SimError(INVALID_PARAM, 'Invalid timeInForce.')
+        try:
+            price = float(params['price'])
+        except (KeyError, ValueError):
+            raise SimError(MANDATORY_PARAM, "Mandatory parameter 'price' was not sent.")
+        if price <= 0:
+            raise SimError(INVALID_PARAM, 'Invalid price.')
+        if info.min_notional and price * qty < info.min_notional:
+            raise SimError(BAD_NOTIONAL, 'Order\'s notional must be no smaller than {}'.format(info.min_notional))
+        return side, round(price / info.tick_size), qty, order_type, time_in_force
+
+    def on_order_entry(self, symbol, arrival):
+        sent = self.tick_time[symbol]
+        if sent:
+            self.tick_to_trade.record(int((arrival - sent) * 1e9))
+
+    def new_order(self, account, params, arrival):
+        info = self.info(params)
+        side, price, qty, order_type, time_in_force = self.parse_order(info, params)
+        self.on_order_entry(info.symbol, arrival)
+        self.counts['orders'] += 1
+        order = self.engine.new_order(account, info.symbol, side, price, qty, order_type, time_in_force,
+                                      params.get('newClientOrderId', ''))
+        return self.order_json(order)
+
+    def modify_order(self, account, params, arrival):
+        order = self.find(account, params, NO_SUCH_ORDER)
+        info = self.symbols[order.symbol]
+        if params.get('side', order.side) != order.side or order.type != LIMIT:
+            raise SimError(INVALID_PARAM, 'Only the price and quantity of a limit order can be modified.')
+        _, price, qty, _, _ = self.parse_order(info, dict(params, type=LIMIT))
+        self.on_order_entry(order.symbol, arrival)
+        self.counts['amends'] += 1
+        if self.engine.books[order.symbol].amend(order, price, qty) is None:
+            raise SimError(NO_SUCH_ORDER, 'Order does not exist.')
+        return self.order_json(order)
+
+    def query_order(self, account, params, arrival):
+        return self.order_json(self.find(account, params, NO_SUCH_ORDER))
+
+    def cancel_order(self, account, params, arrival):
+        order = self.find(account, params)
+        if self.engine.books[order.symbol].cancel(order) is None:
+            raise SimError(UNKNOWN_ORDER, 'Unknown order sent.')
+        self.counts['cancels'] += 1
+        return self.order_json(order)
+
+    def batch(self, handler, account, entries, arrival):
+        results = []
+        for params in entries:
+            try:
+                results.append(handler(account, params, arrival))
+            except SimError as e:
+                self.counts['rejects'] += 1
+                results.append({'code': e.code, 'msg': e.msg})
+        return results
+
+    def new_orders(self, account, params, arrival):
+        try:
+            entries = json.loads(params['batchOrders'])
+        except (KeyError, ValueError):
+            raise SimError(MANDATORY_PARAM, "Mandatory parameter 'batchOrders' was not sent.")
+        for bucket in (self.orders_1m, self.orders_10s):
+            bucket.take(len(entries))
+        return self.batch(self.new_order, account, entries, arrival)
+
+    def cancel_orders(self, account, params, arrival):
+        info = self.info(params)
+        try:
+            order_ids = json.loads(params['orderIdList'])
+        except (KeyError, ValueError):
+            raise SimError(MANDATORY_PARAM, "Mandatory parameter 'orderIdList' was not sent.")
+        return self.batch(self.cancel_order, account,
+                          [{'symbol': info.symbol, 'orderId': order_id} for order_id in order_ids], arrival)
+
+    def cancel_all(self, account, params, arrival):
+        info = self.info(params)
+        book = self.engine.books[info.symbol]
+        for order in self.engine.open_orders(account, info.symbol):
+            book.cancel(order)
+            self.counts['cancels'] += 1
+        return {'code': 200, 'msg': 'The operation of cancel all open order is done.'}
+
+    def open_orders(self, account, params, arrival):
+        symbol = self.info(params).symbol if 'symbol' in params else None
+        return [self.order_json(order) for order in self.engine.open_orders(account, symbol)]
+
+    def exchange_info(self, account, params, arrival):
+        return {'timezone': 'UTC', 'serverTime': int(time.time() * 1000), 'rateLimits': [], 'symbols': [{
+            'symbol': info.symbol,
+            'status': 'TRADING',
+            'contractType': 'PERPETUAL',
+            'pricePrecision': info.price_precision,
+            'quantityPrecision': info.quantity_precision,
+            'filters': [
+                {'filterType': 'PRICE_FILTER', 'tickSize': repr(info.tick_size)},
+                {'filterType': 'LOT_SIZE', 'stepSize': repr(info.step_size), 'minQty': repr(info.min_qty)},
+                {'filterType': 'MIN_NOTIONAL', 'notional': repr(info.min_notional)},
+            ],
+        } for info in self.symbols.values()]}
+
+    def mid(self, symbol):
+        book = self.engine.books[symbol]
+        if book.bid and book.ask:
+            return (book.bid + book.ask) / 2 * book.tick_size
+        return book.last_price * book.tick_size
+
+    def ticker_price(self, account, params, arrival):
+        if 'symbol' in params:
+            info = self.info(params)
+            return {'symbol': info.symbol, 'price': repr(self.mid(info.symbol))}
+        return [{'symbol': symbol, 'price': repr(self.mid(symbol))} for symbol in self.symbols]
+
+    def depth(self, account, params, arrival):
+        info = self.info(params)
+        book = self.engine.books[info.symbol]
+        now = int(time.time() * 1000)
+        return {'lastUpdateId': book.update_id, 'E': now, 'T': now,
+                'bids': [[repr(book.bid * book.tick_size), repr(book.bid_qty)]] if book.bid else [],
+                'asks': [[repr(book.ask * book.tick_size), repr(book.ask_qty)]] if book.ask else []}
+
+    def position_json(self, account, symbol):
+        position = account.position(symbol)
+        mark = self.mid(symbol)
+        return {'symbol': symbol, 'positionAmt': self.formats[symbol][1].format(position.amount), 'entryPrice': repr(position.entry),
+                'markPrice': repr(mark), 'unRealizedProfit': repr(position.unrealized(mark)),
+                'positionSide': 'BOTH', 'marginType': 'cross', 'leverage': '20'}
+
+    def position_risk(self, account, params, arrival):
+        symbols = [self.info(params).symbol] if 'symbol' in params else list(self.symbols)
+        return [self.position_json(account, symbol) for symbol in symbols]
+
+    def new_listen_key(self, account, params, arrival):
+        for key, owner in self.listen_keys.items():
+            if owner is account:
+                return {'listenKey': key}
+        key = secrets.token_hex(32)
+        self.listen_keys[key] = account
+        return {'listenKey': key}
+
+    def keep_listen_key(self, account, params, arrival):
+        return {}
+
+    async def stats_handler(self, request):
+        return web.Response(text=dumps(self.stats()), content_type='application/json')
+
+    def stats(self):
+        '''
+        Returns: dict of the counters, order throughput and tick to trade in us
+        '''
+        elapsed = time.time() - self.start_time
+        stats = dict(self.counts)
+        stats['elapsed'] = elapsed
+        stats['orders_per_second'] = (self.counts['orders'] + self.counts['amends'] + self.counts['cancels']) \
+            / elapsed if elapsed else 0.0
+        stats['tick_to_trade'] = self.tick_to_trade.summary()
+        stats['accounts'] = {name: {symbol: self.position_json(account, symbol) for symbol in account.positions}
+                             for name, account in self.engine.accounts.items()}
+        return stats
+
+    # websockets
+
+    async def serve_socket(self, request, subscriptions, raw):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscriber = Subscriber(ws, raw)
+        for subscribers in subscriptions:
+            subscribers.add(subscriber)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            for subscribers in subscriptions:
+                subscribers.discard(subscriber)
+            subscriber.close()
+        return ws
+
+    async def market_socket(self, request):
+        names = [name for name in request.query.get('streams', '').split('/') if name]
+        return await self.serve_socket(request, [self.streams.setdefault(name, set()) for name in names], False)
+
+    async def raw_socket(self, request):
+        name = request.match_info['name']
+        account = self.listen_keys.get(name)
+        if account is not None:
+            return await self.serve_socket(request, [self.users.setdefault(account.name, set())], True)
+        return await self.serve_socket(request, [self.streams.setdefault(name, set())], True)
+
+    async def user_socket(self, request):
+        account = self.listen_keys.get(request.query.get('listenKey'))
+        if account is None:
+            raise web.HTTPBadRequest(text='Invalid listen key')
+        return await self.serve_socket(request, [self.users.setdefault(account.name, set())], True)
+
+    def publish(self, stream, data):
+        subscribers = self.streams.get(stream)
+        if not subscribers:
+            return
+        combined = raw = None
+        now = time.perf_counter()
+        for subscriber in subscribers:
+            if subscriber.raw:
+                if raw is None:
+                    raw = dumps(data)
+                subscriber.send(raw, now + self.delay(self.stream_latency))
+            else:
+                if combined is None:
+                    combined = dumps({'stream': stream, 'data': data})
+                subscriber.send(combined, now + self.delay(self.stream_latency))
+            self.counts['frames'] += 1
+
+    def publish_user(self, account, data):
+        subscribers = self.users.get(account.name)
+        if not subscribers:
+            return
+        frame = dumps(data)
+        now = time.perf_counter()
+        for subscriber in subscribers:
+            subscriber.send(frame, now + self.delay(self.stream_latency))
+            self.counts['frames'] += 1
+
+    def publish_events(self):
+        '''
+        Send the order updates of the engine events, then one account update per traded position
+        '''
+        events = self.engine.drain()
+        if not events:
+            return
+        now = int(time.time() * 1000)
+        traded = {}
+        for order, execution, last_qty, last_price, maker in events:
+            tick_size = self.symbols[order.symbol].tick_size
+            price_format, qty_format = self.formats[order.symbol]
+            commission = 0.0
+            trade_id = 0
+            if execution == TRADE:
+                self.counts['fills'] += 1
+                commission = last_qty * last_price * tick_size * \
+                    (self.engine.maker_fee if maker else self.engine.taker_fee)
+                self.trade_ids[order.symbol] += 1
+                trade_id = self.trade_ids[order.symbol]
+                traded[(order.account.name, order.symbol)] = order.account
+            self.publish_user(order.account, {'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now, 'o': {
+                's': order.symbol, 'c': order.client_order_id, 'S': order.side, 'o': order.type,
+                'f': order.time_in_force, 'q': qty_format.format(order.qty),
+                'p': price_format.format(order.price * tick_size if order.type == LIMIT else 0.0),
+                'ap': price_format.format(order.quote / order.filled * tick_size if order.filled else 0.0),
+                'sp': '0', 'x': execution, 'X': order.status, 'i': order.order_id, 'l': qty_format.format(last_qty),
+                'z': qty_format.format(order.filled), 'L': price_format.format(last_price * tick_size), 'N': 'USDT',
+                'n': '{:.8f}'.format(commission),
+                'T': order.update_time, 't': trade_id, 'm': maker, 'R': False, 'ps': 'BOTH', 'rp': '0'}})
+        for (_, symbol), account in traded.items():
+            position = self.position_json(account, symbol)
+            self.publish_user(account, {'e': 'ACCOUNT_UPDATE', 'E': now, 'T': now, 'a': {'m': 'ORDER', 'B': [], 'P': [{
+                's': symbol, 'pa': position['positionAmt'], 'ep': position['entryPrice'], 'cr': '0',
+                'up': position['unRealizedProfit'], 'mt': 'cross', 'iw': '0', 'ps': 'BOTH'}]}})
+
+    # market data
+
+    def on_book_ticker(self, symbol, bid, bid_qty, ask, ask_qty):
+        book = self.engine.books[symbol]
+        self.update_ids[symbol] += 1
+        update_id = self.update_ids[symbol]
+        inverse = 1.0 / book.tick_size
+        book.on_quote(update_id, round(bid * inverse), bid_qty, round(ask * inverse), ask_qty)
+        now = int(time.time() * 1000)
+        self.tick_time[symbol] = time.perf_counter()
+        self.counts['ticks'] += 1
+        self.publish(symbol.lower() + '@bookTicker', {'e': 'bookTicker', 'u': update_id, 's': symbol,
+                                                      'b': repr(bid), 'B': repr(bid_qty), 'a': repr(ask),
+                                                      'A': repr(ask_qty), 'T': now, 'E': now})
+        self.publish_events()
+
+    def on_agg_trade(self, symbol, price, qty, buyer_maker):
+        book = self.engine.books[symbol]
+        book.on_trade(round(price / book.tick_size), qty, buyer_maker)
+        self.trade_ids[symbol] += 1
+        now = int(time.time() * 1000)
+        self.counts['trades'] += 1
+        self.publish(symbol.lower() + '@aggTrade', {'e': 'aggTrade', 'E': now, 'a': self.trade_ids[symbol],
+                                                    's': symbol, 'p': repr(price), 'q': repr(qty),
+                                                    'f': self.trade_ids[symbol], 'l': self.trade_ids[symbol],
+                                                    'T': now, 'm': buyer_maker})
+        self.publish_events()
+
+    async def feed(self, symbol, ticks, speed=1, limit=None, err=None):
+        '''
+        Drive a symbol with ticks (offset seconds, BOOK_TICKER, (bid, bid qty, ask, ask qty)) or
+        (offset seconds, AGG_TRADE, (price, qty, buyer is maker)), at speed times their pace, 0 as fast as possible
+        Returns: number of ticks fed
+        '''
+        count = 0
+        start = time.perf_counter()
+        for offset, kind, values in ticks:
+            if (limit is not None and count >= limit) or (err is not None and err.status):
+                break
+            if speed:
+                wait = offset / speed - (time.perf_counter() - start)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            elif count % FEED_BATCH == 0:
+                await asyncio.sleep(0)
+            if kind == BOOK_TICKER:
+                self.on_book_ticker(symbol, *values)
+            else:
+                self.on_agg_trade(symbol, *values)
+            count += 1
+        return count
+
+
+def synthetic_ticks(info, price, rate=SYNTHETIC_RATE, seed=SEED, trade_share=TRADE_SHARE, move_share=MOVE_SHARE,
+                    top_qty=TOP_QTY):
+    '''
+    Endless random walk of a one tick wide book around price, with trades at the touch
+    Yields: ticks for SimExchange.feed, the same for the same seed
+    '''
+    rng = random.Random(seed)
+    tick_size = info.tick_size
+    bid = round(price / tick_size)
+    step = info.step_size or info.min_qty or 0.001
+    i = 0
+    while True:
+        offset = i / rate
+        i += 1
+        if rng.random() < trade_share:
+            buyer_maker = rng.random() < 0.5
+            qty = round(rng.uniform(1, top_qty) / step) * step
+            yield offset, AGG_TRADE, ((bid if buyer_maker else bid + 1) * tick_size, qty, buyer_maker)
+            continue
+        if rng.random() < move_share:
+            bid += 1 if rng.random() < 0.5 else -1
+        yield offset, BOOK_TICKER, (bid * tick_size, round(rng.uniform(1, top_qty) / step) * step,
+                                    (bid + 1) * tick_size, round(rng.uniform(1, top_qty) / step) * step)
+
+
+def recorded_ticks(symbol, folder=RECORD_FOLDER):
+    '''
+    Market ticks of a recording made by recorder.py
+    Yields: ticks for SimExchange.feed, offsets are the recorded receive times
+    '''
+    first = None
+    for kind, message, recv_ns in iter_messages(symbol, folder, MARKET_KINDS):
+        if first is None:
+            first = recv_ns
+        offset = (recv_ns - first) / 1e9
+        if kind == BOOK_TICKER:
+            yield offset, kind, (message['b'], message['B'], message['a'], message['A'])
+        else:
+            yield offset, kind, (message['p'], message['q'], message['m'])
+
+
+def symbol_info(symbol, tick_size, step_size, min_notional=0.0):
+    return SymbolInfo(symbol, tick_size, step_size, step_size, min_notional, decimals('{:.10f}'.format(tick_size)),
+                      decimals('{:.10f}'.format(step_size)))
+
+
+def bot_urls(host=HOST, port=PORT):
+    '''
+    Returns: the url, futures_url and stream_url arguments that point run_strat at a simulator
+    '''
+    return {'url': 'http://{}:{}/api'.format(host, port), 'futures_url': 'http://{}:{}'.format(host, port),
+            'stream_url': 'ws://{}:{}/stream?streams='.format(host, port)}
+
+
+def point_binance(host=HOST, port=PORT):
+    '''
+    Point the python-binance futures calls and user socket at a simulator, they are class
+    attributes and not arguments of the bot
+    '''
+    from binance.client import BaseClient
+    from binance import BinanceSocketManager
+    BaseClient.FUTURES_URL = 'http://{}:{}/fapi'.format(host, port)
+    BinanceSocketManager.STREAM_URL = BinanceSocketManager.FSTREAM_URL = 'ws://{}:{}/'.format(host, port)
+
+
+async def bench_gateway(url, symbol, price, qty, count, concurrency=16):
+    '''
+    Place and cancel count orders through OrderGateway, concurrency at a time, away from the market
+    Returns: (round trips per second, place Histogram, cancel Histogram) with latencies in ns
+    '''
+    gateway = await OrderGateway('bench', 'bench', url,
+                                 limiter=RateLimiter(BENCH_LIMIT, BENCH_LIMIT, BENCH_LIMIT)).start()
+    placed, cancelled = Histogram('place'), Histogram('cancel')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def round_trip(i):
+        async with semaphore:
+            res = await gateway.create_order(symbol, BUY, LIMIT, qty, price, GTC)
+            placed.record(int(res.latency * 1e6))
+            if res.ok:
+                res = await gateway.cancel_order(symbol, orderId=res.data['orderId'])
+                cancelled.record(int(res.latency * 1e6))
+
+    timer = time.perf_counter()
+    await asyncio.gather(*(round_trip(i) for i in range(count)))
+    elapsed = time.perf_counter() - timer
+    await gateway.close()
+    return count / elapsed, placed, cancelled
+
+
+async def run_sim(infos, prices, host=HOST, port=PORT, rate=SYNTHETIC_RATE, recording=None, speed=1, limit=None,
+                  rest_latency=REST_LATENCY, stream_latency=STREAM_LATENCY, jitter=JITTER, seed=SEED):
+    sim = await SimExchange(infos, rest_latency, stream_latency, jitter, seed).start(host, port)
+    print('sim_exchange: listening on {}'.format(bot_urls(host, port)))
+    feeds = []
+    for i, info in enumerate(infos):
+        if recording:
+            ticks = recorded_ticks(info.symbol, recording)
+        else:
+            ticks = synthetic_ticks(info, prices[i], rate, seed + i)
+        feeds.append(sim.feed(info.symbol, ticks, speed, limit))
+    try:
+        await asyncio.gather(*feeds)
+        # keep serving after the ticks ran out until interrupted
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(sim.stats(), indent=2))
+        await sim.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "--symbol", help="The symbols, comma separated, e.g. ETHUSDT,BTCUSDT", type=str, required=True)
+    parser.add_argument(
+        "--tick_size", help="The tick sizes, comma separated, e.g. 0.01,0.1", type=str, default='0.01')
+    parser.add_argument(
+        "--step_size", help="The quantity steps, comma separated, e.g. 0.001", type=str, default='0.001')
+    parser.add_argument(
+        "--price", help="The synthetic start prices, comma separated, e.g. 2000,40000", type=str, default='100')
+    parser.add_argument(
+        "--rate", help="The synthetic ticks per second per symbol", type=float, default=SYNTHETIC_RATE)
+    parser.add_argument(
+        "--recording", help="Replay this recording folder instead of synthetic ticks, e.g. recordings",
+        type=str, required=False)
+    parser.add_argument(
+        "--speed", help="The replay speed, 0 as fast as possible", type=float, default=1)
+    parser.add_argument(
+        "--ticks", help="Stop feeding after this many ticks per symbol", type=int, required=False)
+    parser.add_argument(
+        "--rest_latency", help="The injected REST latency in ms", type=float, default=REST_LATENCY)
+    parser.add_argument(
+        "--stream_latency", help="The injected websocket latency in ms", type=float, default=STREAM_LATENCY)
+    parser.add_argument(
+        "--jitter", help="The injected jitter in ms", type=float, default=JITTER)
+    parser.add_argument(
+        "--seed", help="The seed of the synthetic market and the jitter", type=int, default=SEED)
+    parser.add_argument(
+        "--host", help="The listen address", type=str, default=HOST)
+    parser.add_argument(
+        "--port", help="The listen port", type=int, default=PORT)
+    parser.add_argument(
+        "--cpus", help="Pin the simulator to these cpus, e.g. 2,3", type=str, required=False)
+    parser.add_argument(
+        "--bench", help="Benchmark order round trips against a running simulator instead, e.g. 10000",
+        type=int, required=False)
+
+    args = parser.parse_args()
+    symbols = args.symbol.split(',')
+
+    def column(text):
+        values = [float(value) for value in text.split(',')]
+        return values + [values[-1]] * (len(symbols) - len(values))
+
+    infos = [symbol_info(symbol, tick_size, step_size)
+             for symbol, tick_size, step_size in zip(symbols, column(args.tick_size), column(args.step_size))]
+    prices = column(args.price)
+    if args.bench:
+        url = 'http://{}:{}'.format(args.host, args.port)
+        rate, placed, cancelled = runtime.run(bench_gateway(url, symbols[0], infos[0].tick_size * round(
+            prices[0] * 0.5 / infos[0].tick_size), infos[0].step_size * 10, args.bench))
+        print('{:.0f} place+cancel round trips/s'.format(rate))
+        print('place: {}'.format(placed.summary()))
+        print('cancel: {}'.format(cancelled.summary()))
+    else:
+        try:
+            runtime.run(run_sim(infos, prices, args.host, args.port, args.rate, args.recording, args.speed,
+                                args.ticks, args.rest_latency, args.stream_latency, args.jitter, args.seed),
+                        cpus=runtime.parse_cpus(args.cpus) if args.cpus else None)
+        except KeyboardInterrupt:
+            pass
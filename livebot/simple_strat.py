@@ -1,44 +1,83 @@
-from cmath import log
 from binance.client import Client
 from binance import BinanceSocketManager
-from pytest import param
-from sympy import re, symbols
 
-from data_structure.orderbook import Orderbook
+from data_structure.orderbook import TopOfBook, TickScale
+from data_structure.depth_book import DepthBook
 from data_structure.client_params import ClientParams
+from data_structure.order_manager import OrderManager, FILLED, REGULAR_ORDER, TAKE_PROFIT_ORDER, STOP_LOSS_ORDER
 from logger import Logger
 from utility import *
+from order_gateway import OrderGateway, FUTURES_URL, is_local_url
+from rate_limiter import limited_call
+from symbol_cache import SymbolCache
+from decoder import EventFilter, install, USER_EVENTS
+from indicators import IndicatorEngine, BarBuilder, INTERVAL_MS, warmup, load_warmup_klines, microprice
+from market_stream import STREAM_URL, StreamRouter, combined_stream_url, combined_market_data_socket
+from latency import (LATENCY, BOOK_TO_DECISION, ORDER_ROUND_TRIP, DECISION_TO_ACK, FILL_EVENT_TO_RECV,
+                     FILL_TO_BRACKET_ACK, instrument_book, loop_lag_monitor, dump_latency, install_dump_signal)
+from journal import JOURNAL_FOLDER, Journal, reconcile, apply_exchange_order
+from recorder import RECORD_FOLDER, USER, BOOK_TICKER, AGG_TRADE, Recorder, replay
+from runtime import INLINE, THREAD, PROCESS, FEED_MODES, Mailbox, SharedTopOfBook, FeedThread, FeedProcess
+from risk import RISK_KEYWORDS, RiskEngine, read_limits, load_positions
+import runtime
 
 import asyncio
 import time
 import datetime
 
-SELL = 'sell'
+SELL = 'SELL'
 BUY = 'BUY'
 LIMIT = 'LIMIT'
 MARKET = 'MARKET'
 BID = 'bid'
 ASK = 'ask'
+TAKE_PROFIT = 0.1
+STOP_LOSS = 0.1
+MAX_ORDER = 2
+DEPTH_LIMIT = 1000
+REQUOTE_TICKS = 1
+# ticks arriving within this many seconds are quoted once
+DEBOUNCE = 0.02
+INDICATOR_INTERVAL = '1m'
+WARMUP_BARS = 500
+# request weight of the informational calls
+DEPTH_WEIGHT = 20
+TICKER_WEIGHT = 2
+
+
+def record_order(orders, logger, data, side, price, amount, latency, role=REGULAR_ORDER, parent_id=None):
+    order = orders.add(data['orderId'], side, price, amount, role, parent_id, data.get('clientOrderId'))
+    if role == STOP_LOSS_ORDER:
+        logger.info_nowait("Stoploss order - price: {}, amount: {}, id: {}, pre_order_id: {}, latency: {:.2f}ms".format(price, amount, order.order_id, parent_id, latency))
+    elif role == TAKE_PROFIT_ORDER:
+        logger.info_nowait("Take profit order - price: {}, amount: {}, id: {}, pre_order_id: {}, latency: {:.2f}ms".format(price, amount, order.order_id, parent_id, latency))
+    else:
+        logger.info_nowait("Regular order - price: {}, amount: {}, id: {}, latency: {:.2f}ms".format(price, amount, order.order_id, latency))
+    return order
 
 
 async def execute_order(
-    client,
+    gateway,
     symbol,
     side,
     order_type,
     amount,
     price,
     precision,
-    params,
+    orders,
     logger,
-    is_stop_loss_order=False,
-    is_take_profit_order=False,
-    pre_order_id=-1,
+    role=REGULAR_ORDER,
+    parent_id=None,
     timeInForce='GTC'
 ):
     price = round(price, precision)
+    if orders.risk is not None:
+        reason = orders.risk.check(side, amount, price, role)
+        if reason is not None:
+            logger.error_nowait("Order rejected - side: {}, price: {}, amount: {}, risk: {}".format(side, price, amount, reason))
+            return None
     if order_type == LIMIT:
-        res = await client.create_order(
+        res = await gateway.create_order(
             symbol=symbol,
             side=side,
             type=order_type,
@@ -46,331 +85,525 @@ async def execute_order(
             quantity=amount,
             price=price
         )
-        order_id = res['orderId']
-
-        regular_orders = await params.get_param("regular_orders")
-        take_profit_orders = await params.get_param("take_profit_orders")
-        stoploss_orders = await params.get_param("stoploss_orders")
-        if is_stop_loss_order:
-            stoploss_orders[order_id] = pre_order_id
-            stoploss_orders[pre_order_id] = order_id
-            await params.update_param("stoploss_orders", stoploss_orders)
-            await logger.info("Stoploss order - price: {}, amount: {}, id: {}, pre_order_id: {}".format(price, amount, order_id, pre_order_id))
-        elif is_take_profit_order:
-            take_profit_orders[order_id] = pre_order_id
-            take_profit_orders[pre_order_id] = order_id
-            await params.update_param("take_profit_orders", take_profit_orders)
-            await logger.info("Take profit order - price: {}, amount: {}, id: {}, pre_order_id: {}".format(price, amount, order_id, pre_order_id))
+        if not res.ok:
+            logger.error_nowait("Order failed - side: {}, price: {}, amount: {}, error: {}, latency: {:.2f}ms".format(side, price, amount, res.error, res.latency))
+            return None
+        LATENCY.record(ORDER_ROUND_TRIP, res.latency * 1e6)
+        return record_order(orders, logger, res.data, side, price, amount, res.latency, role, parent_id)
+
+
+async def place_quotes(gateway, symbol, logger, orders, amount, bid, ask, precision, timeInForce='GTC'):
+    # both sides in one batchOrders round trip
+    quotes = [
+        dict(symbol=symbol, side=BUY, type=LIMIT, timeInForce=timeInForce,
+             quantity=amount, price=round(bid, precision)),
+        dict(symbol=symbol, side=SELL, type=LIMIT, timeInForce=timeInForce,
+             quantity=amount, price=round(ask, precision)),
+    ]
+    if orders.risk is not None:
+        checked = []
+        for quote in quotes:
+            reason = orders.risk.check(quote['side'], amount, quote['price'])
+            if reason is None:
+                checked.append(quote)
+            else:
+                logger.error_nowait("Order rejected - side: {}, price: {}, amount: {}, risk: {}".format(quote['side'], quote['price'], amount, reason))
+        quotes = checked
+        if not quotes:
+            return
+    results = await gateway.create_orders(quotes)
+    LATENCY.record(ORDER_ROUND_TRIP, results[0].latency * 1e6)
+    for quote, res in zip(quotes, results):
+        if res.ok:
+            record_order(orders, logger, res.data, quote['side'], quote['price'], amount, res.latency)
         else:
-            regular_orders.add(order_id)
-            await params.update_param("regular_orders", regular_orders)
-            await logger.info("Regular order - price: {}, amount: {}, id: {}".format(price, amount, order_id))
-
-
-async def send_take_profit_order(client, symbol, logger, err, orderbook, params, order_id, side, filled_qty, fill_price):
-    tp_price = fill_price
-    precision = await orderbook.get('precision')
-    if side.upper() == BUY:
-        tp_price *= 1.1
-        await execute_order(
-            client=client,
-            symbol=symbol,
-            side=SELL,
-            order_type=LIMIT,
-            amount=filled_qty,
-            price=tp_price,
-            precision=precision,
-            params=params,
-            is_take_profit_order=True,
-            pre_order_id=order_id
-        )
-    else:
-        tp_price *= 0.9
-        await execute_order(
-            client=client,
-            symbol=symbol,
-            side=BUY,
-            order_type=LIMIT,
-            amount=filled_qty,
-            price=tp_price,
-            precision=precision,
-            params=params,
-            is_take_profit_order=True,
-            pre_order_id=order_id
-        )
+            logger.error_nowait("Order failed - side: {}, price: {}, amount: {}, error: {}, latency: {:.2f}ms".format(quote['side'], quote['price'], amount, res.error, res.latency))
 
 
-async def send_stop_loss_order(client, symbol, logger, err, orderbook, params, order_id, side, filled_qty, fill_price):
-    sl_price = fill_price
-    precision = await orderbook.get('precision')
-    if side.upper() == BUY:
-        sl_price *= 0.9
-        await execute_order(
-            client=client,
-            symbol=symbol,
-            side=SELL,
-            order_type=LIMIT,
-            amount=filled_qty,
-            price=sl_price,
-            precision=precision,
-            params=params,
-            is_stop_loss_order=True,
-            pre_order_id=order_id
-        )
+async def send_take_profit_order(gateway, symbol, logger, params, orders, order):
+    tp_price = order.avg_price or order.price
+    precision = await params.get_param('precision')
+    take_profit = await params.get_param('take_profit')
+    if order.side == BUY:
+        tp_price *= 1 + take_profit
+        side = SELL
     else:
-        sl_price *= 1.1
-        await execute_order(
-            client=client,
-            symbol=symbol,
-            side=BUY,
-            order_type=LIMIT,
-            amount=filled_qty,
-            price=sl_price,
-            precision=precision,
-            params=params,
-            is_stop_loss_order=True,
-            pre_order_id=order_id
-        )
-
-
-async def cancel_order(client, symbol, logger, params, order_id):
-    try:
-        await client.cancel_order(symbol=symbol, orderId=order_id)
-    except Exception as e:
-        await logger.error("Error cancelling order: {}".format(e))
+        tp_price *= 1 - take_profit
+        side = BUY
+    await execute_order(
+        gateway=gateway,
+        symbol=symbol,
+        side=side,
+        order_type=LIMIT,
+        amount=order.filled_qty,
+        price=tp_price,
+        precision=precision,
+        orders=orders,
+        logger=logger,
+        role=TAKE_PROFIT_ORDER,
+        parent_id=order.order_id
+    )
+
+
+async def send_stop_loss_order(gateway, symbol, logger, params, orders, order):
+    sl_price = order.avg_price or order.price
+    precision = await params.get_param('precision')
+    stop_loss = await params.get_param('stop_loss')
+    if order.side == BUY:
+        sl_price *= 1 - stop_loss
+        side = SELL
     else:
-        regular_orders = await params.get_param("regular_orders")
-        regular_orders.remove(order_id)
-        await params.update_param("regular_orders", regular_orders)
-        await logger.info("Cancelled order: {}".format(order_id))
-
-
-async def cancel_stoploss_order(client, symbol, logger, params, order_id):
-    try:
-        await client.cancel_order(symbol=symbol, orderId=order_id)
-    except Exception as e:
-        await logger.error("Error cancelling order: {}".format(e))
-    else:
-        stoploss_orders = await params.get_param("stoploss_orders")
-        prev_id = stoploss_orders[order_id]
-        del stoploss_orders[order_id]
-        del stoploss_orders[prev_id]
-        await params.update_param("stoploss_orders", stoploss_orders)
-        await logger.info("Cancelled order: {}".format(order_id))
-
-
-async def cancel_take_profit_order(client, symbol, logger, params, order_id):
-    try:
-        await client.cancel_order(symbol=symbol, orderId=order_id)
-    except Exception as e:
-        await logger.error("Error cancelling order: {}".format(e))
-    else:
-        take_profit_orders = await params.get_param("take_profit_orders")
-        prev_id = take_profit_orders[order_id]
-        del take_profit_orders[order_id]
-        del take_profit_orders[prev_id]
-        await params.update_param("take_profit_orders", take_profit_orders)
-        await logger.info("Cancelled order: {}".format(order_id))
-
-
-async def cancel_all_unfilled_orders(client, symbol, logger, params):
-    regular_orders = await params.get_param("regular_orders")
-    for order_id in list(regular_orders):
-        await cancel_order(client, symbol, logger, params, order_id)
+        sl_price *= 1 + stop_loss
+        side = BUY
+    await execute_order(
+        gateway=gateway,
+        symbol=symbol,
+        side=side,
+        order_type=LIMIT,
+        amount=order.filled_qty,
+        price=sl_price,
+        precision=precision,
+        orders=orders,
+        logger=logger,
+        role=STOP_LOSS_ORDER,
+        parent_id=order.order_id
+    )
+
+
+async def send_bracket_orders(gateway, symbol, logger, params, orders, order):
+    # take profit and stop loss are independent, send them concurrently
+    await asyncio.gather(
+        send_take_profit_order(gateway, symbol, logger, params, orders, order),
+        send_stop_loss_order(gateway, symbol, logger, params, orders, order),
+    )
+
+
+async def cancel_order(gateway, symbol, logger, orders, order_id):
+    res = await gateway.cancel_order(symbol=symbol, orderId=order_id)
+    if not res.ok:
+        logger.error_nowait("Error cancelling order: {}, latency: {:.2f}ms".format(res.error, res.latency))
+        return None
+    logger.info_nowait("Cancelled order: {}, latency: {:.2f}ms".format(order_id, res.latency))
+    return orders.cancel(order_id)
+
+
+async def cancel_all_unfilled_orders(gateway, symbol, logger, orders):
+    order_ids = orders.open_ids(REGULAR_ORDER)
+    if not order_ids:
+        return
+    results = await gateway.cancel_orders(symbol, order_ids)
+    for order_id, res in zip(order_ids, results):
+        if res.ok:
+            orders.forget(orders.cancel(order_id))
+            logger.info_nowait("Cancelled order: {}, latency: {:.2f}ms".format(order_id, res.latency))
+        else:
+            logger.error_nowait("Error cancelling order: {}, latency: {:.2f}ms".format(res.error, res.latency))
 
 
-async def close_open_orders(client, symbol, logger, params):
-    orders = await client.futures_get_open_orders(symbol=symbol)
-    for order in orders:
-        if order["status"] == "NEW" or order["status"] == "PARTIALLY_FILLED":
-            try:
-                await client.cancel_order(symbol=symbol, orderId=order["orderId"])
-            except Exception as e:
-                await logger.error("Error cancelling order: {}".format(e))
-    await params.update_param("regular_orders", set())
-    await params.update_param("stoploss_orders", {})
-    await params.update_param("take_profit_orders", {})
+async def close_open_orders(gateway, symbol, logger, orders):
+    res = await gateway.cancel_all(symbol)
+    if not res.ok:
+        logger.error_nowait("Error cancelling open orders: {}, latency: {:.2f}ms".format(res.error, res.latency))
+    orders.cancel_open()
+    orders.clear()
 
 
 async def close_position(client, symbol, logger, params):
     position = await client.get_position(symbol=symbol)
     if position:
         await client.close_position(symbol=symbol)
-        await logger.info("Closed position: {}".format(position["id"]))
-
-
-async def order_filled_socket(client, symbol, logger, err, orderbook, params):
-    bsm = BinanceSocketManager(client)
-    timer = time.time()
-    keep_alive = 60*50
-    async with bsm.user_socket() as stream:
-        while True:
-            # Keep socket alive
-            if time.time() - timer > keep_alive:
-                keep_alive = time.time()
-                listen_key = await stream.get_listen_key()
-                res = await client.keep_alive(listen_key)
-                logger.info(
-                    "Keep alive: {}, Listen Key: {}".format(res, listen_key))
-            if err.status:
-                await stream.close()
-                await bsm.stop()
-                await logger.err("order_filled_socket: socket closed")
-                break
-            try:
-                res = await stream.recv()
-            except Exception as e:
-                await logger.err("order_filled_socket: {}".format(e))
-                continue
+        logger.info_nowait("Closed position: {}".format(position["id"]))
+
+
+async def recover_orders(gateway, symbol, logger, params, orders):
+    '''
+    Reconcile orders restored from the journal with the exchange instead of closing them:
+    one openOrders call, a query for each order that closed while the bot was down,
+    untracked orders are cancelled and missing bracket work is done now
+    '''
+    res = await gateway.open_orders(symbol)
+    if not res.ok:
+        logger.error_nowait("recover_orders: open orders failed: {}, dropping restored state".format(res.error))
+        orders.clear()
+        return False
+    closed, unknown = reconcile(orders, res.data)
+    results = await asyncio.gather(*(gateway.query_order(symbol=symbol, orderId=order_id) for order_id in closed))
+    for order_id, result in zip(closed, results):
+        if result.ok:
+            apply_exchange_order(orders, result.data)
+        else:
+            logger.error_nowait("recover_orders: query of {} failed: {}".format(order_id, result.error))
+            orders.cancel(order_id)
+    if unknown:
+        unknown_ids = [data['orderId'] for data in unknown]
+        logger.info_nowait("recover_orders: cancelling untracked orders: {}".format(unknown_ids))
+        await gateway.cancel_orders(symbol, unknown_ids)
+
+    brackets = []
+    for order in list(orders.orders.values()):
+        if order.status != FILLED:
+            continue
+        if order.role == REGULAR_ORDER:
+            if order.take_profit is None and order.stop_loss is None:
+                logger.info_nowait("recover_orders: regular order {} filled while down".format(order.order_id))
+                brackets.append(send_bracket_orders(gateway, symbol, logger, params, orders, order))
+        else:
+            sibling = orders.sibling(order)
+            if sibling is not None and sibling.is_open:
+                brackets.append(cancel_order(gateway, symbol, logger, orders, sibling.order_id))
+    await asyncio.gather(*brackets)
+    for order in list(orders.orders.values()):
+        if order.role != REGULAR_ORDER and order.parent is not None and not order.is_open:
+            orders.forget(order.parent)
+    return True
+
+
+async def open_journal(gateway, symbol, logger, params, orders, folder=JOURNAL_FOLDER):
+    '''
+    Restore the saved state of a symbol, start journaling it and reconcile with the exchange
+    Returns: the started Journal
+    '''
+    timer = time.perf_counter()
+    journal = Journal(symbol, folder)
+    replayed = journal.restore(orders, params.params)
+    journal.start()
+    orders.journal = params.journal = journal
+    if replayed >= 0 and await recover_orders(gateway, symbol, logger, params, orders):
+        logger.info_nowait("open_journal: resumed {} open orders, {} records replayed in {:.1f}ms".format(
+            sum(orders.open_count(role) for role in orders.open), replayed, (time.perf_counter() - timer) * 1000))
+    # the journal restarts from this state
+    journal.snapshot(orders, params.params)
+    return journal
+
+
+async def load_risk_positions(client, limiter, risk, logger):
+    try:
+        count = await load_positions(client, limiter, risk)
+    except Exception as e:
+        logger.error_nowait("load_risk_positions: {}".format(e))
+        return
+    logger.info_nowait("load_risk_positions: {} positions, exposure: {:.2f}".format(count, risk.exposure))
+
+
+async def handle_user_event(gateway, symbol, logger, err, orderbook, params, orders, res):
+    if res['e'] == "ORDER_TRADE_UPDATE":
+        update = res['o']
+        if update['s'] != symbol:
+            return
+        order = orders.on_order_update(update)
+        if order is None:
+            if update['X'] == 'FILLED':
+                logger.error_nowait("Unknow Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(update['i'], update['S'], update['z'], update['L']))
+            return
+        if order.status != FILLED:
+            return
+        if order.role == REGULAR_ORDER:
+            received = time.time_ns() if LATENCY.enabled else 0
+            if received:
+                LATENCY.record(FILL_EVENT_TO_RECV, received - res['E'] * 1000000)
+            logger.info_nowait("Regular Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order.order_id, order.side, order.filled_qty, order.avg_price))
+            await send_bracket_orders(gateway, symbol, logger, params, orders, order)
+            if received:
+                LATENCY.since(FILL_TO_BRACKET_ACK, received)
+        else:
+            if order.role == TAKE_PROFIT_ORDER:
+                logger.info_nowait("Take Profit Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order.order_id, order.side, order.filled_qty, order.avg_price))
             else:
-                if res['e'] == "ORDER_TRADE_UPDATE":
-                    order = res['o']
-                    if order['s'] == symbol and order['x'] == 'FILLED':
-                        regular_orders = await params.get_param("regular_orders")
-                        take_profit_orders = await params.get_param("take_profit_orders")
-                        stoploss_orders = await params.get_param("stoploss_orders")
-
-                        order_id = order['i']
-                        side = order['S'].lower()
-                        filled_qty = order['l']
-                        fill_price = float(order['L'])
-
-                        if order_id in regular_orders:
-                            regular_orders.remove(order_id)
-                            await params.update_param("regular_orders", regular_orders)
-                            await logger.info("Regular Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order_id, side, filled_qty, fill_price))
-
-                            await send_take_profit_order(client, symbol, logger, err, orderbook, params, order_id, side, filled_qty, fill_price)
-                            await send_stop_loss_order(client, symbol, logger, err, orderbook, params, order_id, side, filled_qty, fill_price)
-                        elif order in take_profit_orders:
-                            await logger.info("Take Profit Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order_id, side, filled_qty, fill_price))
-                            prev_id = take_profit_orders[order_id]
-                            st_id = stoploss_orders[prev_id]
-                            del take_profit_orders[order_id]
-                            del take_profit_orders[prev_id]
-
-                            await cancel_stoploss_order(client, symbol, logger, params, st_id)
-                        elif order in stoploss_orders:
-                            await logger.info("Stop Loss Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order_id, side, filled_qty, fill_price))
-                            prev_id = stoploss_orders[order_id]
-                            tp_id = take_profit_orders[prev_id]
-                            del stoploss_orders[order_id]
-                            del stoploss_orders[prev_id]
-
-                            await cancel_take_profit_order(client, symbol, logger, params, tp_id)
-                        else:
-                            await logger.err("Unknow Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order_id, side, filled_qty, fill_price))
-                            print("Unknow Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(
-                                order_id, side, filled_qty, fill_price))
-                elif res['e'] == 'ACCOUNT_UPDATE':
-                    position = res['a']['P']
-                    for pos in position:
-                        if pos['s'] == symbol and pos['ps'] == "BOTH":
-                            posAmt = pos['pa']
-                            pnl = pos['up']
-                            await params.update_param("posAmt", posAmt)
-                            await params.update_param("pnl", pnl)
-        logger.info("order_filled_socket: socket closed")
-
-
-async def market_data_socket(client, symbol, logger, err, orderbook):
+                logger.info_nowait("Stop Loss Order Filled: id: {}, side: {}, filled_qty: {}, fill_price: {}".format(order.order_id, order.side, order.filled_qty, order.avg_price))
+            sibling = orders.sibling(order)
+            if sibling is not None and sibling.is_open:
+                await cancel_order(gateway, symbol, logger, orders, sibling.order_id)
+            if order.parent is not None:
+                orders.forget(order.parent)
+    elif res['e'] == 'ACCOUNT_UPDATE':
+        position = res['a']['P']
+        for pos in position:
+            if pos['s'] == symbol and pos['ps'] == "BOTH":
+                posAmt = pos['pa']
+                pnl = pos['up']
+                await params.update_param("posAmt", posAmt)
+                await params.update_param("pnl", pnl)
+                if orders.risk is not None:
+                    orders.risk.on_position(float(posAmt), float(pnl), float(pos.get('ep') or 0))
+
+
+async def order_filled_socket(client, gateway, symbol, logger, err, orderbook, params, orders, recorder=None):
     bsm = BinanceSocketManager(client)
-    orderboom_stream = symbol.lower()+'@bookTicker'
-
-    keepalive = 60*50
-    timer = time.time()
-
-    price_timer = time.time()
-
-    async with bsm._get_socket(orderboom_stream)as stream:
+    # the futures user data stream is read by python-binance, which also keeps its listen key alive
+    async with bsm.futures_user_socket() as stream:
+        # other symbols and event types are dropped before decoding
+        install(stream, EventFilter(USER_EVENTS, symbol))
         while True:
-            if time.time() - timer > keep_alive:
-                keep_alive = time.time()
-                listen_key = await stream.get_listen_key()
-                res = await client.keep_alive(listen_key)
-                logger.info(
-                    "Keep alive: {}, Listen Key: {}".format(res, listen_key))
             if err.status:
                 await stream.close()
                 await bsm.stop()
-                await logger.err("market_data_socket: socket closed")
+                logger.error_nowait("order_filled_socket: socket closed")
                 break
             try:
                 res = await stream.recv()
             except Exception as e:
-                await logger.err("market_data_socket: {}".format(e))
+                logger.error_nowait("order_filled_socket: {}".format(e))
                 continue
             else:
-                if 'stream' in res and res['stream'] == orderboom_stream and 'data' in res:
-                    data = res['data']
-                    bid, ask = float(res['b']), float(res['a'])
-
-                    temp_orderbook = {'bid': bid, 'ask': ask}
-                    if price_timer+1 <= time.time():
-                        # further indicator calculation
-                        price_timer = time.time()
-                    orderbook.updates(temp_orderbook)
-                elif res['e'] == 'error':
-                    await logger.err("market_data_socket: {}".format(res))
-                    err.status = True
-        print("market_data_socket: socket closed")
-
-
-async def regular_order_stream(client, symbol, logger, err, orderbook, params):
-    await logger.info("regular_order_stream: started")
+                if recorder is not None:
+                    recorder.on_user_event(res, time.time_ns())
+                await handle_user_event(gateway, symbol, logger, err, orderbook, params, orders, res)
+        logger.info_nowait("order_filled_socket: socket closed")
+
+
+def book_handler(orderbook, trigger=None):
+    update_book = instrument_book(orderbook.on_book_ticker)
+    if trigger is None:
+        return update_book
+
+    def handler(data, recv_time=0):
+        if update_book(data, recv_time):
+            trigger.on_book()
+            return True
+        return False
+    return handler
+
+
+async def market_data_socket(symbol, logger, err, orderbook, stream_url=STREAM_URL, bars=None, trigger=None,
+                             record_folder=None):
+    router = StreamRouter()
+    recorder = Recorder(symbol, record_folder) if record_folder else None
+    on_book = book_handler(orderbook, trigger)
+    if recorder is not None:
+        on_book = recorder.recording_book(on_book, orderbook)
+    router.add(symbol.lower()+'@bookTicker', on_book)
+    if bars is not None:
+        # indicators update on every closed bar of aggregated trades
+        on_trade = bars.on_agg_trade
+        if recorder is not None:
+            on_trade = recorder.recording(on_trade, recorder.on_agg_trade)
+        router.add(symbol.lower()+'@aggTrade', on_trade)
+    elif recorder is not None:
+        router.add(symbol.lower()+'@aggTrade', recorder.on_agg_trade)
+    try:
+        await combined_market_data_socket(combined_stream_url(router.streams(), stream_url), router, logger, err)
+    finally:
+        if recorder is not None:
+            recorder.close()
+    print("market_data_socket: socket closed")
+
+
+async def replay_market_data(symbol, logger, err, orderbook, record_folder=RECORD_FOLDER, speed=0, bars=None,
+                             trigger=None):
+    '''
+    Stand-in for market_data_socket that feeds a recording through the same handlers
+    '''
+    handlers = {BOOK_TICKER: book_handler(orderbook, trigger)}
+    if bars is not None:
+        handlers[AGG_TRADE] = bars.on_agg_trade
+    count = await replay(symbol, handlers, record_folder, speed, err)
+    logger.info_nowait("replay_market_data: replayed {} messages".format(count))
+
+
+async def depth_socket(client, limiter, symbol, logger, err, depth_book, stream_url=STREAM_URL):
+    '''
+    Keep depth_book synced from the futures diff-depth stream and futures REST snapshots
+    The book is telemetry only, it is logged on every sync and the quoting does not read it
+    '''
+    depth_stream = symbol.lower()+'@depth@100ms'
+    snapshot_task = None
+
+    async def load_snapshot():
+        try:
+            snapshot = await limited_call(limiter, client, DEPTH_WEIGHT, client.futures_order_book,
+                                          symbol=symbol, limit=DEPTH_LIMIT)
+        except Exception as e:
+            logger.error_nowait("depth_socket: snapshot failed: {}".format(e))
+            return
+        if depth_book.on_snapshot(snapshot):
+            logger.info_nowait("depth_socket: synced at {}, resyncs: {}, bid: {}, ask: {}".format(
+                depth_book.last_update_id, depth_book.resyncs, depth_book.best_bid(), depth_book.best_ask()))
+
+    def on_depth(data, recv_time=0):
+        nonlocal snapshot_task
+        depth_book.on_event(data)
+        # buffer diffs while the snapshot is in flight, refetch if it came back too old
+        if not depth_book.synced and (snapshot_task is None or snapshot_task.done()):
+            snapshot_task = asyncio.ensure_future(load_snapshot())
+
+    router = StreamRouter()
+    router.add(depth_stream, on_depth)
+    await combined_market_data_socket(combined_stream_url(router.streams(), stream_url), router, logger, err)
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    logger.info_nowait("depth_socket: terminated")
+
+
+async def regular_order_stream(client, gateway, symbol, logger, err, orderbook, params, orders, indicators=None):
+    logger.info_nowait("regular_order_stream: started")
     order_interval = await params.get_param("order_interval")
     order_interval = int(order_interval)
     max_order = await params.get_param("max_order")
     enable_close_position = await params.get_param("close_position")
     enable_close_open_orders = await params.get_param("close_open_orders")
 
-    await logger.info("Regular Order Interval: {}".format(order_interval))
+    logger.info_nowait("Regular Order Interval: {}".format(order_interval))
     await asyncio.sleep(5)
     timer = time.time()
     while True:
         if err.status:
-            await logger.err("regular_order_stream: terminated")
+            logger.error_nowait("regular_order_stream: terminated")
             if enable_close_open_orders:
-                await close_open_orders(client, symbol, logger, params)
+                await close_open_orders(gateway, symbol, logger, orders)
             if enable_close_position:
                 await close_position(client, symbol, logger, params)
             break
-        if time.time() - timer > order_interval or len(await params.get_param("regular_orders")) < max_order:
-            await cancel_all_unfilled_orders(client, symbol, logger, params)
-            best_bid = await orderbook.get('bid')
-            best_ask = await orderbook.get('ask')
-            amount = await orderbook.get("amount")
-            precision = await orderbook.get('precision')
+        if orderbook.update_id < 0:
+            # no book yet
+            await asyncio.sleep(1)
+            continue
+        if time.time() - timer > order_interval or orders.open_count(REGULAR_ORDER) < max_order:
+            await cancel_all_unfilled_orders(gateway, symbol, logger, orders)
+            best_bid, best_ask = orderbook.prices()
+            amount = await params.get_param("amount")
+            precision = await params.get_param('precision')
 
             # calculate bid/ask depending on the other indicators
+            if indicators is not None and indicators.ready:
+                _, _, bid_qty, _, ask_qty, _, _ = orderbook.snapshot()
+                values = indicators.values()
+                values['microprice'] = microprice(best_bid, bid_qty, best_ask, ask_qty)
+                logger.info_nowait("Indicators: {}".format(values))
             # end
 
-            await logger.info("Regular Order: best_bid: {}, best_ask: {}".format(best_bid, best_ask))
-            # BID
-            await execute_order(
-                client=client,
-                symbol=symbol,
-                side=BUY,
-                order_type=LIMIT,
-                amount=amount,
-                price=best_bid,
-                precision=precision,
-                logger=logger
-            )
-            # ASK
-            await execute_order(
-                client=client,
-                symbol=symbol,
-                side=SELL,
-                order_type=LIMIT,
-                amount=amount,
-                price=best_ask,
-                precision=precision,
-                logger=logger
-            )
+            decision = time.time_ns() if LATENCY.enabled else 0
+            if decision:
+                LATENCY.record(BOOK_TO_DECISION, decision - orderbook.recv_time)
+            logger.info_nowait("Regular Order: best_bid: {}, best_ask: {}".format(best_bid, best_ask))
+            await place_quotes(gateway, symbol, logger, orders, amount, best_bid, best_ask, precision)
+            if decision:
+                LATENCY.since(DECISION_TO_ACK, decision)
             timer = time.time()
         await asyncio.sleep(1)
-    await logger.info("regular_order_stream: terminated")
+    logger.info_nowait("regular_order_stream: terminated")
+
+
+class QuoteTrigger:
+    '''
+    Wakes the quoting task when the top of book moves requote_ticks away from the last quote
+    of a side or a side lost its quote, checked from the book handler on every tick
+    '''
+
+    def __init__(self, orderbook, requote_ticks=REQUOTE_TICKS):
+        self.orderbook = orderbook
+        self.requote_ticks = requote_ticks
+        # last quoted price of each side in ticks, None when the side has no quote
+        self.quoted = {BUY: None, SELL: None}
+        self.event = asyncio.Event()
+        self.triggers = 0
+
+    def on_book(self):
+        if self.event.is_set():
+            return
+        state = self.orderbook.state
+        quoted_bid, quoted_ask = self.quoted[BUY], self.quoted[SELL]
+        if quoted_bid is None or quoted_ask is None \
+                or abs(state[1] - quoted_bid) >= self.requote_ticks \
+                or abs(state[3] - quoted_ask) >= self.requote_ticks:
+            self.triggers += 1
+            self.event.set()
+
+    def on_order_closed(self, order):
+        if order.role == REGULAR_ORDER:
+            self.quoted[order.side] = None
+            self.event.set()
+
+    async def wait(self, timeout):
+        '''
+        Returns: True if triggered, False on timeout
+        '''
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+async def requote_side(gateway, symbol, logger, orders, trigger, side, ticks, amount, precision):
+    '''
+    Keep one quote on a side at ticks: place it if missing, amend it in place if it is
+    requote_ticks away, cancel and replace it if the amend is rejected
+    '''
+    scale = trigger.orderbook.scale
+    price = scale.to_price(ticks)
+    # a failed placement is retried on the next move or timeout, not on every tick
+    trigger.quoted[side] = ticks
+    order = orders.working(side)
+    if order is None:
+        await execute_order(gateway, symbol, side, LIMIT, amount, price, precision, orders, logger)
+        return
+    if abs(scale.to_ticks(order.price) - ticks) < trigger.requote_ticks:
+        return
+    if orders.risk is not None:
+        reason = orders.risk.check(side, order.qty - order.filled_qty, price, replaces=order)
+        if reason is not None:
+            logger.error_nowait("Amend rejected - id: {}, side: {}, price: {}, risk: {}".format(
+                order.order_id, side, price, reason))
+            return
+    res = await gateway.modify_order(symbol, side, order.qty, price, orderId=order.order_id)
+    if res.ok:
+        LATENCY.record(ORDER_ROUND_TRIP, res.latency * 1e6)
+        orders.reprice(order.order_id, price)
+        logger.info_nowait("Amended order - id: {}, side: {}, price: {}, latency: {:.2f}ms".format(
+            order.order_id, side, price, res.latency))
+        return
+    logger.error_nowait("Amend failed - id: {}, error: {}, latency: {:.2f}ms".format(
+        order.order_id, res.error, res.latency))
+    # a rejected cancel means it filled meanwhile, the fill handler takes over
+    cancelled = await cancel_order(gateway, symbol, logger, orders, order.order_id)
+    if cancelled is not None:
+        orders.forget(cancelled)
+        await execute_order(gateway, symbol, side, LIMIT, amount, price, precision, orders, logger)
+
+
+async def event_quote_stream(client, gateway, symbol, logger, err, orderbook, params, orders, trigger,
+                             debounce=DEBOUNCE):
+    '''
+    Quote both sides at the top of book and requote only the side that moved, woken by
+    QuoteTrigger instead of polling
+    '''
+    logger.info_nowait("event_quote_stream: started")
+    order_interval = int(await params.get_param("order_interval"))
+    enable_close_position = await params.get_param("close_position")
+    enable_close_open_orders = await params.get_param("close_open_orders")
+    amount = await params.get_param("amount")
+    precision = await params.get_param('precision')
+    orders.on_close = trigger.on_order_closed
+
+    while True:
+        if err.status:
+            logger.error_nowait("event_quote_stream: terminated")
+            if enable_close_open_orders:
+                await close_open_orders(gateway, symbol, logger, orders)
+            if enable_close_position:
+                await close_position(client, symbol, logger, params)
+            break
+        if orderbook.update_id < 0:
+            await asyncio.sleep(0.1)
+            continue
+        # the timeout also retries sides whose placement failed
+        await trigger.wait(order_interval)
+        if err.status:
+            continue
+        # let a burst of ticks settle and quote the latest book once
+        await asyncio.sleep(debounce)
+        trigger.event.clear()
+        decision = time.time_ns() if LATENCY.enabled else 0
+        if decision:
+            LATENCY.record(BOOK_TO_DECISION, decision - orderbook.recv_time)
+        _, bid, _, ask, _, _, _ = orderbook.snapshot()
+        await asyncio.gather(
+            requote_side(gateway, symbol, logger, orders, trigger, BUY, bid, amount, precision),
+            requote_side(gateway, symbol, logger, orders, trigger, SELL, ask, amount, precision),
+        )
+        if decision:
+            LATENCY.since(DECISION_TO_ACK, decision)
+    logger.info_nowait("event_quote_stream: terminated")
 
 
 class Error:
@@ -381,63 +614,167 @@ class Error:
         self.data = ""
 
 
-async def run_strat(symbol, api_key, api_secret, url, init_amount, order_interval):
+async def setup_symbol(client, limiter, symbol, symbols, logger, init_amount, order_interval,
+                       max_order=MAX_ORDER, take_profit=TAKE_PROFIT, stop_loss=STOP_LOSS):
+    info = symbols.get(symbol)
+    if info is None:
+        return None
+
+    precision = info.price_precision
+    quantityPrecision = info.quantity_precision
+
+    current_ticker = await limited_call(limiter, client, TICKER_WEIGHT, client.get_symbol_ticker, symbol=symbol)
+    cur_price = float(current_ticker["price"])
+
+    amount = round(init_amount/cur_price, quantityPrecision)
+
+    orderbook = TopOfBook(symbol, TickScale(info.tick_size, info.price_precision))
+
+    temp_params = {
+        'order_interval': order_interval,
+        'max_order': max_order,
+        'take_profit': take_profit,
+        'stop_loss': stop_loss,
+        'precision': precision,
+        'amount': amount,
+        'close_position': True,
+        'close_open_orders': True,
+        'posAmt': 0,
+        'pnl': 0,
+    }
+    params = ClientParams([], logger)
+    await params.set_params(temp_params)
+    orders = OrderManager(symbol)
+    return orderbook, params, orders
+
+
+async def run_strat(symbol, api_key, api_secret, url, init_amount, order_interval,
+                    max_order=MAX_ORDER, take_profit=TAKE_PROFIT, stop_loss=STOP_LOSS, enable_depth=False,
+                    futures_url=FUTURES_URL, stream_url=STREAM_URL, enable_latency=False,
+                    indicator_interval=INDICATOR_INTERVAL, warmup_bars=WARMUP_BARS,
+                    event_quoting=False, requote_ticks=REQUOTE_TICKS, feed_mode=INLINE, feed_cpus=None,
+                    journal_folder=JOURNAL_FOLDER, record_folder=None, replay_folder=None, replay_speed=0,
+                    risk_limits=None, sim=False):
+    '''
+    enable_depth: keep an L2 DepthBook from the futures depth stream, telemetry only, quotes do not read it
+    risk_limits: dict of RiskEngine limits, orders then pass its pre-trade checks,
+    an empty dict uses the defaults of risk.py and None disables the checks
+    journal_folder: order state is journaled there and resumed on restart, None disables it
+    record_folder: market data and user events are recorded there, None disables it
+    replay_folder: market data is replayed from this recording instead of the live streams,
+    at replay_speed (0 as fast as possible, 1 the recorded pace), with the feed inline;
+    the orders still go to futures_url, so it must point at a local simulator or sim must be set
+    sim: futures_url is a simulator on another host, replay is allowed against it
+    feed_mode: INLINE reads market data on the strategy loop, THREAD on its own loop in a thread,
+    PROCESS in a child process through a shared book; feed_cpus pins the feed thread or process
+    '''
+    if feed_mode not in FEED_MODES:
+        raise ValueError("unknown feed mode: {}".format(feed_mode))
+    if replay_folder and not (sim or is_local_url(futures_url)):
+        # replayed prices would be quoted on the live exchange
+        raise ValueError("replay sends orders to {}, point futures_url at a simulator or set sim".format(
+            futures_url))
     client = await create_client(api_key, api_secret, url)
+    logger = Logger('simple_strat', symbol)
+    LATENCY.enable(enable_latency)
+    gateway = await OrderGateway(api_key, api_secret, futures_url, logger=logger).start()
 
     # Check valid symbol
-    market_info = await client.get_exchange_info()
+    symbols = await SymbolCache(logger=logger).ensure(client, gateway.limiter)
 
-    symbol_data = {}
-    for sym in market_info["symbols"]:
-        if sym['symbol'] == symbol:
-            symbol_data = sym
-            break
-    if symbol_data == {}:
+    setup = await setup_symbol(client, gateway.limiter, symbol, symbols, logger, init_amount, order_interval,
+                               max_order, take_profit, stop_loss)
+    if setup is None:
         print("Invalid symbol")
-        await client.close()
+        await gateway.close()
+        await client.close_connection()
     else:
-        tick = float(symbol_data["fillter"][0]["tickSize"])
-        precision = await get_precision(tick)
-        quantityPrecision = int(symbol_data["quantityPrecision"])
-
-        current_ticker = await client.get_symbol_ticker(symbol=symbol)
-        cur_price = float(current_ticker["price"])
-
-        amount = round(init_amount/cur_price, quantityPrecision)
-
-        logger = Logger('simple_strat', symbol)
+        orderbook, params, orders = setup
+        if replay_folder:
+            feed_mode = INLINE
+        indicators = IndicatorEngine()
+        if indicator_interval:
+            try:
+                warmup(indicators, await load_warmup_klines(
+                    client, gateway.limiter, symbol, indicator_interval, warmup_bars, logger=logger))
+            except Exception as e:
+                logger.error_nowait("run_strat: indicator warmup failed: {}".format(e))
+            logger.info_nowait("run_strat: indicators warmed up on {} bars".format(indicators.bars))
+        bars = BarBuilder(INTERVAL_MS[indicator_interval], indicators.update) if indicator_interval else None
+        if bars is not None and indicators.bars:
+            # live bars continue the warmup series
+            bars.seed(indicators.open_time, indicators.close)
 
         err = Error()
-
-        # Fake orderbook
-        orderbook = Orderbook(["bid", "ask"], logger)
-
-        temp_params = {
-            'regular_orders': set([]),
-            'take_profit_orders': {},
-            'stoploss_orders': {},
-            'order_interval': order_interval,
-            'max_order': 2,
-            'close_position': True,
-            'close_open_orders': True,
-            'posAmt': 0,
-            'pnl': 0,
-        }
-        params = ClientParams([], logger)
-        params.set(params=temp_params)
-
-        event_loop = asyncio.get_event_loop()
+        risk = None
+        if risk_limits is not None:
+            risk = RiskEngine(logger=logger, **risk_limits)
+            orders.risk = risk.add(symbol, orderbook)
+        journal = None
+        if journal_folder:
+            journal = await open_journal(gateway, symbol, logger, params, orders, journal_folder)
+        if feed_mode == PROCESS:
+            orderbook = SharedTopOfBook(symbol, orderbook.scale)
+        if risk is not None:
+            risk.add(symbol, orderbook)
+            await load_risk_positions(client, gateway.limiter, risk, logger)
+        user_recorder = Recorder(symbol, record_folder, USER) if record_folder else None
+        trigger = QuoteTrigger(orderbook, requote_ticks) if event_quoting else None
+
+        if trigger is not None:
+            quoting = event_quote_stream(client, gateway, symbol, logger, err, orderbook, params, orders, trigger)
+        else:
+            quoting = regular_order_stream(client, gateway, symbol, logger, err, orderbook, params, orders, indicators)
         events = [
-            asyncio.Task(regular_order_stream(client, symbol,
-                         logger, err, params, orderbook, params)),
+            asyncio.Task(quoting),
             asyncio.Task(order_filled_socket(
-                client, symbol, logger, err, orderbook, params)),
-            asyncio.Task(market_data_socket(
-                client, symbol, logger, err, orderbook, params)),
+                client, gateway, symbol, logger, err, orderbook, params, orders, user_recorder)),
+            asyncio.Task(symbols.refresh_loop(client, gateway.limiter, err)),
         ]
-        await event_loop.run_until_complete(asyncio.gather(*events))
-        await client.close()
-        await logger.info("run_strat: terminated")
+        if journal is not None:
+            events.append(asyncio.Task(journal.snapshot_loop(orders, params, err)))
+        if replay_folder:
+            events.append(asyncio.Task(replay_market_data(
+                symbol, logger, err, orderbook, replay_folder, replay_speed, bars, trigger)))
+        elif feed_mode == INLINE:
+            events.append(asyncio.Task(market_data_socket(
+                symbol, logger, err, orderbook, stream_url, bars, trigger, record_folder)))
+        elif feed_mode == THREAD:
+            loop = asyncio.get_running_loop()
+            # the book tuple is the slot, wake-ups and closed bars are handed over to this loop
+            wake = Mailbox(loop, trigger.on_book) if trigger is not None else None
+            if bars is not None:
+                bars.on_bar = lambda *bar: loop.call_soon_threadsafe(indicators.update, *bar)
+            feed = FeedThread(lambda feed_loop: market_data_socket(
+                symbol, logger, err, orderbook, stream_url, bars, wake, record_folder), feed_cpus,
+                err=err, logger=logger).start()
+            events.append(asyncio.Task(feed.wait()))
+        else:
+            # indicators keep their warmup values, aggTrade is not read in the feed process
+            feed = FeedProcess(market_data_socket, orderbook, (stream_url, None, None, record_folder), feed_cpus)
+            feed.start(trigger.on_book if trigger is not None else None, err)
+            events.append(asyncio.Task(feed.watch(err)))
+        if enable_latency:
+            events.append(asyncio.Task(loop_lag_monitor(err)))
+            install_dump_signal(symbol, logger)
+        if enable_depth:
+            depth_book = DepthBook(symbol)
+            events.append(asyncio.Task(depth_socket(
+                client, gateway.limiter, symbol, logger, err, depth_book, stream_url)))
+        await asyncio.gather(*events)
+        if journal is not None:
+            journal.close()
+        if user_recorder is not None:
+            user_recorder.close()
+        if feed_mode == PROCESS:
+            orderbook.close()
+        await gateway.close()
+        await client.close_connection()
+        if enable_latency:
+            dump_latency(symbol, logger)
+        if risk is not None:
+            logger.info_nowait("run_strat: risk: {}".format(risk.summary()))
+        logger.info_nowait("run_strat: terminated")
 
 if __name__ == '__main__':
     config_keywords = set(
@@ -450,6 +787,8 @@ if __name__ == '__main__':
             if key in config_keywords:
                 param[key] = value.strip('\n')
                 config_keywords.remove(key)
+            elif key in RISK_KEYWORDS:
+                param[key] = value.strip('\n')
     if len(config_keywords) > 0:
         print("Missing config keywords: {}".format(config_keywords))
         exit(1)
@@ -459,5 +798,5 @@ if __name__ == '__main__':
     url = param['url']
     init_amount = float(param['init_amount'])
     order_interval = int(param['order_interval'])
-    asyncio.run(run_strat(symbol, api_key, api_secret,
-                url, init_amount, order_interval))
+    runtime.run(run_strat(symbol, api_key, api_secret,
+                url, init_amount, order_interval, risk_limits=read_limits(param)))
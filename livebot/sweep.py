@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+import numpy as np
+from multiprocessing import Pool, shared_memory
+
+from backtest import Market, load_klines, run_backtest, MAX_ORDER, TAKE_PROFIT, STOP_LOSS, FEE
+
+# Config
+RESULTS = 'sweep_results.jsonl'
+MARKET_FIELDS = ['time', 'bid', 'ask', 'low', 'high']
+
+# worker state, attached once per process by init_worker
+_market = None
+_blocks = []
+
+# search space
+
+
+def grid_search(space):
+    '''
+    Every combination of a dict of param -> list of values
+    Returns: list of param dicts
+    '''
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def random_search(space, samples, seed=None):
+    '''
+    Sample a dict of param -> list of values or (low, high) range
+    Ranges of two ints are sampled as ints, any other range uniformly
+    Returns: list of param dicts
+    '''
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(samples):
+        config = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    config[key] = rng.randint(low, high)
+                else:
+                    config[key] = rng.uniform(low, high)
+            else:
+                config[key] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+# shared market data
+
+
+class SharedMarket:
+    '''
+    Copy of a Market in shared memory, workers map it instead of receiving a pickled copy
+    '''
+
+    def __init__(self, market):
+        self.symbols = market.symbols
+        self.blocks = []
+        self.spec = {}
+        for field in MARKET_FIELDS:
+            array = getattr(market, field)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[field] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def attach_market(spec, symbols):
+    '''
+    Returns: (Market over the shared blocks, the blocks to keep open)
+    '''
+    blocks = []
+    arrays = {}
+    for field, (name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays[field] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    return Market(symbols=symbols, **arrays), blocks
+
+
+def init_worker(spec, symbols):
+    global _market, _blocks
+    _market, _blocks = attach_market(spec, symbols)
+
+
+def run_config(config):
+    '''
+    Backtest one config against the market attached to this worker
+    Returns: dict of the config and its results
+    '''
+    timer = time.perf_counter()
+    result = run_backtest(
+        _market,
+        init_amount=config['init_amount'],
+        order_interval=config['order_interval'],
+        max_order=config.get('max_order', MAX_ORDER),
+        take_profit=config.get('take_profit', TAKE_PROFIT),
+        stop_loss=config.get('stop_loss', STOP_LOSS),
+        fee=config.get('fee', FEE),
+    )
+    equity = np.nan_to_num(result.equity).sum(axis=0)
+    drawdown = np.maximum.accumulate(equity) - equity
+    return {
+        'params': config,
+        'pnl': float(result.pnl.sum()),
+        'pnl_by_symbol': dict(zip(_market.symbols, result.pnl.tolist())),
+        'fills': int(len(result.fills)),
+        'max_drawdown': float(drawdown.max()) if len(drawdown) else 0.0,
+        'seconds': time.perf_counter() - timer,
+    }
+
+# runner
+
+
+def sweep(market, configs, out=RESULTS, workers=None):
+    '''
+    Backtest every config over a process pool, each result is appended to out as soon as it is done
+    Returns: list of result dicts in completion order
+    '''
+    workers = workers or os.cpu_count()
+    shared = SharedMarket(market)
+    results = []
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(shared.spec, shared.symbols)) as pool, \
+                open(out, 'a') as f:
+            for result in pool.imap_unordered(run_config, configs):
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                results.append(result)
+                print('pnl: {:.4f}, params: {}'.format(result['pnl'], result['params']))
+    finally:
+        shared.close()
+    return results
+
+
+def parse_values(text, cast):
+    '''
+    '1,2,3' -> [1, 2, 3] and '1:3' -> (1, 3)
+    '''
+    if ':' in text:
+        low, high = text.split(':')
+        return (cast(low), cast(high))
+    return [cast(value) for value in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "--symbol", help="The symbols, comma separated, e.g. ETHUSDT,BTCUSDT", type=str, required=True)
+    parser.add_argument(
+        "--interval", help="The kline interval, e.g. 1m", type=str, default='1m')
+    parser.add_argument(
+        "--start", help="The start date, e.g. 2022-01-01", type=str, required=False)
+    parser.add_argument(
+        "--end", help="The end date (exclusive), e.g. 2022-02-01", type=str, required=False)
+    parser.add_argument(
+        "--store", help="The root folder of the kline store", type=str, required=False)
+    parser.add_argument(
+        "--init_amount", help="Order sizes, e.g. 100,200 or a range 100:500", type=str, default='100')
+    parser.add_argument(
+        "--order_interval", help="Requote intervals in seconds, e.g. 60,300 or 60:600", type=str, required=True)
+    parser.add_argument(
+        "--max_order", help="Max open quotes, e.g. 1,2", type=str, default=str(MAX_ORDER))
+    parser.add_argument(
+        "--take_profit", help="Take profit fractions, e.g. 0.05,0.1 or 0.01:0.2", type=str, default=str(TAKE_PROFIT))
+    parser.add_argument(
+        "--stop_loss", help="Stop loss fractions, e.g. 0.05,0.1 or 0.01:0.2", type=str, default=str(STOP_LOSS))
+    parser.add_argument(
+        "--samples", help="Random search with this many samples instead of a grid", type=int, required=False)
+    parser.add_argument(
+        "--workers", help="The number of worker processes, all cores by default", type=int, required=False)
+    parser.add_argument(
+        "--out", help="The results file, one json line per config", type=str, default=RESULTS)
+
+    args = parser.parse_args()
+    casts = {'init_amount': float, 'order_interval': int, 'max_order': int,
+             'take_profit': float, 'stop_loss': float}
+    space = {key: parse_values(getattr(args, key), cast) for key, cast in casts.items()}
+    if args.samples:
+        configs = random_search(space, args.samples)
+    else:
+        if any(isinstance(values, tuple) for values in space.values()):
+            parser.error('ranges need --samples')
+        configs = grid_search(space)
+
+    market = load_klines(args.symbol.split(','), args.interval, args.start, args.end, args.store)
+    timer = time.time()
+    sweep(market, configs, args.out, args.workers)
+    print('{} configs in {:.3f}s'.format(len(configs), time.time() - timer))
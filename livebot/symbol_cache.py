@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import asyncio
+
+from utility import make_path
+from rate_limiter import limited_call
+
+CACHE_FOLDER = 'cache'
+CACHE_FILE = CACHE_FOLDER + '/futures_exchange_info.json'
+TTL = 60 * 60
+EXCHANGE_INFO_WEIGHT = 1
+REFRESH_CHECK = 1
+RETRY_DELAY = 30
+
+
+def decimals(value):
+    '''
+    Returns: number of decimals of a binance number string, e.g. "0.01000000" -> 2
+    '''
+    if '.' not in value:
+        return 0
+    return len(value.split('.')[1].rstrip('0'))
+
+
+class SymbolInfo:
+    __slots__ = ('symbol', 'tick_size', 'step_size', 'min_qty', 'min_notional',
+                 'price_precision', 'quantity_precision')
+
+    FIELDS = __slots__
+
+    def __init__(self, symbol, tick_size, step_size, min_qty, min_notional,
+                 price_precision, quantity_precision):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.step_size = step_size
+        self.min_qty = min_qty
+        self.min_notional = min_notional
+        self.price_precision = price_precision
+        self.quantity_precision = quantity_precision
+
+    @classmethod
+    def from_exchange_info(cls, data):
+        filters = {f['filterType']: f for f in data.get('filters', [])}
+        price_filter = filters.get('PRICE_FILTER', {})
+        lot_size = filters.get('LOT_SIZE', {})
+        min_notional = filters.get('MIN_NOTIONAL', {})
+        tick_size = price_filter.get('tickSize', '0')
+        step_size = lot_size.get('stepSize', '0')
+        return cls(
+            symbol=data['symbol'],
+            tick_size=float(tick_size),
+            step_size=float(step_size),
+            min_qty=float(lot_size.get('minQty', 0)),
+            # futures call it notional, spot minNotional
+            min_notional=float(min_notional.get('notional', min_notional.get('minNotional', 0))),
+            # prices are rounded to the tick, not to pricePrecision
+            price_precision=decimals(tick_size),
+            quantity_precision=int(data.get('quantityPrecision', decimals(step_size))),
+        )
+
+    def to_list(self):
+        return [getattr(self, field) for field in SymbolInfo.FIELDS]
+
+    def __repr__(self):
+        return 'SymbolInfo({})'.format(', '.join('{}={}'.format(field, getattr(self, field))
+                                                 for field in SymbolInfo.FIELDS))
+
+
+class SymbolCache:
+    '''
+    Parsed symbol filters of the futures exchange info, kept on disk for TTL seconds
+    Every bot process on the host reads the same file, only a stale file is downloaded again
+    and that happens in the background while the old entries keep serving lookups
+    '''
+
+    def __init__(self, path=CACHE_FILE, ttl=TTL, logger=None):
+        self.path = path
+        self.ttl = ttl
+        self.logger = logger
+        self.symbols = {}
+        self.time = 0
+        self.mtime = 0
+        self.refreshing = None
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
+
+    def get(self, symbol):
+        return self.symbols.get(symbol)
+
+    def fresh(self):
+        return time.time() - self.time < self.ttl
+
+    def load(self):
+        '''
+        Read the cache file if it changed since the last read
+        Returns: True if entries are loaded
+        '''
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return bool(self.symbols)
+        if mtime == self.mtime:
+            return bool(self.symbols)
+        try:
+            with open(self.path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return bool(self.symbols)
+        self.symbols = {row[0]: SymbolInfo(*row) for row in cache['symbols']}
+        self.time = cache['time']
+        self.mtime = mtime
+        return bool(self.symbols)
+
+    def save(self):
+        make_path(os.path.dirname(self.path) or '.')
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'time': self.time, 'symbols': [info.to_list() for info in self.symbols.values()]}, f)
+        # other processes only ever see a complete file
+        os.replace(tmp, self.path)
+        self.mtime = os.stat(self.path).st_mtime
+
+    def update(self, exchange_info):
+        self.symbols = {data['symbol']: SymbolInfo.from_exchange_info(data)
+                        for data in exchange_info['symbols']}
+        self.time = time.time()
+        self.save()
+
+    async def refresh(self, client, limiter):
+        # another process may have refreshed the file already
+        self.load()
+        if self.fresh():
+            return
+        exchange_info = await limited_call(limiter, client, EXCHANGE_INFO_WEIGHT, client.futures_exchange_info)
+        self.update(exchange_info)
+        if self.logger:
+            self.logger.info_nowait("SymbolCache: refreshed {} symbols".format(len(self.symbols)))
+
+    async def try_refresh(self, client, limiter):
+        '''
+        Returns: True if the entries are fresh afterwards
+        '''
+        try:
+            await self.refresh(client, limiter)
+        except Exception as e:
+            if self.logger:
+                self.logger.error_nowait("SymbolCache: refresh failed: {}".format(e))
+            return False
+        return True
+
+    def refresh_nowait(self, client, limiter):
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(self.try_refresh(client, limiter))
+        return self.refreshing
+
+    async def ensure(self, client, limiter):
+        '''
+        Make the entries usable: a cold cache is downloaded now, a stale one is served
+        while it refreshes in the background
+        '''
+        if not self.load():
+            await self.refresh(client, limiter)
+        elif not self.fresh():
+            self.refresh_nowait(client, limiter)
+        return self
+
+    async def refresh_loop(self, client, limiter, err):
+        while not err.status:
+            await asyncio.sleep(REFRESH_CHECK)
+            if not self.fresh() and not await self.refresh_nowait(client, limiter):
+                await asyncio.sleep(RETRY_DELAY)
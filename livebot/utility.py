@@ -1,5 +1,5 @@
 import asyncio
-from binance.client import Client
+from binance import AsyncClient
 from pathlib import Path
 
 
@@ -8,7 +8,8 @@ def make_path(path):
 
 
 async def create_client(api_key, api_secret, url):
-    client = await Client(api_key, api_secret)
+    # AsyncClient.create pings the default API_URL before url can be set
+    client = AsyncClient(api_key, api_secret)
     client.API_URL = url
     return client
 
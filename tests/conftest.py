@@ -0,0 +1,15 @@
+import os
+import sys
+import socket
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# livebot and the data scripts import their modules flat, as when run from their own folder
+for folder in (os.path.join(ROOT, 'livebot'), os.path.join(ROOT, 'data_scripts', 'data_download')):
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,122 @@
+import json
+import asyncio
+import websockets
+
+import market_stream
+from rate_limiter import RateLimiter
+from data_structure.depth_book import DepthBook, BID, ASK
+from simple_strat import depth_socket
+
+SYMBOL = 'ETHUSDT'
+STREAM = 'ethusdt@depth@100ms'
+SNAPSHOT = {'lastUpdateId': 100,
+            'bids': [['99.9', '1'], ['100.0', '2'], ['99.8', '0']],
+            'asks': [['100.2', '3'], ['100.1', '1']]}
+
+
+def diff(first, last, previous, bids=(), asks=()):
+    return {'e': 'depthUpdate', 'E': last, 'U': first, 'u': last, 'pu': previous,
+            'b': [list(level) for level in bids], 'a': [list(level) for level in asks]}
+
+
+def synced_book():
+    book = DepthBook(SYMBOL)
+    # buffered before the snapshot: one too old, one straddling it, one continuing
+    assert not book.on_event(diff(90, 95, 89, [('100.0', '9')]))
+    assert not book.on_event(diff(96, 102, 95, [('100.0', '5')]))
+    assert not book.on_event(diff(103, 104, 102, asks=[('100.1', '0')]))
+    assert book.on_snapshot(SNAPSHOT)
+    return book
+
+
+def test_snapshot_bridges_the_buffer():
+    book = synced_book()
+    assert book.synced and book.last_update_id == 104
+    # the event older than the snapshot is dropped, the straddling one applies
+    assert book.depth(BID, 5) == [(100.0, 5.0), (99.9, 1.0)]
+    assert book.depth(ASK, 5) == [(100.2, 3.0)]
+    assert book.mid() == 100.1
+    assert book.on_event(diff(105, 106, 104, [('100.05', '1')], [('100.15', '2')]))
+    assert book.best_bid() == (100.05, 1.0) and book.best_ask() == (100.15, 2.0)
+    assert book.vwap(ASK, 4) == ((100.15 * 2 + 100.2 * 2) / 4, 4.0)
+    # a late duplicate is not a gap
+    assert not book.on_event(diff(103, 104, 102)) and book.synced
+
+
+def test_snapshot_older_than_the_buffer():
+    book = DepthBook(SYMBOL)
+    book.on_event(diff(110, 112, 109))
+    # events 101 to 109 are missing between the snapshot and the buffer
+    assert not book.on_snapshot(SNAPSHOT)
+    assert not book.synced
+    assert book.on_snapshot(dict(SNAPSHOT, lastUpdateId=111))
+    assert book.last_update_id == 112
+
+
+def test_gap_drops_sync_until_a_new_snapshot():
+    book = synced_book()
+    # pu does not continue the last u, an event was lost
+    assert not book.on_event(diff(107, 108, 106, [('100.0', '7')]))
+    assert not book.synced and book.resyncs == 1
+    assert not book.on_event(diff(109, 110, 108, [('100.01', '1')]))
+    # the stale levels are kept until the snapshot that bridges the buffer
+    assert book.on_snapshot({'lastUpdateId': 107, 'bids': [['99.0', '1']], 'asks': [['101.0', '1']]})
+    assert book.synced and book.last_update_id == 110
+    assert book.depth(BID, 5) == [(100.01, 1.0), (100.0, 7.0), (99.0, 1.0)]
+
+
+class Client:
+    def __init__(self):
+        self.snapshots = 0
+
+    async def futures_order_book(self, symbol, limit):
+        self.snapshots += 1
+        await asyncio.sleep(0.05)
+        return SNAPSHOT
+
+
+class Logger:
+    def __init__(self):
+        self.infos = []
+
+    def info_nowait(self, message):
+        self.infos.append(message)
+
+    def error_nowait(self, message):
+        pass
+
+
+class Error:
+    status = False
+
+
+async def serve_depth(monkeypatch):
+    monkeypatch.setattr(market_stream, 'RECONNECT_DELAY', 0)
+    paths = []
+    book, client, logger, err = DepthBook(SYMBOL), Client(), Logger(), Error()
+
+    async def handler(ws):
+        paths.append(ws.request.path)
+        events = [diff(96, 102, 95, [('100.0', '5')]), diff(103, 104, 102), diff(105, 106, 104)]
+        for event in events:
+            await ws.send(json.dumps({'stream': STREAM, 'data': event}, separators=(',', ':')))
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.1)
+        err.status = True
+        await ws.send(json.dumps({'stream': STREAM, 'data': diff(107, 108, 106)}, separators=(',', ':')))
+        await ws.wait_closed()
+
+    async with websockets.serve(handler, '127.0.0.1', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        url = 'ws://127.0.0.1:{}/stream?streams='.format(port)
+        await asyncio.wait_for(depth_socket(client, RateLimiter(), SYMBOL, logger, err, book, url), 10)
+    return paths, book, client
+
+
+def test_depth_socket_reads_the_futures_stream(monkeypatch):
+    paths, book, client = asyncio.run(serve_depth(monkeypatch))
+    # the combined stream of the futures stream url, not the spot one of the socket manager
+    assert paths == ['/stream?streams=' + STREAM]
+    # one snapshot while the first diffs are buffered
+    assert client.snapshots == 1
+    assert book.synced and book.last_update_id == 106
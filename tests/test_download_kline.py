@@ -0,0 +1,113 @@
+import os
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+import download_kline
+from download_kline import CHECKSUM, MISMATCH_RETRIES, data_download, parallel_download
+
+SYMBOL = 'ETHUSDT'
+INTERVAL = '1m'
+
+
+class ArchiveServer:
+    '''
+    binance.vision stand-in: serves files by path, counts requests and injects faults
+    failures: path -> number of 500 responses before it is served
+    corrupt: paths served with a body that does not match its checksum
+    '''
+
+    def __init__(self):
+        self.files = {}
+        self.failures = {}
+        self.corrupt = set()
+        self.requests = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                body = server.files.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if server.failures.get(self.path):
+                    server.failures[self.path] -= 1
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                if self.path in server.corrupt:
+                    body = body[::-1]
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = 'http://127.0.0.1:{}/'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def add_archive(self, date, body):
+        filename = '{}-{}-{}.zip'.format(SYMBOL, INTERVAL, date)
+        path = '/{}/{}/{}'.format(SYMBOL, INTERVAL, filename)
+        self.files[path] = body
+        self.files[path + CHECKSUM] = '{}  {}\n'.format(hashlib.sha256(body).hexdigest(), filename).encode()
+        return path
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download_kline, 'BACKOFF', 0)
+    server = ArchiveServer()
+    yield server
+    server.close()
+
+
+def test_download_verifies_and_skips_verified(server, tmp_path):
+    path = server.add_archive('2024-01-01', os.urandom(100000))
+    assert data_download(SYMBOL, '2024-01-01', INTERVAL, str(tmp_path), chunk_size=4096, base_url=server.base_url)
+    with open(os.path.join(str(tmp_path), os.path.basename(path)), 'rb') as f:
+        assert f.read() == server.files[path]
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(download_kline.PART)]
+
+    assert data_download(SYMBOL, '2024-01-01', INTERVAL, str(tmp_path), base_url=server.base_url)
+    assert server.requests[path] == 1
+
+
+def test_missing_archive(server, tmp_path):
+    assert not data_download(SYMBOL, '2024-01-02', INTERVAL, str(tmp_path), base_url=server.base_url)
+
+
+def test_transport_errors_are_retried(server, tmp_path):
+    path = server.add_archive('2024-01-01', b'klines')
+    server.failures[path] = 2
+    assert data_download(SYMBOL, '2024-01-01', INTERVAL, str(tmp_path), base_url=server.base_url, retries=2)
+    assert server.requests[path] == 3
+
+
+def test_checksum_mismatch_attempts(server, tmp_path):
+    path = server.add_archive('2024-01-01', b'klines')
+    server.corrupt.add(path)
+    assert not data_download(SYMBOL, '2024-01-01', INTERVAL, str(tmp_path), base_url=server.base_url, retries=3)
+    # a complete download with a wrong checksum is not a transport error, retries do not multiply
+    assert server.requests[path] == MISMATCH_RETRIES + 1
+
+
+def test_parallel_download(server, tmp_path):
+    dates = ['2024-01-0{}'.format(day) for day in range(1, 7)]
+    for date in dates:
+        server.add_archive(date, os.urandom(5000))
+    folder = os.path.join(str(tmp_path), '{}', '{}')
+    jobs = [(SYMBOL, INTERVAL, date) for date in dates] + [(SYMBOL, INTERVAL, '2024-02-01')]
+    results = parallel_download(jobs, folder, workers=3, base_url=server.base_url)
+    assert results == {job: job[2] in dates for job in jobs}
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import (RingBuffer, EMA, RollingStats, RollingExtreme, RollingVWAP, BarBuilder, IndicatorEngine,
+                        microprice, warmup, indicator_series)
+
+WINDOW = 20
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(5)
+    # a random walk far from zero, where a naive sum of squares loses precision
+    return 30000 + np.cumsum(rng.normal(0, 5, 5000))
+
+
+def test_ring_buffer_evicts_oldest():
+    buffer = RingBuffer(3)
+    assert [buffer.push(value) for value in range(5)] == [None, None, None, 0, 1]
+    assert buffer.full() and len(buffer) == 3
+
+
+def test_rolling_stats_match_numpy(prices):
+    stats = RollingStats(WINDOW)
+    for i, price in enumerate(prices):
+        stats.update(price)
+        window = prices[max(0, i + 1 - WINDOW):i + 1]
+        assert stats.ready == (i + 1 >= WINDOW)
+        assert stats.mean == pytest.approx(window.mean(), rel=1e-12)
+        if len(window) > 1:
+            assert stats.variance == pytest.approx(window.var(ddof=1), rel=1e-6, abs=1e-9)
+    assert np.isnan(RollingStats(WINDOW).variance)
+
+
+@pytest.mark.parametrize('is_max', [False, True])
+def test_rolling_extreme_matches_numpy(prices, is_max):
+    extreme = RollingExtreme(WINDOW, is_max)
+    # repeated values exercise the ties in the deque
+    values = np.round(prices / 10) * 10
+    reference = np.max if is_max else np.min
+    for i, value in enumerate(values):
+        assert extreme.update(value) == reference(values[max(0, i + 1 - WINDOW):i + 1])
+        assert extreme.value == reference(values[max(0, i + 1 - WINDOW):i + 1])
+    assert len(extreme.deque) <= WINDOW
+
+
+def test_ema_and_vwap_match_pandas(prices):
+    ema = EMA(12)
+    vwap = RollingVWAP(WINDOW)
+    volumes = np.abs(np.sin(np.arange(len(prices)))) + 0.1
+    emas = [ema.update(price) for price in prices]
+    vwaps = [vwap.update(price * volume, volume) for price, volume in zip(prices, volumes)]
+    np.testing.assert_allclose(emas, pd.Series(prices).ewm(span=12, adjust=False).mean(), rtol=1e-12)
+    expected = pd.Series(prices * volumes).rolling(WINDOW, min_periods=1).sum() / \
+        pd.Series(volumes).rolling(WINDOW, min_periods=1).sum()
+    np.testing.assert_allclose(vwaps, expected, rtol=1e-9)
+
+
+def test_microprice_leans_to_the_thin_side():
+    assert microprice(100.0, 1.0, 101.0, 1.0) == 100.5
+    # little size on the ask, the next trade more likely lifts it
+    assert microprice(100.0, 9.0, 101.0, 1.0) == pytest.approx(100.9)
+    assert microprice(100.0, 0.0, 101.0, 0.0) == 100.5
+
+
+def test_bar_builder_closes_and_fills_gaps():
+    bars = []
+    builder = BarBuilder(60000, lambda *bar: bars.append(bar))
+    # the first bar is partial, the bot connected after it opened
+    builder.on_trade(59000, 98.0, 1.0)
+    builder.on_trade(60000 + 1, 100.0, 1.0)
+    builder.on_trade(60000 + 2, 102.0, 1.0)
+    builder.on_trade(60000 + 3, 99.0, 2.0)
+    assert bars == []
+    # the next trade two minutes later closes the bar and fills the empty minute between
+    builder.on_agg_trade({'T': 3 * 60000, 'p': '101', 'q': '1'})
+    assert bars == [(60000, 102.0, 99.0, 99.0, 4.0, 100.0 + 102.0 + 198.0),
+                    (2 * 60000, 99.0, 99.0, 99.0, 0.0, 0.0)]
+
+
+def test_seeded_bars_continue_the_warmup():
+    bars = []
+    builder = BarBuilder(60000, lambda *bar: bars.append(bar))
+    builder.seed(10 * 60000, 100.0)
+    # a trade of the seeded bar is already in the warmup
+    builder.on_trade(10 * 60000 + 5, 101.0, 1.0)
+    # the minutes without trades after the warmup are filled, the partial first live bar is dropped
+    builder.on_trade(13 * 60000 + 30000, 102.0, 1.0)
+    builder.on_trade(14 * 60000, 103.0, 1.0)
+    assert bars == [(11 * 60000, 101.0, 101.0, 101.0, 0.0, 0.0), (12 * 60000, 101.0, 101.0, 101.0, 0.0, 0.0)]
+    builder.on_trade(15 * 60000, 104.0, 1.0)
+    assert bars[2:] == [(14 * 60000, 103.0, 103.0, 103.0, 1.0, 103.0)]
+
+
+def test_live_bars_match_indicator_series():
+    rng = np.random.default_rng(9)
+    count, warm, interval = 80, 50, 60000
+    trades = []
+    klines = {name: [] for name in ('open_time', 'high', 'low', 'close', 'volume', 'quote_volume')}
+    price = 100.0
+    for bar in range(count):
+        times = np.sort(rng.integers(0, interval, 6)) + bar * interval
+        prices = price + np.cumsum(rng.normal(0, 0.1, 6))
+        qtys = rng.uniform(0.1, 2.0, 6)
+        price = prices[-1]
+        trades.append(list(zip(times.tolist(), prices.tolist(), qtys.tolist())))
+        klines['open_time'].append(bar * interval)
+        klines['high'].append(prices.max())
+        klines['low'].append(prices.min())
+        klines['close'].append(prices[-1])
+        klines['volume'].append(qtys.sum())
+        klines['quote_volume'].append(sum(p * q for p, q in zip(prices.tolist(), qtys.tolist())))
+    klines = {name: np.array(values) for name, values in klines.items()}
+
+    engine = warmup(IndicatorEngine(), {name: values[:warm] for name, values in klines.items()})
+    live = []
+
+    def on_bar(*bar):
+        engine.update(*bar)
+        live.append(engine.values())
+    builder = BarBuilder(interval, on_bar)
+    builder.seed(engine.open_time, engine.close)
+    # connected in the middle of the bar after the warmup
+    for trade in trades[warm][3:] + [trade for bar in trades[warm + 1:] for trade in bar]:
+        builder.on_trade(*trade)
+    builder.on_trade(count * interval, price, 1.0)
+
+    # the same values as the klines without the partial bar
+    keep = np.arange(count) != warm
+    series = indicator_series({name: values[keep] for name, values in klines.items()})
+    assert len(live) == count - warm - 1
+    for i, values in enumerate(live):
+        for name, value in values.items():
+            assert value == pytest.approx(series[name][warm + i], rel=1e-9), name
@@ -0,0 +1,111 @@
+import os
+
+from data_structure.order_manager import OrderManager, NEW, PARTIAL, REGULAR_ORDER, TAKE_PROFIT_ORDER, STOP_LOSS_ORDER
+from journal import Journal, JOURNAL_FILE, order_row, reconcile
+
+SYMBOL = 'ETHUSDT'
+
+
+def state(orders):
+    return sorted(order_row(order) for order in orders.orders.values()), \
+        {role: sorted(open_orders) for role, open_orders in orders.open.items()}
+
+
+def trade(orders, params, journal):
+    '''
+    A fill with its brackets, a repriced quote, a partial fill and a cancel
+    '''
+    orders.add(1, 'BUY', 100.0, 1.0, REGULAR_ORDER, None, 'c1')
+    orders.add(2, 'SELL', 101.0, 1.0, REGULAR_ORDER, None, 'c2')
+    orders.fill(1, 1.0, 100.0)
+    orders.add(3, 'SELL', 100.5, 1.0, TAKE_PROFIT_ORDER, 1, 'c3')
+    orders.add(4, 'SELL', 99.5, 1.0, STOP_LOSS_ORDER, 1, 'c4')
+    orders.reprice(2, 101.5)
+    orders.fill(2, 0.4, 101.5, PARTIAL)
+    orders.fill(3, 1.0, 100.5)
+    orders.cancel(4)
+    orders.forget(orders.get(1))
+    orders.add(5, 'BUY', 99.0, 2.0, REGULAR_ORDER, None, 'c5')
+    params['posAmt'] = '-0.4'
+    journal.param('posAmt', '-0.4')
+    journal.param('amount', '1')
+
+
+def restore(folder):
+    orders = OrderManager(SYMBOL)
+    params = {}
+    journal = Journal(SYMBOL, folder)
+    replayed = journal.restore(orders, params)
+    return orders, params, journal, replayed
+
+
+def test_round_trip(tmp_path):
+    folder = str(tmp_path)
+    orders = OrderManager(SYMBOL)
+    params = {}
+    journal = orders.journal = Journal(SYMBOL, folder).start()
+    trade(orders, params, journal)
+    journal.close()
+
+    restored, restored_params, restored_journal, replayed = restore(folder)
+    assert replayed == journal.seq
+    assert state(restored) == state(orders)
+    # only journaled params are persisted
+    assert restored_params == {'posAmt': '-0.4'}
+    assert restored.get(2).status == PARTIAL and restored.get(2).price == 101.5
+    # the filled regular order was forgotten with its closed brackets
+    assert restored.get(1) is None and restored.get(3) is None and restored.get(4) is None
+    assert restored.get_by_client_id('c5').status == NEW
+    # numbering continues after recovery
+    assert restored_journal.seq == journal.seq
+
+
+def test_snapshot_then_records(tmp_path):
+    folder = str(tmp_path)
+    orders = OrderManager(SYMBOL)
+    params = {}
+    journal = orders.journal = Journal(SYMBOL, folder).start()
+    orders.add(1, 'BUY', 100.0, 1.0)
+    orders.add(2, 'SELL', 101.0, 1.0)
+    journal.snapshot(orders, params)
+    trade(orders, params, journal)
+    journal.close()
+
+    restored, restored_params, _, replayed = restore(folder)
+    # the snapshot covers the first records, only the later ones are replayed
+    assert replayed == journal.seq - 2
+    assert state(restored) == state(orders)
+    assert restored_params == {'posAmt': '-0.4'}
+
+
+def test_torn_record_is_ignored(tmp_path):
+    folder = str(tmp_path)
+    orders = OrderManager(SYMBOL)
+    journal = orders.journal = Journal(SYMBOL, folder).start()
+    orders.add(1, 'BUY', 100.0, 1.0)
+    orders.add(2, 'SELL', 101.0, 1.0)
+    journal.close()
+    with open(os.path.join(folder, SYMBOL, JOURNAL_FILE), 'ab') as f:
+        f.write(b'[3,"status",2,"FIL')
+
+    restored, _, _, replayed = restore(folder)
+    assert replayed == 2
+    assert state(restored) == state(orders)
+
+
+def test_no_saved_state(tmp_path):
+    assert restore(str(tmp_path))[3] == -1
+
+
+def test_reconcile(tmp_path):
+    orders = OrderManager(SYMBOL)
+    orders.add(1, 'BUY', 100.0, 1.0, REGULAR_ORDER, None, 'c1')
+    orders.add(2, 'SELL', 101.0, 1.0, REGULAR_ORDER, None, 'c2')
+    open_orders = [
+        {'orderId': 2, 'clientOrderId': 'c2', 'status': 'PARTIALLY_FILLED', 'executedQty': '0.5', 'avgPrice': '101'},
+        {'orderId': 9, 'clientOrderId': 'x', 'status': 'NEW', 'executedQty': '0', 'avgPrice': '0'},
+    ]
+    closed, unknown = reconcile(orders, open_orders)
+    assert closed == [1]
+    assert [data['orderId'] for data in unknown] == [9]
+    assert orders.get(2).status == PARTIAL and orders.get(2).filled_qty == 0.5
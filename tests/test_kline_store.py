@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from ingest_kline import COLUMNS, partition_path, write_partition
+from kline_store import KlineStore, to_ms
+
+SYMBOL = 'ETHUSDT'
+INTERVAL = '1h'
+HOUR = 60 * 60 * 1000
+
+
+def store_month(root, month, start, rows):
+    '''
+    Write an hourly partition of rows open times starting at start, the close is the row number
+    '''
+    open_time = to_ms(start) + np.arange(rows, dtype=np.int64) * HOUR
+    columns = {name: np.zeros(rows, dtype=dtype) for name, dtype in COLUMNS}
+    columns['open_time'] = open_time
+    columns['close_time'] = open_time + HOUR - 1
+    columns['close'] = np.arange(rows, dtype=np.float64)
+    write_partition(partition_path(root, SYMBOL, INTERVAL, month), columns, {month: 'sha'})
+    return open_time
+
+
+@pytest.fixture
+def store(tmp_path):
+    root = str(tmp_path)
+    # January, February and April, March is missing
+    times = np.concatenate([store_month(root, '2024-01', '2024-01-01', 31 * 24),
+                            store_month(root, '2024-02', '2024-02-01', 29 * 24),
+                            store_month(root, '2024-04', '2024-04-01', 30 * 24)])
+    return KlineStore(root), times
+
+
+def expected(times, start, end):
+    start = times[0] if start is None else to_ms(start)
+    end = times[-1] + 1 if end is None else to_ms(end)
+    return times[(times >= start) & (times < end)]
+
+
+@pytest.mark.parametrize('start, end', [
+    (None, None),
+    ('2024-01-10', '2024-01-11'),
+    ('2024-01-31 23:00', '2024-02-01 01:00'),
+    ('2024-01-31 23:30', '2024-02-01 00:30'),
+    ('2024-02-15', '2024-04-02'),
+    ('2024-03-01', '2024-03-31'),
+    ('2023-06-01', '2024-01-01 02:00'),
+    ('2024-04-30 22:00', '2025-01-01'),
+    ('2024-05-01', None),
+    (None, '2024-01-01'),
+])
+def test_load_bounds_across_months(store, start, end):
+    store, times = store
+    klines = store.load(SYMBOL, INTERVAL, start, end)
+    np.testing.assert_array_equal(klines['open_time'], expected(times, start, end))
+    assert klines['open_time'].dtype == np.int64
+
+
+def test_single_partition_is_a_view(store):
+    store, _ = store
+    klines = store.load(SYMBOL, INTERVAL, '2024-02-02', '2024-02-03', columns=['open_time', 'close'])
+    assert sorted(klines) == ['close', 'open_time']
+    # a range inside one month is not copied out of the memory map
+    assert isinstance(klines['close'].base, np.memmap) or isinstance(klines['close'], np.memmap)
+    assert not klines['close'].flags.writeable
+    np.testing.assert_array_equal(klines['close'], np.arange(24, 48))
+
+
+def test_chunks_per_partition(store):
+    store, _ = store
+    chunks = list(store.load_chunks(SYMBOL, INTERVAL, '2024-01-31 22:00', '2024-04-01 02:00'))
+    assert [len(chunk['open_time']) for chunk in chunks] == [2, 29 * 24, 2]
+
+
+def test_refresh_sees_new_partitions(store, tmp_path):
+    store, _ = store
+    assert store.get_months(SYMBOL, INTERVAL) == ['2024-01', '2024-02', '2024-04']
+    store_month(str(tmp_path), '2024-03', '2024-03-01', 31 * 24)
+    assert len(store.load(SYMBOL, INTERVAL, '2024-03-01', '2024-04-01')['open_time']) == 0
+    store.refresh()
+    assert len(store.load(SYMBOL, INTERVAL, '2024-03-01', '2024-04-01')['open_time']) == 31 * 24
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from latency import Histogram, Latency, SUB_BUCKET_BITS, MAX_BITS
+
+# relative width of a bucket above the exact range
+ERROR = 1.0 / (1 << (SUB_BUCKET_BITS - 1))
+
+
+def test_buckets_hold_their_values():
+    histogram = Histogram()
+    rng = np.random.default_rng(3)
+    values = list(range(0, 1000)) + [int(value) for value in rng.integers(0, 1 << MAX_BITS, 10000)] + \
+        [(1 << bits) + offset for bits in range(7, MAX_BITS) for offset in (-1, 0, 1)]
+    for value in values:
+        index = histogram.index(value)
+        assert histogram.lowest(index) <= value <= histogram.highest(index)
+        if value < 1 << SUB_BUCKET_BITS:
+            assert histogram.lowest(index) == histogram.highest(index)
+        else:
+            assert histogram.highest(index) - histogram.lowest(index) + 1 <= histogram.lowest(index) * ERROR
+    # buckets are contiguous and ordered
+    for index in range(1, len(histogram.counts)):
+        assert histogram.lowest(index) == histogram.highest(index - 1) + 1
+
+
+@pytest.mark.parametrize('scale', [50, 20000, 5e6])
+def test_percentiles_within_error(scale):
+    rng = np.random.default_rng(11)
+    values = rng.lognormal(0, 1, 20000) * scale
+    values = values.astype(np.int64)
+    histogram = Histogram()
+    for value in values:
+        histogram.record(int(value))
+    ordered = np.sort(values)
+    for q in (50, 90, 99, 99.9):
+        # the nearest rank, as np.percentile(method='inverted_cdf') without its float rounding
+        exact = ordered[int(round(q / 100 * len(values))) - 1]
+        # the top of the bucket of the exact value
+        assert exact <= histogram.percentile(q) <= exact * (1 + ERROR) + 1
+    assert histogram.percentile(100) == values.max()
+    assert (histogram.min, histogram.max, histogram.count) == (values.min(), values.max(), len(values))
+    assert histogram.total == values.sum()
+
+
+def test_clipped_and_overflow():
+    histogram = Histogram()
+    histogram.record(-5)
+    histogram.record(1 << (MAX_BITS + 4))
+    assert histogram.clipped == 1 and histogram.counts[0] == 1 and histogram.counts[-1] == 1
+    # an overflow saturates at the last bucket, max keeps the real value
+    assert histogram.percentile(100) == histogram.highest(len(histogram.counts) - 1)
+    assert histogram.max == 1 << (MAX_BITS + 4)
+    histogram.reset()
+    assert histogram.count == 0 and histogram.percentile(50) == 0 and not histogram.buckets()
+
+
+def test_disabled_records_nothing():
+    latency = Latency()
+    latency.record('stage', 10)
+    assert latency.export() == {}
+    latency.enable()
+    latency.record('stage', 1500)
+    summary = latency.export(buckets=True)['stage']
+    assert summary['count'] == 1 and summary['p50'] == 1.5
+    assert summary['buckets'] == [(Histogram().lowest(Histogram().index(1500)), 1)]
@@ -0,0 +1,58 @@
+import os
+
+from manifest import Manifest
+
+
+def write(path, body):
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def test_lookup_matches_until_the_file_changes(tmp_path):
+    file = str(tmp_path / 'ETHUSDT-1m-2024-01-01.zip')
+    manifest = Manifest(str(tmp_path / 'manifest.jsonl'))
+    assert manifest.lookup(file) is None
+    write(file, b'klines')
+    assert manifest.lookup(file) is None
+    manifest.add(file, 'sha')
+    assert manifest.lookup(file) == 'sha'
+    # paths are normalized, the same file found another way matches
+    assert manifest.lookup(os.path.join(str(tmp_path), '.', os.path.basename(file))) == 'sha'
+
+    # same size, new mtime
+    stat = os.stat(file)
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert manifest.lookup(file) is None
+    manifest.add(file, 'sha')
+    # new size, mtime restored
+    stat = os.stat(file)
+    write(file, b'klines!')
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert manifest.lookup(file) is None
+    manifest.add(file, 'sha2')
+    os.remove(file)
+    assert manifest.lookup(file) is None
+
+
+def test_reload_and_compact(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.jsonl')
+    kept, removed = str(tmp_path / 'kept'), str(tmp_path / 'removed')
+    write(kept, b'a')
+    write(removed, b'b')
+    manifest = Manifest(manifest_file)
+    manifest.add(kept, 'old')
+    manifest.add(kept, 'new')
+    manifest.add(removed, 'b')
+    with open(manifest_file, 'a') as f:
+        f.write('{"path": "torn')
+
+    # the latest line of a path wins, a torn line is skipped
+    reloaded = Manifest(manifest_file)
+    assert reloaded.lookup(kept) == 'new'
+    assert reloaded.lookup(removed) == 'b'
+
+    os.remove(removed)
+    reloaded.compact()
+    with open(manifest_file) as f:
+        assert len(f.readlines()) == 1
+    assert Manifest(manifest_file).lookup(kept) == 'new'
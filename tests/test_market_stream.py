@@ -0,0 +1,90 @@
+import json
+import asyncio
+import websockets
+
+import market_stream
+from market_stream import StreamRouter, combined_stream_url, combined_market_data_socket
+
+BOOK = 'ethusdt@bookTicker'
+TRADE = 'ethusdt@aggTrade'
+OTHER = 'btcusdt@bookTicker'
+
+
+class Logger:
+    def __init__(self):
+        self.errors = []
+
+    def info_nowait(self, message):
+        pass
+
+    def error_nowait(self, message):
+        self.errors.append(message)
+
+
+class Error:
+    status = False
+
+
+def frame(stream, data):
+    # binance sends compact frames, the router reads the stream name off the prefix
+    return json.dumps({'stream': stream, 'data': data}, separators=(',', ':'))
+
+
+def test_stream_url():
+    assert combined_stream_url([BOOK, TRADE], 'ws://host/stream?streams=') == \
+        'ws://host/stream?streams=ethusdt@bookTicker/ethusdt@aggTrade'
+
+
+def test_dispatch_without_decoding_unrouted():
+    router = StreamRouter()
+    received = []
+    router.add(BOOK, lambda data, recv_time: received.append((data, recv_time)))
+    assert router.dispatch(frame(BOOK, {'u': 1}), 5)
+    # an unrouted frame is dropped on its name, the payload is never decoded
+    assert not router.dispatch('{"stream":"' + OTHER + '","data":not json}')
+    assert not router.dispatch(json.dumps({'e': 'raw'}))
+    assert received == [({'u': 1}, 5)]
+    assert router.unrouted == 2
+
+
+async def serve_and_read(monkeypatch):
+    monkeypatch.setattr(market_stream, 'RECONNECT_DELAY', 0)
+    paths = []
+    err = Error()
+    logger = Logger()
+
+    async def handler(ws):
+        paths.append(ws.request.path)
+        if len(paths) == 1:
+            # the first connection drops after one frame, the socket has to reconnect
+            await ws.send(frame(BOOK, {'u': 1}))
+            return
+        await ws.send(frame(OTHER, {'u': 2}))
+        await ws.send(frame(TRADE, {'p': '100.0'}))
+        await ws.send(frame(BOOK, {'u': 3}))
+        await ws.wait_closed()
+
+    router = StreamRouter()
+    books, trades = [], []
+    router.add(BOOK, lambda data, recv_time: books.append(data['u']))
+
+    def on_trade(data, recv_time):
+        trades.append((data['p'], recv_time > 0))
+        err.status = True
+    router.add(TRADE, on_trade)
+
+    async with websockets.serve(handler, '127.0.0.1', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        url = combined_stream_url(router.streams(), 'ws://127.0.0.1:{}/stream?streams='.format(port))
+        await asyncio.wait_for(combined_market_data_socket(url, router, logger, err), 10)
+    return paths, books, trades, router
+
+
+def test_combined_socket_routes_and_reconnects(monkeypatch):
+    paths, books, trades, router = asyncio.run(serve_and_read(monkeypatch))
+    assert paths[0] == '/stream?streams={}/{}'.format(BOOK, TRADE)
+    assert len(paths) == 2
+    # the socket stops at the frame after err is set
+    assert books == [1]
+    assert trades == [('100.0', True)]
+    assert router.unrouted == 1
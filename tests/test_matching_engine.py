@@ -0,0 +1,114 @@
+import pytest
+
+from matching_engine import (MatchingEngine, Position, BUY, SELL, MARKET, IOC, GTX, NEW, PARTIALLY_FILLED,
+                             FILLED, CANCELED, EXPIRED, TRADE)
+
+SYMBOL = 'ETHUSDT'
+
+
+@pytest.fixture
+def engine():
+    engine = MatchingEngine(0, 0)
+    book = engine.add_symbol(SYMBOL, 0.1)
+    # market quote in ticks: 1000 x 1002, 5 on each side
+    book.on_quote(1, 1000, 5.0, 1002, 5.0)
+    return engine
+
+
+def test_price_time_priority(engine):
+    maker, taker = engine.account('maker'), engine.account('taker')
+    first = engine.new_order(maker, SYMBOL, BUY, 1001, 1.0)
+    second = engine.new_order(maker, SYMBOL, BUY, 1001, 1.0)
+    sell = engine.new_order(taker, SYMBOL, SELL, 1000, 1.5)
+    assert (first.status, first.filled) == (FILLED, 1.0)
+    assert (second.status, second.filled) == (PARTIALLY_FILLED, 0.5)
+    assert sell.status == FILLED
+    # the taker trades at the resting price, not its limit
+    assert sell.quote / sell.filled == 1001
+
+
+def test_market_liquidity_before_worse_resting_orders(engine):
+    maker, taker = engine.account('maker'), engine.account('taker')
+    resting = engine.new_order(maker, SYMBOL, SELL, 1003, 1.0)
+    buy = engine.new_order(taker, SYMBOL, BUY, 1003, 6.0)
+    # 5 displayed at 1002 first, then the resting order at 1003
+    assert buy.status == FILLED
+    assert resting.status == FILLED
+    assert buy.quote == 5 * 1002 + 1003
+
+
+def test_queue_ahead_and_trades(engine):
+    account = engine.account('maker')
+    order = engine.new_order(account, SYMBOL, BUY, 1000, 1.0)
+    book = engine.books[SYMBOL]
+    # joins behind the displayed 5 at its price
+    assert order.queue == 5.0
+    book.on_trade(1000, 4.0, True)
+    assert (order.queue, order.filled) == (1.0, 0.0)
+    # a shrinking level means the orders ahead went away
+    book.on_quote(2, 1000, 0.5, 1002, 5.0)
+    assert order.queue == 0.5
+    book.on_trade(1000, 1.0, True)
+    assert (order.filled, order.status) == (0.5, PARTIALLY_FILLED)
+    # the ask moving through the order fills the rest at its price
+    book.on_quote(3, 995, 1.0, 1000, 2.0)
+    assert (order.filled, order.status) == (1.0, FILLED)
+
+
+def test_time_in_force(engine):
+    account = engine.account('a')
+    post_only = engine.new_order(account, SYMBOL, BUY, 1002, 1.0, time_in_force=GTX)
+    assert post_only.status == EXPIRED and post_only.filled == 0
+    ioc = engine.new_order(account, SYMBOL, BUY, 1002, 7.0, time_in_force=IOC)
+    assert (ioc.status, ioc.filled) == (EXPIRED, 5.0)
+    market = engine.new_order(account, SYMBOL, SELL, 0, 2.0, MARKET)
+    assert (market.status, market.filled) == (FILLED, 2.0)
+    assert not engine.open_orders(account)
+
+
+def test_amend_and_cancel(engine):
+    account = engine.account('a')
+    book = engine.books[SYMBOL]
+    first = engine.new_order(account, SYMBOL, SELL, 1003, 1.0)
+    second = engine.new_order(account, SYMBOL, SELL, 1003, 1.0)
+    # a smaller quantity at the same price keeps the time priority
+    book.amend(first, 1003, 0.5)
+    assert book.levels[SELL][1003][0] is first
+    # a larger one loses it
+    book.amend(first, 1003, 2.0)
+    assert book.levels[SELL][1003][0] is second
+    # an amend that crosses the market bid executes
+    book.amend(second, 1000, 1.0)
+    assert second.status == FILLED
+    assert book.cancel(first) is first and first.status == CANCELED
+    assert book.cancel(first) is None
+    assert not book.prices[SELL]
+
+
+def test_positions_and_events(engine):
+    maker, taker = engine.account('maker'), engine.account('taker')
+    engine.drain()
+    engine.new_order(maker, SYMBOL, BUY, 1001, 2.0)
+    engine.new_order(taker, SYMBOL, SELL, 1001, 2.0)
+    engine.new_order(taker, SYMBOL, BUY, 1002, 1.0)
+    # positions are in prices, the book in ticks
+    position = maker.position(SYMBOL)
+    assert position.amount == 2.0 and position.entry == pytest.approx(100.1)
+    taken = taker.position(SYMBOL)
+    assert taken.amount == -1.0
+    assert taken.realized == pytest.approx(-0.1)
+    events = engine.drain()
+    assert [execution for _, execution, _, _, _ in events].count(TRADE) == 3
+    assert [execution for _, execution, _, _, _ in events].count(NEW) == 3
+    assert engine.drain() == []
+
+
+def test_position_flip():
+    position = Position()
+    position.fill(BUY, 1.0, 100.0, 0.0)
+    position.fill(BUY, 1.0, 110.0, 0.0)
+    assert position.entry == 105.0
+    assert position.fill(SELL, 3.0, 120.0, 0.0) == 30.0
+    assert (position.amount, position.entry) == (-1.0, 120.0)
+    position.fill(BUY, 1.0, 120.0, 0.0)
+    assert (position.amount, position.entry) == (0.0, 0.0)
@@ -0,0 +1,81 @@
+import asyncio
+
+import multi_strat
+from multi_strat import SymbolState, user_event_symbols, user_data_socket
+
+
+def order_update(symbol, order_id):
+    return {'e': 'ORDER_TRADE_UPDATE', 'o': {'s': symbol, 'i': order_id}}
+
+
+class Stream:
+    def __init__(self, events, err):
+        self.events = list(events)
+        self.err = err
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def recv(self):
+        await asyncio.sleep(0)
+        if not self.events:
+            self.err.status = True
+            return {}
+        return self.events.pop(0)
+
+    async def close(self):
+        pass
+
+
+class Logger:
+    def error_nowait(self, message):
+        pass
+
+
+class Error:
+    status = False
+
+
+def test_user_event_symbols():
+    assert user_event_symbols(order_update('ETHUSDT', 1)) == ['ETHUSDT']
+    account = {'e': 'ACCOUNT_UPDATE', 'a': {'P': [{'s': 'BTCUSDT'}, {'s': 'BTCUSDT'}]}}
+    assert user_event_symbols(account) == ['BTCUSDT']
+    assert user_event_symbols({'e': 'listenKeyExpired'}) == []
+
+
+def test_slow_symbol_does_not_hold_up_the_others(monkeypatch):
+    handled = []
+
+    async def run():
+        err = Error()
+        btc_done = asyncio.Event()
+        events = [order_update('ETHUSDT', 1), order_update('ETHUSDT', 2),
+                  order_update('BTCUSDT', 3), order_update('BTCUSDT', 4), order_update('XRPUSDT', 5)]
+
+        class SocketManager:
+            def __init__(self, client):
+                pass
+
+            def futures_user_socket(self):
+                return Stream(events, err)
+
+            async def stop(self):
+                pass
+
+        async def handle_user_event(gateway, symbol, logger, err, orderbook, params, orders, res):
+            # the first ETH fill waits on order requests until BTC is handled
+            if res['o']['i'] == 1:
+                await btc_done.wait()
+            handled.append(res['o']['i'])
+            if res['o']['i'] == 4:
+                btc_done.set()
+        monkeypatch.setattr(multi_strat, 'BinanceSocketManager', SocketManager)
+        monkeypatch.setattr(multi_strat, 'handle_user_event', handle_user_event)
+        states = {symbol: SymbolState(symbol, Logger(), None, None, None) for symbol in ('ETHUSDT', 'BTCUSDT')}
+        await asyncio.wait_for(user_data_socket(None, None, states, Logger(), err), 5)
+    asyncio.run(run())
+    # every symbol in its own order, events of unknown symbols are dropped
+    assert handled == [3, 4, 1, 2]
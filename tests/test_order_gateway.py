@@ -0,0 +1,118 @@
+import hmac
+import json
+import asyncio
+import hashlib
+from aiohttp import web
+
+from order_gateway import OrderGateway, MAX_BATCH_ORDERS, MAX_BATCH_CANCELS, BATCH_ORDERS, ORDER
+
+SECRET = 'secret'
+
+
+class FuturesServer:
+    '''
+    fapi stand-in: checks signatures, records requests and answers batches per entry
+    Orders with quantity 0 and order id 0 are rejected inside the batch
+    '''
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+
+    async def start(self):
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return 'http://127.0.0.1:{}'.format(port)
+
+    async def handle(self, request):
+        query = request.raw_path.split('?', 1)[1]
+        payload, signature = query.rsplit('&signature=', 1)
+        assert hmac.new(SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest() == signature
+        assert request.headers['X-MBX-APIKEY'] == 'key'
+        self.requests.append((request.method, request.path, dict(request.query)))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.05)
+        self.in_flight -= 1
+        if request.path == BATCH_ORDERS and request.method == 'POST':
+            return web.json_response([
+                {'code': -4003, 'msg': 'Quantity less than zero.'} if order['quantity'] == '0' else
+                {'orderId': int(order['price']), 'status': 'NEW'}
+                for order in json.loads(request.query['batchOrders'])])
+        if request.path == BATCH_ORDERS:
+            return web.json_response([
+                {'code': -2011, 'msg': 'Unknown order sent.'} if order_id == 0 else {'orderId': order_id}
+                for order_id in json.loads(request.query['orderIdList'])])
+        if request.path == ORDER and request.query.get('quantity') == '0':
+            return web.json_response({'code': -4003, 'msg': 'Quantity less than zero.'}, status=400)
+        return web.json_response({'orderId': 1, 'symbol': request.query['symbol']})
+
+
+async def run(test):
+    server = FuturesServer()
+    url = await server.start()
+    try:
+        async with OrderGateway('key', SECRET, url=url) as gateway:
+            return server, await test(gateway)
+    finally:
+        await server.runner.cleanup()
+
+
+def test_single_actions_and_error_mapping():
+    async def test(gateway):
+        return await asyncio.gather(
+            gateway.create_order('ETHUSDT', 'BUY', 'LIMIT', 1, 100, 'GTC'),
+            gateway.create_order('ETHUSDT', 'BUY', 'LIMIT', 0, 100, 'GTC'),
+            gateway.cancel_order('ETHUSDT', orderId=1))
+    server, (placed, rejected, canceled) = asyncio.run(run(test))
+    assert placed.ok and placed.status == 200 and placed.data == {'orderId': 1, 'symbol': 'ETHUSDT'}
+    assert placed.latency > 0
+    assert not rejected.ok and rejected.status == 400 and rejected.error['code'] == -4003
+    assert canceled.ok
+    # None params are not sent, independent actions go out together
+    assert 'origClientOrderId' not in server.requests[2][2]
+    assert server.max_in_flight == 3
+
+
+def test_batch_orders_are_chunked():
+    orders = [dict(symbol='ETHUSDT', side='BUY', type='LIMIT', quantity=0 if i == 6 else 1,
+                   price=100 + i, timeInForce='GTC', reduceOnly=None) for i in range(12)]
+
+    async def test(gateway):
+        return await gateway.create_orders(orders)
+    server, results = asyncio.run(run(test))
+    chunks = [json.loads(query['batchOrders']) for _, _, query in server.requests]
+    assert [len(chunk) for chunk in chunks] == [MAX_BATCH_ORDERS, MAX_BATCH_ORDERS, 2]
+    assert 'reduceOnly' not in chunks[0][0]
+    assert server.max_in_flight == 3
+    # one result per order in the caller's order, a rejected entry does not fail its chunk
+    assert len(results) == len(orders)
+    assert [result.data['orderId'] for i, result in enumerate(results) if i != 6] == \
+        [100 + i for i in range(12) if i != 6]
+    assert not results[6].ok and results[6].error['code'] == -4003 and results[6].status == 200
+
+
+def test_batch_cancels_are_chunked():
+    order_ids = list(range(1, 23)) + [0]
+
+    async def test(gateway):
+        return await gateway.cancel_orders('ETHUSDT', order_ids)
+    server, results = asyncio.run(run(test))
+    assert [len(json.loads(query['orderIdList'])) for _, _, query in server.requests] == \
+        [MAX_BATCH_CANCELS, MAX_BATCH_CANCELS, 3]
+    assert [result.ok for result in results] == [True] * 22 + [False]
+    assert [result.data['orderId'] for result in results[:-1]] == order_ids[:-1]
+
+
+def test_transport_error():
+    async def test():
+        async with OrderGateway('key', SECRET, url='http://127.0.0.1:1') as gateway:
+            return await gateway.create_order('ETHUSDT', 'BUY', 'MARKET', 1)
+    result = asyncio.run(test())
+    assert not result.ok and result.status == 0 and 'msg' in result.error
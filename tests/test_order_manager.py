@@ -0,0 +1,72 @@
+from data_structure.order_manager import (OrderManager, PARTIAL, FILLED, CANCELED,
+                                          REGULAR_ORDER, TAKE_PROFIT_ORDER, STOP_LOSS_ORDER)
+
+
+def bracket(orders, order_id=1):
+    parent = orders.add(order_id, 'BUY', 100.0, 1.0, REGULAR_ORDER, None, 'c{}'.format(order_id))
+    orders.fill(order_id, 1.0, 100.0)
+    take_profit = orders.add(order_id + 1, 'SELL', 101.0, 1.0, TAKE_PROFIT_ORDER, order_id)
+    stop_loss = orders.add(order_id + 2, 'SELL', 99.0, 1.0, STOP_LOSS_ORDER, order_id)
+    return parent, take_profit, stop_loss
+
+
+def test_brackets_link_to_their_parent():
+    orders = OrderManager('ETHUSDT')
+    parent, take_profit, stop_loss = bracket(orders)
+    assert parent.take_profit is take_profit and parent.stop_loss is stop_loss
+    assert take_profit.parent is parent and stop_loss.parent is parent
+    assert orders.sibling(take_profit) is stop_loss
+    assert orders.sibling(stop_loss) is take_profit
+    assert orders.sibling(parent) is None
+    assert orders.open_ids(REGULAR_ORDER) == []
+    assert orders.open_ids(TAKE_PROFIT_ORDER) == [2]
+    assert orders.open_ids(STOP_LOSS_ORDER) == [3]
+
+
+def test_fill_and_cancel_touch_only_the_order():
+    orders = OrderManager('ETHUSDT')
+    for order_id in range(10, 20):
+        orders.add(order_id, 'BUY', 100.0 - order_id, 1.0, client_order_id='c{}'.format(order_id))
+    assert orders.fill(15, 0.4, 85.0, PARTIAL).status == PARTIAL
+    # a partial fill stays open
+    assert orders.open_count() == 10
+    assert orders.fill(15, 1.0, 85.0).status == FILLED
+    assert orders.cancel(11).status == CANCELED
+    # cancelling a closed order does not reopen or change it
+    assert orders.cancel(15).status == FILLED
+    assert orders.open_ids() == [10, 12, 13, 14, 16, 17, 18, 19]
+    assert orders.get(15).filled_qty == 1.0 and orders.get(15).avg_price == 85.0
+    assert orders.fill(99, 1.0) is None and orders.cancel(99) is None
+
+    orders.cancel_open()
+    assert orders.open_count() == 0
+    assert orders.get(10).status == CANCELED and orders.get(15).status == FILLED
+
+
+def test_order_trade_update():
+    orders = OrderManager('ETHUSDT')
+    orders.add(1, 'BUY', 100.0, 2.0, client_order_id='c1')
+    update = {'i': 1, 'c': 'c1', 'X': 'PARTIALLY_FILLED', 'z': '0.5', 'ap': '99.9'}
+    order = orders.on_order_update(update)
+    assert (order.status, order.filled_qty, order.avg_price) == (PARTIAL, 0.5, 99.9)
+    # unknown statuses leave the order as is
+    assert orders.on_order_update(dict(update, X='NEW_INSURANCE')).status == PARTIAL
+    assert orders.on_order_update(dict(update, X='EXPIRED')).status == CANCELED
+    # an id the exchange reassigned is matched on the client order id
+    orders.add(2, 'SELL', 101.0, 1.0, client_order_id='c2')
+    assert orders.on_order_update({'i': 7, 'c': 'c2', 'X': 'FILLED', 'z': '1', 'ap': '101'}).order_id == 2
+    assert orders.on_order_update({'i': 8, 'c': 'x', 'X': 'FILLED', 'z': '1'}) is None
+
+
+def test_forget_drops_closed_orders():
+    orders = OrderManager('ETHUSDT')
+    parent, take_profit, stop_loss = bracket(orders)
+    # open children stay tracked and keep their link to the forgotten parent
+    orders.forget(parent)
+    assert orders.get(1) is None and orders.get_by_client_id('c1') is None
+    assert orders.get(2) is take_profit and orders.sibling(take_profit) is stop_loss
+    orders.fill(2, 1.0, 101.0)
+    orders.cancel(3)
+    orders.forget(parent)
+    assert not orders.orders and not orders.by_client_id
+    assert take_profit.status == FILLED and stop_loss.status == CANCELED
@@ -0,0 +1,36 @@
+from data_structure.orderbook import TopOfBook
+
+
+def ticker(update_id, bid, ask, event_time=1):
+    return {'u': update_id, 'E': event_time, 'b': str(bid), 'B': '2.5', 'a': str(ask), 'A': '1.5'}
+
+
+def test_stale_updates_are_dropped():
+    book = TopOfBook('ETHUSDT')
+    assert book.snapshot() == TopOfBook.EMPTY
+    assert book.on_book_ticker(ticker(10, 100.0, 100.1), recv_time=7)
+    assert book.snapshot() == (10, 100.0, 2.5, 100.1, 1.5, 1, 7)
+
+    # an older or repeated update id arrives late and must not overwrite the book
+    assert not book.on_book_ticker(ticker(9, 99.0, 99.1))
+    assert not book.on_book_ticker(ticker(10, 99.0, 99.1))
+    assert (book.update_id, book.bid, book.ask) == (10, 100.0, 100.1)
+    assert book.dropped == 2
+
+    assert book.update(11, 100.2, 1.0, 100.3, 1.0)
+    assert (book.update_id, book.bid, book.ask) == (11, 100.2, 100.3)
+    # the receive time defaults to now
+    assert book.recv_time > 0
+
+
+def test_snapshot_is_consistent():
+    book = TopOfBook('ETHUSDT')
+    book.update(1, 100.0, 1.0, 100.1, 1.0, 0, 1)
+    snapshot = book.snapshot()
+    book.update(2, 101.0, 1.0, 101.1, 1.0, 0, 2)
+    # a snapshot taken before an update is not mutated by it
+    assert snapshot[:4] == (1, 100.0, 1.0, 100.1)
+    book.clear()
+    assert book.snapshot() == TopOfBook.EMPTY
+    # after a clear any update id applies again
+    assert book.update(1, 100.0, 1.0, 100.1, 1.0)
@@ -0,0 +1,69 @@
+import asyncio
+
+from data_structure.orderbook import TopOfBook, TickScale
+from data_structure.order_manager import OrderManager, TAKE_PROFIT_ORDER
+from simple_strat import QuoteTrigger, BUY, SELL
+
+
+def ticker(update_id, bid, ask):
+    return {'u': update_id, 'b': bid, 'B': '1', 'a': ask, 'A': '1'}
+
+
+def quoted_trigger(requote_ticks):
+    book = TopOfBook('ETHUSDT', TickScale(0.01, 2))
+    trigger = QuoteTrigger(book, requote_ticks)
+    book.on_book_ticker(ticker(1, '100.00', '100.05'))
+    trigger.quoted = {BUY: 10000, SELL: 10005}
+    return book, trigger
+
+
+def test_moves_below_the_threshold_do_not_trigger():
+    book, trigger = quoted_trigger(3)
+    for update_id, (bid, ask) in enumerate([('100.01', '100.05'), ('99.98', '100.07'), ('100.02', '100.03')], 2):
+        book.on_book_ticker(ticker(update_id, bid, ask))
+        trigger.on_book()
+    assert not trigger.event.is_set() and trigger.triggers == 0
+
+
+def test_a_move_of_requote_ticks_triggers_once():
+    book, trigger = quoted_trigger(3)
+    book.on_book_ticker(ticker(2, '100.00', '100.08'))
+    trigger.on_book()
+    assert trigger.event.is_set() and trigger.triggers == 1
+    # further ticks of the burst are not counted until the quoting task clears the event
+    book.on_book_ticker(ticker(3, '99.90', '100.08'))
+    trigger.on_book()
+    assert trigger.triggers == 1
+    trigger.event.clear()
+    book.on_book_ticker(ticker(4, '99.97', '100.05'))
+    trigger.on_book()
+    assert trigger.triggers == 2
+
+
+def test_a_side_without_quote_triggers():
+    book, trigger = quoted_trigger(3)
+    trigger.quoted[SELL] = None
+    trigger.on_book()
+    assert trigger.event.is_set()
+
+
+def test_closed_quotes_trigger():
+    _, trigger = quoted_trigger(3)
+    orders = OrderManager('ETHUSDT')
+    orders.on_close = trigger.on_order_closed
+    orders.add(1, BUY, 100.0, 1.0)
+    orders.add(2, SELL, 100.1, 1.0, TAKE_PROFIT_ORDER)
+    orders.fill(2, 1.0)
+    # a bracket order is not a quote
+    assert not trigger.event.is_set() and trigger.quoted[SELL] == 10005
+    orders.fill(1, 1.0)
+    assert trigger.event.is_set() and trigger.quoted == {BUY: None, SELL: 10005}
+
+
+def test_wait():
+    async def wait():
+        _, trigger = quoted_trigger(3)
+        timed_out = await trigger.wait(0.01)
+        asyncio.get_running_loop().call_later(0.01, trigger.event.set)
+        return timed_out, await trigger.wait(1)
+    assert asyncio.run(wait()) == (False, True)
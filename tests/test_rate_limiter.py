@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket, WEIGHT_HEADER, ORDER_1M_HEADER, ORDER_10S_HEADER, INFO, SAFETY
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # one second into a minute window
+    clock = Clock(1800 * 60 + 1.0)
+    monkeypatch.setattr(rate_limiter.time, 'time', clock.time)
+    return clock
+
+
+def test_bucket_refills_at_the_window_boundary():
+    bucket = TokenBucket('weight', 100, 60)
+    now = 60 * 10 + 5.0
+    assert bucket.wait(int(100 * SAFETY), now) == 0
+    bucket.take(int(100 * SAFETY))
+    assert bucket.wait(1, now) == pytest.approx(55.0)
+    # the next window starts empty
+    assert bucket.wait(1, now + 55.0) == 0
+    assert bucket.used == 0
+
+
+def test_headers_raise_the_estimate(clock):
+    limiter = RateLimiter(weight_limit=1000)
+    asyncio.run(limiter.acquire(10))
+    limiter.update({WEIGHT_HEADER: '700', ORDER_1M_HEADER: '5', ORDER_10S_HEADER: '3'})
+    assert limiter.remaining() == {'weight': 300, 'orders_1m': 1200 - 5, 'orders_10s': 300 - 3}
+    # requests in flight are not in a lower header yet, the estimate is kept
+    limiter.update({WEIGHT_HEADER: '200'})
+    assert limiter.remaining()['weight'] == 300
+    # a new window resets it
+    clock.now += 60
+    assert limiter.remaining()['weight'] == 1000
+
+
+def test_informational_calls_leave_room_for_orders(clock):
+    limiter = RateLimiter(weight_limit=1000)
+    limiter.update({WEIGHT_HEADER: '625'})
+    now = clock.now
+    # 625 + 10 is past 0.7 * 0.9 of the limit for information, not for orders
+    assert limiter.delay(10, 0, 0, INFO, now) > 0
+    assert limiter.delay(10, 1, 1, rate_limiter.ORDER, now) == 0
+    limiter.waiting_orders = 1
+    assert limiter.delay(1, 0, 0, INFO, now) > 0
+
+
+@pytest.mark.parametrize('status', [418, 429])
+def test_throttled_responses_block(clock, status):
+    limiter = RateLimiter()
+    limiter.update({'Retry-After': '7'}, status)
+    assert limiter.throttled == 1
+    assert limiter.delay(1, 1, 1, rate_limiter.ORDER, clock.now) == pytest.approx(7.0)
+    # without Retry-After the block lasts until the weight window rolls over
+    limiter = RateLimiter()
+    limiter.update({}, status)
+    assert limiter.delay(1, 0, 0, rate_limiter.ORDER, clock.now) == pytest.approx(59.0)
+    assert limiter.delay(1, 0, 0, rate_limiter.ORDER, clock.now + 59.0) == 0
+
+
+def test_acquire_waits_for_the_order_window(monkeypatch):
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+    clock = Clock(10 * 100 + 9.5)
+    monkeypatch.setattr(rate_limiter.time, 'time', clock.time)
+    monkeypatch.setattr(rate_limiter.asyncio, 'sleep', sleep)
+
+    limiter = RateLimiter(order_limit_10s=10)
+    for _ in range(9):
+        asyncio.run(limiter.acquire(0, 1))
+    assert sleeps == []
+    # the tenth order is past the safety margin and waits for the 10s window to roll
+    asyncio.run(limiter.acquire(0, 1))
+    assert sleeps == [pytest.approx(0.5)]
+    assert limiter.orders_10s.used == 1 and limiter.orders_1m.used == 10
+    assert limiter.waiting_orders == 0
@@ -0,0 +1,94 @@
+import asyncio
+import numpy as np
+import pytest
+
+from data_structure.orderbook import TopOfBook, TickScale
+from recorder import (Recorder, MARKET, USER, BOOK_TICKER, AGG_TRADE, ORDER_UPDATE, ACCOUNT_UPDATE, DTYPE,
+                      segment_paths, valid_rows, load_segment, load_records, replay)
+from order_gateway import is_local_url
+from simple_strat import run_strat
+
+SYMBOL = 'ETHUSDT'
+
+
+def book_ticker(update_id):
+    return {'u': update_id, 'E': 1000 + update_id, 'b': '100.01', 'B': '1.5', 'a': '100.02', 'A': '2.5'}
+
+
+def order_update(order_id, status):
+    return {'e': 'ORDER_TRADE_UPDATE', 'E': 5000, 'o': {
+        's': SYMBOL, 'i': order_id, 'S': 'SELL', 'X': status, 'p': '100.5', 'q': '2', 'z': '1', 'ap': '100.5',
+        'L': '100.5'}}
+
+
+def test_valid_rows():
+    records = np.zeros(10, dtype=DTYPE)
+    assert valid_rows(records) == 0
+    records['recv_ns'][:7] = np.arange(1, 8)
+    assert valid_rows(records) == 7
+    records['recv_ns'][:] = 1
+    assert valid_rows(records) == 10
+
+
+def test_segments_round_trip(tmp_path):
+    folder = str(tmp_path)
+    recorder = Recorder(SYMBOL, folder, MARKET, segment_records=4)
+    for update_id in range(1, 10):
+        recorder.on_book_ticker(book_ticker(update_id), recv_time=update_id * 10)
+    recorder.on_agg_trade({'a': 7, 'E': 2000, 'p': '100.0', 'q': '0.5', 'T': 1999, 'm': True}, recv_time=95)
+    user = Recorder(SYMBOL, folder, USER)
+    user.on_user_event(order_update(42, 'PARTIALLY_FILLED'), recv_time=55)
+    user.on_user_event(dict(order_update(43, 'NEW'), o=dict(order_update(43, 'NEW')['o'], s='BTCUSDT')), 56)
+    user.on_user_event({'e': 'ACCOUNT_UPDATE', 'E': 6000, 'a': {'P': [
+        {'s': SYMBOL, 'ps': 'BOTH', 'pa': '-1', 'up': '0.5', 'ep': '100.5'}]}}, recv_time=57)
+    # segments are not closed, as after a crash
+
+    # 10 records in segments of 4, the last one has 2 written rows and 2 zero rows
+    paths = segment_paths(folder, SYMBOL, MARKET)
+    assert [len(load_segment(path)) for path in paths] == [4, 4, 2]
+    assert recorder.count == 10 and recorder.segments == 3
+
+    records = load_records(SYMBOL, folder)
+    # other symbols are not recorded, streams are merged by receive time
+    assert len(records) == 12
+    assert list(records['recv_ns']) == sorted(records['recv_ns'])
+    book = records[records['kind'] == BOOK_TICKER]
+    np.testing.assert_array_equal(book['id'], np.arange(1, 10))
+    assert (book['p1'][0], book['p2'][0], book['p3'][0], book['p4'][0]) == (100.01, 1.5, 100.02, 2.5)
+    assert list(load_records(SYMBOL, folder, 50, 60, [ORDER_UPDATE, ACCOUNT_UPDATE])['kind']) == \
+        [ORDER_UPDATE, ACCOUNT_UPDATE]
+
+    replayed = []
+
+    def on_order(message, recv_time):
+        replayed.append((message['o']['i'], message['o']['X'], message['o']['S'], float(message['o']['z'])))
+
+    async def on_trade(message, recv_time):
+        replayed.append((message['a'], message['m'], message['T'], recv_time))
+    count = asyncio.run(replay(SYMBOL, {ORDER_UPDATE: on_order, AGG_TRADE: on_trade}, folder))
+    assert count == 2
+    assert replayed == [(42, 'PARTIALLY_FILLED', 'SELL', 1.0), (7, True, 1999, 95)]
+    recorder.close()
+    user.close()
+
+
+def test_recording_book_stores_prices(tmp_path):
+    folder = str(tmp_path)
+    recorder = Recorder(SYMBOL, folder)
+    orderbook = TopOfBook(SYMBOL, TickScale(0.01, 2))
+    handler = recorder.recording_book(orderbook.on_book_ticker, orderbook)
+    assert handler(book_ticker(2), 20)
+    # a dropped update is not recorded
+    assert not handler(book_ticker(1), 30)
+    recorder.close()
+    records = load_records(SYMBOL, folder)
+    assert len(records) == 1
+    assert records['p1'][0] == 100.01 and records['p3'][0] == 100.02 and records['recv_ns'][0] == 20
+
+
+def test_replay_refuses_the_live_exchange(tmp_path):
+    assert is_local_url('http://127.0.0.1:8080') and is_local_url('http://localhost:8080/api')
+    assert not is_local_url('https://fapi.binance.com')
+    # refused before any connection is made
+    with pytest.raises(ValueError, match='fapi.binance.com'):
+        asyncio.run(run_strat(SYMBOL, 'key', 'secret', None, 10, 1, replay_folder=str(tmp_path)))
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingest_kline import COLUMNS, COLUMN_NAMES, partition_path, write_partition
+from resample_kline import BarSpec, resample, load_bars
+
+SYMBOL = 'ETHUSDT'
+MINUTE = 60 * 1000
+# 2024-01-30 00:00 UTC, the klines run into February
+START = 1706572800000
+ROWS = 4 * 24 * 60
+
+
+def make_klines(rows=ROWS, start=START, seed=7):
+    rng = np.random.default_rng(seed)
+    open_time = start + np.arange(rows, dtype=np.int64) * MINUTE
+    close = 100 + np.cumsum(rng.normal(0, 0.1, rows))
+    open_ = np.r_[100.0, close[:-1]]
+    volume = rng.uniform(1, 10, rows)
+    return {
+        'open_time': open_time,
+        'open': open_,
+        'high': np.maximum(open_, close) + rng.uniform(0, 0.05, rows),
+        'low': np.minimum(open_, close) - rng.uniform(0, 0.05, rows),
+        'close': close,
+        'volume': volume,
+        'close_time': open_time + MINUTE - 1,
+        'quote_volume': volume * close,
+        'count': rng.integers(1, 100, rows),
+        'taker_buy_volume': volume / 2,
+        'taker_buy_quote_volume': volume * close / 2,
+    }
+
+
+def store_klines(root, klines, interval='1m'):
+    '''
+    Write klines into the columnar store, one partition per month
+    '''
+    frame = pd.DataFrame(klines)
+    months = pd.to_datetime(frame['open_time'], unit='ms').dt.strftime('%Y-%m')
+    for month, rows in frame.groupby(months):
+        columns = {name: rows[name].to_numpy().astype(dtype) for name, dtype in COLUMNS}
+        write_partition(partition_path(root, SYMBOL, interval, month), columns, {month: 'sha'})
+
+
+def pandas_bars(klines, rule):
+    frame = pd.DataFrame(klines)
+    frame.index = pd.to_datetime(frame['open_time'], unit='ms')
+    agg = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum',
+           'quote_volume': 'sum', 'count': 'sum', 'taker_buy_volume': 'sum', 'taker_buy_quote_volume': 'sum'}
+    bars = frame.resample(rule).agg(agg)
+    bars['open_time'] = bars.index.astype('datetime64[ms]').astype(np.int64)
+    return bars.reset_index(drop=True)
+
+
+@pytest.fixture
+def stores(tmp_path):
+    store, out = str(tmp_path / 'store'), str(tmp_path / 'bars')
+    klines = make_klines()
+    store_klines(store, klines)
+    return klines, store, out
+
+
+@pytest.mark.parametrize('bar, rule', [('5m', '5min'), ('1h', '1h'), ('1d', '1D')])
+def test_time_bars_match_pandas(stores, bar, rule):
+    klines, store, out = stores
+    written = resample(SYMBOL, [bar], '1m', store, out)
+    # one bar partition per source month
+    assert written == {'1m_' + bar: 2}
+    bars = load_bars(SYMBOL, bar, '1m', out=out, columns=COLUMN_NAMES)
+    expected = pandas_bars(klines, rule)
+    assert len(bars['open_time']) == len(expected)
+    for name in expected.columns:
+        np.testing.assert_allclose(bars[name], expected[name].to_numpy(), rtol=1e-12, err_msg=name)
+    size = BarSpec(bar).size
+    np.testing.assert_array_equal(bars['close_time'], bars['open_time'] + size - 1)
+    # unchanged sources are not rebuilt
+    assert resample(SYMBOL, [bar], '1m', store, out) == {'1m_' + bar: 0}
+
+
+def test_volume_bars_match_pandas(stores):
+    klines, store, out = stores
+    threshold = 500.0
+    resample(SYMBOL, ['volume:{}'.format(threshold)], '1m', store, out)
+    bars = load_bars(SYMBOL, 'volume:{}'.format(threshold), '1m', out=out, columns=COLUMN_NAMES)
+
+    frame = pd.DataFrame(klines)
+    # a row belongs to the bar the running volume was in when the row started
+    before = frame['volume'].cumsum() - frame['volume']
+    frame['bar'] = np.floor(before / threshold).astype(np.int64)
+    expected = frame.groupby('bar').agg({'open_time': 'first', 'open': 'first', 'high': 'max', 'low': 'min',
+                                         'close': 'last', 'volume': 'sum', 'close_time': 'last'})
+    # the trailing bar below the threshold is not emitted
+    if frame['volume'].sum() < (frame['bar'].iloc[-1] + 1) * threshold:
+        expected = expected.iloc[:-1]
+    assert len(bars['open_time']) == len(expected)
+    for name in expected.columns:
+        np.testing.assert_allclose(bars[name], expected[name].to_numpy(), rtol=1e-9, err_msg=name)
+
+
+def test_time_bars_must_be_a_multiple_of_the_source(tmp_path):
+    store, out = str(tmp_path / 'store'), str(tmp_path / 'bars')
+    store_klines(store, make_klines(rows=120), '3m')
+    with pytest.raises(ValueError):
+        resample(SYMBOL, ['5m'], '3m', store, out)
+    assert resample(SYMBOL, ['15m'], '3m', store, out) == {'3m_15m': 1}
+
+
+def test_series_rewrite_drops_stale_months(tmp_path):
+    store, out = str(tmp_path / 'store'), str(tmp_path / 'bars')
+    klines = make_klines()
+    store_klines(store, klines)
+    resample(SYMBOL, ['volume:100'], '1m', store, out)
+    folder = os.path.join(out, SYMBOL, '1m_volume_100')
+    assert sorted(os.listdir(folder)) == ['2024-01', '2024-02']
+
+    # the January partition is removed from the store, the series is rebuilt from February only
+    later = {name: column[2 * 24 * 60:] for name, column in klines.items()}
+    store = str(tmp_path / 'store2')
+    store_klines(store, later)
+    resample(SYMBOL, ['volume:100'], '1m', store, out)
+    assert sorted(os.listdir(folder)) == ['2024-02']
@@ -0,0 +1,109 @@
+import pytest
+
+from data_structure.orderbook import TopOfBook, TickScale
+from data_structure.order_manager import OrderManager, PARTIAL, TAKE_PROFIT_ORDER
+from risk import (RiskEngine, KILL_SWITCH, NOTIONAL_LIMIT, PORTFOLIO_NOTIONAL_LIMIT, OPEN_ORDER_LIMIT,
+                  PORTFOLIO_ORDER_LIMIT, OUTSIDE_BAND, NO_BOOK, read_limits)
+
+SYMBOL = 'ETHUSDT'
+
+
+def managed(engine, symbol=SYMBOL, orderbook=None):
+    orders = OrderManager(symbol)
+    orders.risk = engine.add(symbol, orderbook)
+    return orders
+
+
+def test_notional_counts_the_open_side():
+    engine = RiskEngine(max_notional=1000, max_open_orders=0, price_band=0, max_portfolio_notional=0,
+                        max_portfolio_orders=0, max_loss=0)
+    orders = managed(engine)
+    risk = orders.risk
+    assert risk.check('BUY', 5, 100.0) is None
+    orders.add(1, 'BUY', 100.0, 5)
+    orders.add(2, 'BUY', 100.0, 4)
+    assert risk.check('BUY', 2, 100.0) == NOTIONAL_LIMIT
+    # the other side only lowers the exposure while the buys are open
+    assert risk.check('SELL', 9, 100.0) is None
+    # partial fills and position: a long of 500 and 450 left to buy
+    orders.fill(1, 5, 100.0)
+    orders.fill(2, 0.5, 100.0, PARTIAL)
+    risk.on_position(5, 0.0, 100.0)
+    assert risk.exposure == pytest.approx(500 + 350)
+    assert risk.check('BUY', 2, 100.0) == NOTIONAL_LIMIT
+    assert risk.check('BUY', 1.5, 100.0) is None
+    # an amend replaces what the order counted
+    assert risk.check('BUY', 3.5, 140.0, replaces=orders.get(2)) is None
+    assert risk.check('BUY', 3.5, 150.0, replaces=orders.get(2)) == NOTIONAL_LIMIT
+    orders.cancel(2)
+    assert risk.exposure == pytest.approx(500) and engine.open_orders == 0
+    assert engine.rejected == {NOTIONAL_LIMIT: 3}
+
+
+def test_open_order_limits():
+    engine = RiskEngine(max_notional=0, max_open_orders=2, price_band=0, max_portfolio_notional=0,
+                        max_portfolio_orders=3, max_loss=0)
+    eth, btc = managed(engine), managed(engine, 'BTCUSDT')
+    eth.add(1, 'BUY', 100.0, 1)
+    eth.add(2, 'SELL', 101.0, 1)
+    assert eth.risk.check('BUY', 1, 100.0) == OPEN_ORDER_LIMIT
+    # an amend is not a new order
+    assert eth.risk.check('BUY', 1, 99.0, replaces=eth.get(1)) is None
+    btc.add(3, 'BUY', 100.0, 1)
+    assert btc.risk.check('BUY', 1, 100.0) == PORTFOLIO_ORDER_LIMIT
+    eth.cancel_open()
+    assert engine.open_orders == 1
+    assert btc.risk.check('BUY', 1, 100.0) is None
+    # bracket orders always pass
+    assert btc.risk.check('SELL', 100, 100.0, TAKE_PROFIT_ORDER) is None
+
+
+def test_portfolio_notional():
+    engine = RiskEngine(max_notional=0, max_open_orders=0, price_band=0, max_portfolio_notional=1000,
+                        max_portfolio_orders=0, max_loss=0)
+    eth, btc = managed(engine), managed(engine, 'BTCUSDT')
+    eth.add(1, 'BUY', 100.0, 6)
+    assert btc.risk.check('SELL', 5, 100.0) == PORTFOLIO_NOTIONAL_LIMIT
+    assert btc.risk.check('SELL', 4, 100.0) is None
+    assert engine.exposure == pytest.approx(600)
+
+
+def test_price_band():
+    orderbook = TopOfBook(SYMBOL, TickScale(0.01, 2))
+    engine = RiskEngine(price_band=0.01)
+    risk = managed(engine, orderbook=orderbook).risk
+    assert risk.check('BUY', 1, 100.0) == NO_BOOK
+    orderbook.on_book_ticker({'u': 1, 'b': '99.99', 'B': '1', 'a': '100.01', 'A': '1'})
+    assert risk.check('BUY', 1, 99.0) is None
+    assert risk.check('BUY', 1, 98.9) == OUTSIDE_BAND
+    assert risk.check('SELL', 1, 101.1) == OUTSIDE_BAND
+
+
+def test_kill_switch():
+    engine = RiskEngine(max_loss=100)
+    eth, btc = managed(engine), managed(engine, 'BTCUSDT')
+    engine.on_position(SYMBOL, 1.0, -60.0, 100.0)
+    assert engine.killed is None
+    engine.on_position('BTCUSDT', -0.1, -50.0, 1000.0)
+    assert engine.unrealized == pytest.approx(-110.0) and engine.killed is not None
+    assert eth.risk.check('BUY', 0.1, 40.0) == KILL_SWITCH
+    assert eth.risk.check('SELL', 1.0, 40.0, TAKE_PROFIT_ORDER) is None
+    engine.reset()
+    assert eth.risk.check('BUY', 0.1, 40.0) is None
+    assert btc.risk.summary()['position'] == pytest.approx(-150.0)
+
+
+def test_config_limits_leave_the_others_off():
+    assert read_limits({'symbol': SYMBOL}) is None
+    limits = read_limits({'symbol': SYMBOL, 'max_notional': '200'})
+    assert limits == {'max_notional': 200.0, 'max_open_orders': 0, 'price_band': 0.0,
+                      'max_portfolio_notional': 0.0, 'max_portfolio_orders': 0, 'max_loss': 0.0}
+    engine = RiskEngine(**limits)
+    orders = managed(engine)
+    # no kill switch and no open order limit when only max_notional is set
+    engine.on_position(SYMBOL, 1.0, -1000.0, 1100.0)
+    assert engine.killed is None
+    for order_id in range(20):
+        assert orders.risk.check('BUY', 0.001, 100.0) is None
+        orders.add(order_id, 'BUY', 100.0, 0.001)
+    assert orders.risk.check('BUY', 2.0, 100.0) == NOTIONAL_LIMIT
@@ -0,0 +1,143 @@
+import asyncio
+import multiprocessing as mp
+
+from data_structure.orderbook import TopOfBook, TickScale
+import runtime
+from runtime import SharedTopOfBook, Mailbox, FeedThread, SEQ, parse_cpus, new_event_loop, loop_name
+
+WRITES = 200000
+
+
+def write_books(name, count):
+    # every state keeps bid_qty == bid and ask == bid + 1, a torn read breaks that
+    orderbook = SharedTopOfBook('ETHUSDT', name=name)
+    for i in range(1, count + 1):
+        orderbook.update(i, float(i), float(i), float(i + 1), float(i), i, i)
+    orderbook.close()
+
+
+def test_seqlock_reads_are_consistent():
+    orderbook = SharedTopOfBook('ETHUSDT')
+    try:
+        writer = mp.Process(target=write_books, args=(orderbook.name, WRITES))
+        writer.start()
+        reads, last = 0, -1
+        while writer.is_alive() or reads == 0:
+            update_id, bid, bid_qty, ask, ask_qty, event_time, recv_time = orderbook.state
+            if update_id < 0:
+                continue
+            assert bid == bid_qty == ask_qty == ask - 1 == update_id == event_time == recv_time
+            # snapshots never go back in time
+            assert update_id >= last
+            last = update_id
+            reads += 1
+        writer.join()
+        assert orderbook.update_id == WRITES
+    finally:
+        orderbook.close()
+
+
+def test_shared_book_wakes_the_reader_once():
+    reader, writer = mp.Pipe(duplex=False)
+    orderbook = SharedTopOfBook('ETHUSDT', TickScale(0.01, 2))
+    feed = SharedTopOfBook('ETHUSDT', TickScale(0.01, 2), orderbook.name, writer)
+    orderbook.conn = reader
+    try:
+        assert orderbook.state == TopOfBook.EMPTY
+        for update_id in range(1, 4):
+            feed.on_book_ticker({'u': update_id, 'b': '100.01', 'B': '1', 'a': '100.02', 'A': '2'})
+        # stale updates are dropped by the writer as in a TopOfBook
+        assert not feed.on_book_ticker({'u': 2, 'b': '1', 'B': '1', 'a': '2', 'A': '1'})
+        assert orderbook.state[:5] == (3, 10001, 1.0, 10002, 2.0)
+        assert orderbook.prices() == (100.01, 100.02)
+        # a burst of updates is one wake-up until the reader drains it
+        assert reader.recv_bytes() == b'\0' and not reader.poll()
+        orderbook.drain()
+        feed.update(4, 10003, 1.0, 10004, 1.0)
+        assert reader.poll()
+    finally:
+        feed.close()
+        orderbook.close()
+
+
+def test_torn_write_reads_empty(monkeypatch):
+    monkeypatch.setattr(runtime, 'SEQLOCK_SPINS', 100)
+    orderbook = SharedTopOfBook('ETHUSDT')
+    try:
+        orderbook.update(1, 100.0, 1.0, 100.1, 1.0)
+        # a writer that died mid write leaves seq odd
+        orderbook.ints[SEQ] += 1
+        assert orderbook.state == TopOfBook.EMPTY
+        orderbook.ints[SEQ] += 1
+        assert orderbook.update_id == 1
+    finally:
+        orderbook.close()
+
+
+def test_drain_reports_a_closed_pipe():
+    reader, writer = mp.Pipe(duplex=False)
+    orderbook = SharedTopOfBook('ETHUSDT', conn=reader)
+    try:
+        writer.send_bytes(b'\0')
+        assert orderbook.drain()
+        writer.close()
+        assert not orderbook.drain()
+    finally:
+        orderbook.close()
+
+
+class Logger:
+    def __init__(self):
+        self.errors = []
+
+    def error_nowait(self, message):
+        self.errors.append(message)
+
+
+class Error:
+    status = False
+    message = ''
+
+
+def test_failing_feed_thread_stops_the_strategy():
+    async def feed(loop):
+        await asyncio.sleep(0.01)
+        raise OSError('socket gone')
+
+    async def strategy(err):
+        # stands in for the strategy tasks polling err
+        while not err.status:
+            await asyncio.sleep(0.01)
+        return err.message
+
+    async def run_feed():
+        err, logger = Error(), Logger()
+        thread = FeedThread(feed, err=err, logger=logger).start()
+        message, _ = await asyncio.wait_for(asyncio.gather(strategy(err), thread.wait()), 5)
+        return thread, message, logger
+    thread, message, logger = asyncio.run(run_feed())
+    assert isinstance(thread.error, OSError)
+    assert 'socket gone' in message
+    assert len(logger.errors) == 1 and 'socket gone' in logger.errors[0]
+
+
+def test_mailbox_coalesces_notifications():
+    async def burst():
+        updates = []
+        mailbox = Mailbox(asyncio.get_running_loop(), lambda: updates.append(1))
+        for _ in range(5):
+            mailbox.notify()
+        await asyncio.sleep(0)
+        mailbox.on_book()
+        await asyncio.sleep(0)
+        return updates
+    assert asyncio.run(burst()) == [1, 1]
+
+
+def test_parse_cpus_and_loops():
+    assert parse_cpus('0,2-4, 7') == {0, 2, 3, 4, 7}
+    assert parse_cpus([1, '2']) == {1, 2}
+    assert parse_cpus(None) == set() and parse_cpus('') == set()
+    loop = new_event_loop('asyncio')
+    assert loop_name(loop) == 'asyncio'
+    loop.close()
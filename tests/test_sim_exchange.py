@@ -0,0 +1,59 @@
+import glob
+import asyncio
+from binance import BinanceSocketManager
+from binance.client import BaseClient
+
+from conftest import free_port
+from sim_exchange import SimExchange, symbol_info, synthetic_ticks, bot_urls, point_binance
+from simple_strat import run_strat
+
+SYMBOL = 'ETHUSDT'
+TIMEOUT = 30
+
+
+def read_logs():
+    text = ''
+    for path in glob.glob('logs/simple_strat/{}_*.log'.format(SYMBOL)):
+        with open(path) as f:
+            text += f.read()
+    return text
+
+
+async def run_against_sim(port):
+    info = symbol_info(SYMBOL, 0.01, 0.001)
+    sim = await SimExchange([info]).start('127.0.0.1', port)
+    urls = bot_urls('127.0.0.1', port)
+    bot = asyncio.ensure_future(run_strat(
+        SYMBOL, 'bot', 'secret', urls['url'], 10, 1, futures_url=urls['futures_url'],
+        stream_url=urls['stream_url'], indicator_interval=None, event_quoting=True, journal_folder=None))
+    feed = asyncio.ensure_future(sim.feed(SYMBOL, synthetic_ticks(info, 100.0, rate=500), speed=1))
+    try:
+        deadline = asyncio.get_running_loop().time() + TIMEOUT
+        logs = ''
+        while asyncio.get_running_loop().time() < deadline and not bot.done():
+            await asyncio.sleep(0.5)
+            logs = read_logs()
+            if 'Take profit order' in logs and 'Stoploss order' in logs:
+                break
+        return logs, sim.stats()
+    finally:
+        for task in (feed, bot):
+            task.cancel()
+        await asyncio.gather(feed, bot, return_exceptions=True)
+        await sim.close()
+
+
+def test_fill_sends_bracket_orders(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # point_binance rewrites class attributes, restore them afterwards
+    monkeypatch.setattr(BaseClient, 'FUTURES_URL', BaseClient.FUTURES_URL)
+    monkeypatch.setattr(BinanceSocketManager, 'STREAM_URL', BinanceSocketManager.STREAM_URL)
+    monkeypatch.setattr(BinanceSocketManager, 'FSTREAM_URL', BinanceSocketManager.FSTREAM_URL)
+    port = free_port()
+    point_binance('127.0.0.1', port)
+
+    logs, stats = asyncio.run(run_against_sim(port))
+    assert 'Regular Order Filled' in logs
+    assert 'Take profit order' in logs
+    assert 'Stoploss order' in logs
+    assert stats['fills'] > 0
@@ -0,0 +1,75 @@
+import os
+import json
+import asyncio
+
+from rate_limiter import RateLimiter
+from symbol_cache import SymbolCache, SymbolInfo, decimals
+
+EXCHANGE_INFO = {'symbols': [{
+    'symbol': 'ETHUSDT',
+    'quantityPrecision': 3,
+    'filters': [
+        {'filterType': 'PRICE_FILTER', 'tickSize': '0.01'},
+        {'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001'},
+        {'filterType': 'MIN_NOTIONAL', 'notional': '20'},
+    ],
+}, {
+    'symbol': 'BTCUSDT',
+    'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.10'}, {'filterType': 'LOT_SIZE', 'stepSize': '1'}],
+}]}
+
+
+class Client:
+    def __init__(self):
+        self.calls = 0
+
+    async def futures_exchange_info(self):
+        self.calls += 1
+        return EXCHANGE_INFO
+
+
+def test_parse_filters():
+    assert decimals('0.01000000') == 2 and decimals('1') == 0 and decimals('1.0') == 0
+    eth = SymbolInfo.from_exchange_info(EXCHANGE_INFO['symbols'][0])
+    assert eth.to_list() == ['ETHUSDT', 0.01, 0.001, 0.001, 20.0, 2, 3]
+    btc = SymbolInfo.from_exchange_info(EXCHANGE_INFO['symbols'][1])
+    assert (btc.price_precision, btc.quantity_precision, btc.min_notional) == (1, 0, 0.0)
+
+
+def test_ttl_and_shared_file(tmp_path):
+    path = str(tmp_path / 'cache' / 'exchange_info.json')
+    client, limiter = Client(), RateLimiter()
+    cache = asyncio.run(SymbolCache(path, ttl=60).ensure(client, limiter))
+    assert client.calls == 1 and cache.get('ETHUSDT').tick_size == 0.01
+    # the file is complete, no temporary file is left behind
+    assert os.listdir(os.path.dirname(path)) == ['exchange_info.json']
+
+    # another process reads the fresh file instead of downloading it
+    other = asyncio.run(SymbolCache(path, ttl=60).ensure(client, limiter))
+    assert client.calls == 1 and 'BTCUSDT' in other and other.fresh()
+
+    # a stale file is served while it refreshes in the background
+    with open(path) as f:
+        cache = json.load(f)
+    cache['time'] -= 61
+    with open(path, 'w') as f:
+        json.dump(cache, f)
+    os.utime(path, (1, 1))
+
+    async def stale():
+        cache = await SymbolCache(path, ttl=60).ensure(client, limiter)
+        assert not cache.fresh() and cache.get('ETHUSDT') is not None
+        assert await cache.refreshing
+        return cache
+    cache = asyncio.run(stale())
+    assert client.calls == 2 and cache.fresh()
+
+
+def test_unreadable_file_keeps_entries(tmp_path):
+    path = str(tmp_path / 'exchange_info.json')
+    cache = SymbolCache(path)
+    cache.update(EXCHANGE_INFO)
+    with open(path, 'w') as f:
+        f.write('{"time": ')
+    os.utime(path, (2, 2))
+    assert cache.load() and cache.get('ETHUSDT') is not None